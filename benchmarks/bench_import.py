@@ -0,0 +1,67 @@
+"""
+Benchmark the time taken by ``import pymesync``
+
+Runs ``python -X importtime -c "import pymesync"`` several times in fresh
+interpreters and prints the median cumulative import time. Exits with status
+1 if a module that should load lazily was imported, or if the median is over
+the budget. Run from the repository root (needs Python 3.7+):
+
+    python benchmarks/bench_import.py [runs] [budget_ms]
+"""
+
+from __future__ import print_function
+
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+# Modules pymesync loads on first use rather than at import
+LAZY_MODULES = ("requests", "bcrypt", "ast", "multiprocessing.pool",
+                "pymesync.mock_pymesync")
+
+LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def import_times():
+    """Returns a dict of module name to cumulative import time in us for one
+    fresh ``import pymesync``"""
+    output = subprocess.check_output(
+        [sys.executable, "-X", "importtime", "-c", "import pymesync"],
+        stderr=subprocess.STDOUT, cwd=ROOT).decode("utf-8")
+    times = {}
+    for line in output.splitlines():
+        match = LINE.match(line)
+        if match:
+            times[match.group(4)] = int(match.group(2))
+    return times
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 9
+    budget = float(sys.argv[2]) if len(sys.argv) > 2 else 100.0
+
+    samples = []
+    loaded = set()
+    for _ in range(runs):
+        times = import_times()
+        samples.append(times["pymesync"] / 1000.0)
+        loaded.update(name for name in LAZY_MODULES if name in times)
+
+    median = sorted(samples)[len(samples) // 2]
+    print("import pymesync {0:>8.1f} ms (median of {1})".format(median, runs))
+
+    failed = False
+    if loaded:
+        print("imported eagerly: {}".format(", ".join(sorted(loaded))))
+        failed = True
+    if median > budget:
+        print("over the {:.1f} ms budget".format(budget))
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+"""
+Benchmark pymesync.validators
+
+Prints how many objects per second validate_many() checks for each object
+type. Run from the repository root:
+
+    python benchmarks/bench_validators.py [count]
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from pymesync import validators  # noqa flake8 ignore
+
+OBJECTS = {
+    "time": {
+        "duration": 1200,
+        "project": "ganeti-web-manager",
+        "user": "example-user",
+        "activities": ["docs"],
+        "notes": "Worked on docs",
+        "issue_uri": "https://github.com/",
+        "date_worked": "2014-04-17",
+    },
+    "project": {
+        "name": "TimeSync API",
+        "slugs": ["timesync", "time"],
+        "users": {"tschuy": {"member": True, "manager": True}},
+    },
+    "activity": {
+        "name": "Quality Assurance/Testing",
+        "slug": "qa",
+    },
+    "user": {
+        "username": "example",
+        "password": "password",
+        "site_admin": False,
+    },
+}
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    for name, obj in sorted(OBJECTS.items()):
+        batch = [dict(obj) for _ in range(count)]
+        seconds = min(timeit.repeat(
+            lambda: validators.validate_many(batch, name), number=1, repeat=3))
+        print("{0:<10} {1:>12,.0f} objects/sec".format(name, count / seconds))
+
+
+if __name__ == "__main__":
+    main()
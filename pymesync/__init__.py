@@ -1 +1,3 @@
 from .pymesync import TimeSync  # noqa flake8 ignore
+from .query import Query  # noqa flake8 ignore
+from .clients import ClientManager  # noqa flake8 ignore
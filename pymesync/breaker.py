@@ -0,0 +1,134 @@
+"""
+pymesync.breaker - Circuit breakers that stop sending requests to a failing
+TimeSync endpoint
+
+- CircuitBreaker - Failure-rate circuit breaker with half-open probing
+- Rejection - Stands in for the response of a request the breaker refused
+- is_rejection(message) - Whether an error message is a breaker's refusal
+"""
+
+from __future__ import unicode_literals
+
+import collections
+import threading
+import time
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+# Start of the error message of every refused request
+REJECTED = "circuit breaker open for "
+
+
+class Rejection(object):
+    """Returned instead of a response when a breaker refuses a request"""
+
+    def __init__(self, message):
+        self.message = message
+
+
+def is_rejection(message):
+    """Returns True if ``message`` is the error of a request a breaker
+    refused"""
+    return hasattr(message, "startswith") and message.startswith(REJECTED)
+
+
+class CircuitBreaker(object):
+    """Tracks the outcome of the last ``window`` requests to one endpoint.
+
+    While closed, every request is allowed. Once at least ``min_requests``
+    outcomes are recorded and the share of failures reaches
+    ``failure_rate``, the breaker opens and refuses every request for
+    ``reset_timeout`` seconds. It then turns half-open and lets up to
+    ``half_open_requests`` probe requests through at a time: a successful
+    probe closes it again, a failed one re-opens it."""
+
+    def __init__(self, failure_rate=0.5, window=20, min_requests=10,
+                 reset_timeout=30.0, half_open_requests=1):
+        self.failure_rate = failure_rate
+        self.min_requests = min_requests
+        self.reset_timeout = reset_timeout
+        self.half_open_requests = half_open_requests
+
+        self.__lock = threading.Lock()
+        self.__outcomes = collections.deque(maxlen=window)
+        self.__state = CLOSED
+        self.__opened_at = 0
+        self.__probes = 0
+        self.__counts = {"successes": 0, "failures": 0, "rejected": 0,
+                         "opened": 0}
+
+    def allow(self):
+        """Returns True if a request may be sent now. Every allowed request
+        must be followed by a call to record()"""
+        with self.__lock:
+            self.__check_reset()
+            if self.__state == OPEN or (
+                    self.__state == HALF_OPEN and
+                    self.__probes >= self.half_open_requests):
+                self.__counts["rejected"] += 1
+                return False
+            if self.__state == HALF_OPEN:
+                self.__probes += 1
+            return True
+
+    def record(self, success):
+        """Record the outcome of an allowed request"""
+        with self.__lock:
+            self.__counts["successes" if success else "failures"] += 1
+
+            if self.__state == HALF_OPEN:
+                self.__probes = max(self.__probes - 1, 0)
+                if success:
+                    self.__state = CLOSED
+                    self.__outcomes.clear()
+                else:
+                    self.__open()
+            elif self.__state == CLOSED:
+                self.__outcomes.append(success)
+                failures = self.__outcomes.count(False)
+                if len(self.__outcomes) >= self.min_requests and (
+                        failures >= self.failure_rate * len(self.__outcomes)):
+                    self.__open()
+
+    def state(self):
+        """Returns "closed", "open" or "half-open\""""
+        with self.__lock:
+            self.__check_reset()
+            return self.__state
+
+    def retry_after(self):
+        """Returns the seconds until an open breaker allows a probe"""
+        with self.__lock:
+            if self.__state != OPEN:
+                return 0
+            return max(self.__opened_at + self.reset_timeout - time.time(), 0)
+
+    def metrics(self):
+        """Returns the state, the failure rate over the window and the
+        success, failure, rejected and opened counts"""
+        with self.__lock:
+            self.__check_reset()
+            metrics = dict(self.__counts)
+            metrics["state"] = self.__state
+            metrics["failure_rate"] = (
+                float(self.__outcomes.count(False)) / len(self.__outcomes)
+                if self.__outcomes else 0.0)
+            return metrics
+
+    def __open(self):
+        """Caller holds the lock"""
+        self.__state = OPEN
+        self.__opened_at = time.time()
+        self.__outcomes.clear()
+        self.__counts["opened"] += 1
+
+    def __check_reset(self):
+        """Turn an open breaker half-open once reset_timeout has passed.
+        Caller holds the lock"""
+        if self.__state == OPEN and (
+                time.time() - self.__opened_at >= self.reset_timeout):
+            self.__state = HALF_OPEN
+            self.__probes = 0
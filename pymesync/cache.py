@@ -0,0 +1,672 @@
+"""
+pymesync.cache - Caching for TimeSync reads
+
+- ReadCache - TTL cache with stale-while-revalidate and stale-if-error
+- NegativeCache - Remembers lookups that found nothing, for a short time
+- MemoryBackend - Stores cache entries in this process
+- SQLiteBackend - Stores cache entries in a file shared by every process on
+  the host
+- TieredBackend - Keeps recently used entries in memory under a byte budget
+  and the rest compressed on disk
+- backend_from_url(url) - Creates a backend from a url such as
+  "sqlite:///var/cache/pymesync.db"
+- BACKENDS - Url schemes mapped to backend classes
+"""
+
+from __future__ import unicode_literals
+
+import collections
+import copy
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import zlib
+
+from six.moves.urllib import parse
+
+from . import files
+from . import lazy
+
+# Loaded on first use; only the SQLite and lzma compressed backends need them
+lzma = lazy.LazyModule("lzma")
+sqlite3 = lazy.LazyModule("sqlite3")
+
+
+class NegativeCache(object):
+    """Remembers the "not found" results of lookups by key for ``ttl``
+    seconds, keeping at most ``max_entries`` of them. Discard a key as soon
+    as the thing it names is created."""
+
+    def __init__(self, ttl=30, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.__lock = threading.Lock()
+        self.__entries = collections.OrderedDict()
+        self.__counts = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get(self, key):
+        """Returns the remembered result for ``key``, or None"""
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None and entry[1] <= time.time():
+                del self.__entries[key]
+                entry = None
+            self.__counts["misses" if entry is None else "hits"] += 1
+        return None if entry is None else copy.deepcopy(entry[0])
+
+    def add(self, key, result):
+        """Remember that looking up ``key`` returned ``result``"""
+        result = copy.deepcopy(result)
+        with self.__lock:
+            self.__entries.pop(key, None)
+            self.__entries[key] = (result, time.time() + self.ttl)
+            while len(self.__entries) > self.max_entries:
+                self.__entries.popitem(last=False)
+
+    def discard(self, key):
+        """Forget ``key``, for example because it was just created"""
+        with self.__lock:
+            if self.__entries.pop(key, None) is not None:
+                self.__counts["invalidations"] += 1
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+    def metrics(self):
+        """Returns hit, miss and invalidation counts and the number of keys
+        remembered"""
+        with self.__lock:
+            metrics = dict(self.__counts)
+            metrics["entries"] = len(self.__entries)
+        return metrics
+
+
+class MemoryBackend(object):
+    """Keeps up to ``max_entries`` cache entries in a dict in this process,
+    dropping the least recently used ones first. Values are copied in and
+    out, so callers may modify what they get back.
+
+    Every backend has the same methods: get(key) returns ``(value,
+    stored_at)`` or None once the entry expired, set(key, value, stored_at,
+    expires_at) stores a value, and delete(key), delete_prefix(prefix) and
+    clear() remove entries."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.__lock = threading.Lock()
+        self.__entries = collections.OrderedDict()
+
+    def get(self, key):
+        with self.__lock:
+            entry = self.__entries.pop(key, None)
+            if entry is None:
+                return None
+            value, stored_at, expires_at = entry
+            if expires_at <= time.time():
+                return None
+            # Re-insert to mark it most recently used
+            self.__entries[key] = entry
+        return copy.deepcopy(value), stored_at
+
+    def set(self, key, value, stored_at, expires_at):
+        value = copy.deepcopy(value)
+        with self.__lock:
+            self.__entries.pop(key, None)
+            self.__entries[key] = (value, stored_at, expires_at)
+            while len(self.__entries) > self.max_entries:
+                self.__entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.__lock:
+            self.__entries.pop(key, None)
+
+    def delete_prefix(self, prefix):
+        with self.__lock:
+            for key in [key for key in self.__entries
+                        if key.startswith(prefix)]:
+                del self.__entries[key]
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+    def __len__(self):
+        return len(self.__entries)
+
+
+class SQLiteBackend(object):
+    """Stores cache entries as JSON in the SQLite database at ``path``, so
+    every process on the host using the same file shares one cache. Each
+    set() replaces its entry in a single transaction, so readers in other
+    processes see either the old value or the new one. Expired entries are
+    deleted every ``purge_interval`` sets, and the least recently stored
+    entries are deleted once there are more than ``max_entries``.
+
+    Connections are opened on first use in each process and thread, so a
+    backend created before a server forks its workers is safe to use in
+    all of them."""
+
+    def __init__(self, path, max_entries=10000, purge_interval=100,
+                 timeout=5.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.purge_interval = purge_interval
+        self.timeout = timeout
+        self.__local = threading.local()
+        self.__lock = threading.Lock()
+        self.__sets = 0
+
+    def get(self, key):
+        row = self.__connection().execute(
+            "SELECT value, stored_at FROM entries "
+            "WHERE key = ? AND expires_at > ?",
+            (key, time.time())).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, stored_at, expires_at):
+        data = json.dumps(value, separators=(",", ":"))
+        with self.__connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO entries "
+                "(key, value, stored_at, expires_at) VALUES (?, ?, ?, ?)",
+                (key, data, stored_at, expires_at))
+
+        with self.__lock:
+            self.__sets += 1
+            purge = self.__sets % self.purge_interval == 0
+        if purge:
+            self.purge()
+
+    def delete(self, key):
+        with self.__connection() as connection:
+            connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def delete_prefix(self, prefix):
+        with self.__connection() as connection:
+            connection.execute(
+                "DELETE FROM entries WHERE substr(key, 1, ?) = ?",
+                (len(prefix), prefix))
+
+    def clear(self):
+        with self.__connection() as connection:
+            connection.execute("DELETE FROM entries")
+
+    def purge(self):
+        """Delete expired entries, then the oldest entries over
+        ``max_entries``"""
+        with self.__connection() as connection:
+            connection.execute("DELETE FROM entries WHERE expires_at <= ?",
+                               (time.time(),))
+            connection.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries "
+                "ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,))
+
+    def __len__(self):
+        return self.__connection().execute(
+            "SELECT COUNT(*) FROM entries WHERE expires_at > ?",
+            (time.time(),)).fetchone()[0]
+
+    def __connection(self):
+        """Returns this thread's connection, opening a new one after a
+        fork"""
+        local = self.__local
+        if getattr(local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout)
+            # Readers don't block the writer, or each other
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, "
+                "value TEXT NOT NULL, stored_at REAL NOT NULL, "
+                "expires_at REAL NOT NULL)")
+            connection.commit()
+            local.connection = connection
+            local.pid = os.getpid()
+        return local.connection
+
+
+class TieredBackend(object):
+    """Keeps cache entries decoded in memory while they fit in
+    ``memory_bytes`` and compressed in files in the directory ``path`` while
+    they fit in ``disk_bytes``. An entry's size is the length of its JSON
+    encoding.
+
+    When the memory tier is over its budget the least recently used entries
+    move to disk, and an entry read from disk is copied back to memory;
+    entries larger than the whole memory budget stay on disk. When the disk
+    tier is over its budget expired entries are deleted first, then the
+    least recently used. Files are compressed with ``compression``, "zlib"
+    or "lzma", and compressed and written without holding the lock, so
+    other entries can be read meanwhile. Entries left in ``path`` by an
+    earlier process are used again.
+    """
+
+    def __init__(self, path, memory_bytes=64 * 1024 * 1024,
+                 disk_bytes=1024 * 1024 * 1024, compression="zlib"):
+        if compression not in ("zlib", "lzma"):
+            raise ValueError("Unknown compression {}".format(compression))
+        self.path = path
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.compression = compression
+
+        self.__lock = threading.Lock()
+        # key: (value, stored_at, expires_at, size), least recent first
+        self.__memory = collections.OrderedDict()
+        self.__memory_used = 0
+        # key: (file name, stored_at, expires_at, compressed size)
+        self.__disk = collections.OrderedDict()
+        self.__disk_used = 0
+        # key: memory tier entry being written to disk
+        self.__spilling = {}
+        self.__counts = {"memory_hits": 0, "disk_hits": 0, "misses": 0,
+                         "evictions": 0}
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.__load_index()
+
+    def get(self, key):
+        now = time.time()
+        with self.__lock:
+            entry = self.__memory.pop(key, None)
+            if entry is not None:
+                if entry[2] > now:
+                    self.__memory[key] = entry
+                    self.__counts["memory_hits"] += 1
+                    return copy.deepcopy(entry[0]), entry[1]
+                self.__memory_used -= entry[3]
+
+            entry = self.__spilling.get(key)
+            if entry is not None and entry[2] > now:
+                self.__counts["memory_hits"] += 1
+                return copy.deepcopy(entry[0]), entry[1]
+
+            location = self.__disk.get(key)
+            if location is None or location[2] <= now:
+                self.__counts["misses"] += 1
+                return None
+            self.__disk.pop(key)
+            self.__disk[key] = location
+
+        # Decompress outside the lock; other keys stay available meanwhile
+        try:
+            header, value = self.__read(location[0])
+        except (IOError, OSError, ValueError, zlib.error):
+            with self.__lock:
+                self.__counts["misses"] += 1
+            return None
+
+        spills = []
+        with self.__lock:
+            self.__counts["disk_hits"] += 1
+            if (key not in self.__memory and self.__disk.get(key) == location
+                    and header["size"] <= self.memory_bytes):
+                spills = self.__remember(key, copy.deepcopy(value),
+                                         location[1], location[2],
+                                         header["size"])
+        self.__spill(spills)
+        return value, location[1]
+
+    def set(self, key, value, stored_at, expires_at):
+        size = self.__size(value)
+        value = copy.deepcopy(value)
+        with self.__lock:
+            self.__forget(key)
+            if size > self.memory_bytes:
+                entry = (value, stored_at, expires_at, size)
+                self.__spilling[key] = entry
+                spills = [(key, entry)]
+            else:
+                spills = self.__remember(key, value, stored_at, expires_at,
+                                         size)
+        self.__spill(spills)
+
+    def delete(self, key):
+        with self.__lock:
+            self.__forget(key)
+
+    def delete_prefix(self, prefix):
+        with self.__lock:
+            for key in self.__keys():
+                if key.startswith(prefix):
+                    self.__forget(key)
+
+    def clear(self):
+        with self.__lock:
+            for key in self.__keys():
+                self.__forget(key)
+
+    def metrics(self):
+        """Returns memory hit, disk hit, miss and eviction counts, the hit
+        rate, and the entries and bytes held by each tier"""
+        with self.__lock:
+            metrics = dict(self.__counts)
+            metrics["memory_entries"] = len(self.__memory)
+            metrics["memory_bytes"] = self.__memory_used
+            metrics["disk_entries"] = len(self.__disk)
+            metrics["disk_bytes"] = self.__disk_used
+        lookups = (metrics["memory_hits"] + metrics["disk_hits"] +
+                   metrics["misses"])
+        metrics["hit_rate"] = (float(lookups - metrics["misses"]) / lookups
+                               if lookups else 0.0)
+        return metrics
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__keys())
+
+    def __keys(self):
+        """Returns every key in either tier or being moved to disk. Caller
+        holds the lock"""
+        return set(self.__memory) | set(self.__disk) | set(self.__spilling)
+
+    def __size(self, value):
+        return len(json.dumps(value, separators=(",", ":")))
+
+    def __remember(self, key, value, stored_at, expires_at, size):
+        """Put an entry in the memory tier, marking the least recently used
+        entries to move to disk. Returns the ``(key, entry)`` pairs to pass
+        to __spill() once the lock is released. Caller holds the lock"""
+        self.__memory[key] = (value, stored_at, expires_at, size)
+        self.__memory_used += size
+        now = time.time()
+        spills = []
+        while self.__memory_used > self.memory_bytes:
+            old_key, old = self.__memory.popitem(last=False)
+            self.__memory_used -= old[3]
+            if old[2] > now and old_key not in self.__disk:
+                self.__spilling[old_key] = old
+                spills.append((old_key, old))
+        return spills
+
+    def __spill(self, spills):
+        """Compress and write each of ``spills``, the ``(key, entry)`` pairs
+        marked by set() or __remember(), to a temporary file without
+        holding the lock, then move it into the disk tier unless the key
+        was set or deleted meanwhile"""
+        for key, entry in spills:
+            name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+            file_path = os.path.join(self.path, name)
+            tmp_path = "{0}.{1}-{2}.tmp".format(
+                file_path, os.getpid(), threading.current_thread().ident)
+            try:
+                size = self.__write(tmp_path, key, entry)
+            except (IOError, OSError):
+                size = None
+
+            with self.__lock:
+                if self.__spilling.get(key) is not entry or size is None:
+                    self.__remove(tmp_path)
+                    if self.__spilling.get(key) is entry:
+                        # Couldn't write it; the entry is dropped
+                        del self.__spilling[key]
+                    continue
+                del self.__spilling[key]
+                files.replace(tmp_path, file_path)
+                self.__disk[key] = (name, entry[1], entry[2], size)
+                self.__disk_used += size
+                self.__evict_disk()
+
+    def __write(self, tmp_path, key, entry):
+        """Write the memory tier ``entry`` for ``key`` to the file
+        ``tmp_path``. Returns its size"""
+        value, stored_at, expires_at, _ = entry
+        body = json.dumps(value, separators=(",", ":")).encode("utf-8")
+        header = json.dumps({"key": key, "stored_at": stored_at,
+                             "expires_at": expires_at, "size": len(body),
+                             "compression": self.compression})
+        body = (zlib.compress(body) if self.compression == "zlib"
+                else lzma.compress(body))
+        data = header.encode("utf-8") + b"\n" + body
+        with io.open(tmp_path, "wb") as handle:
+            handle.write(data)
+        return len(data)
+
+    def __evict_disk(self):
+        """Delete expired, then least recently used, files until the disk
+        tier is within budget. Caller holds the lock"""
+        if self.__disk_used <= self.disk_bytes:
+            return
+        now = time.time()
+        expired = [key for key, location in self.__disk.items()
+                   if location[2] <= now]
+        keys = iter(expired + list(self.__disk))
+        while self.__disk_used > self.disk_bytes:
+            key = next(keys)
+            if key in self.__disk:
+                self.__unlink(key)
+                self.__counts["evictions"] += 1
+
+    def __forget(self, key):
+        """Remove ``key`` from both tiers. Caller holds the lock"""
+        entry = self.__memory.pop(key, None)
+        if entry is not None:
+            self.__memory_used -= entry[3]
+        # A write in progress is discarded when it finishes
+        self.__spilling.pop(key, None)
+        if key in self.__disk:
+            self.__unlink(key)
+
+    def __unlink(self, key):
+        name, _, _, size = self.__disk.pop(key)
+        self.__disk_used -= size
+        self.__remove(os.path.join(self.path, name))
+
+    def __remove(self, file_path):
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+
+    def __read(self, name):
+        """Returns the header and value stored in the file ``name``"""
+        with io.open(os.path.join(self.path, name), "rb") as handle:
+            data = handle.read()
+        header, body = data.split(b"\n", 1)
+        header = json.loads(header.decode("utf-8"))
+        body = (zlib.decompress(body) if header["compression"] == "zlib"
+                else lzma.decompress(body))
+        return header, json.loads(body.decode("utf-8"))
+
+    def __load_index(self):
+        """Index the entries left in ``path``, least recently written
+        first, deleting expired and unreadable ones"""
+        now = time.time()
+        found = []
+        for name in os.listdir(self.path):
+            file_path = os.path.join(self.path, name)
+            if len(name) != 40:
+                continue
+            try:
+                with io.open(file_path, "rb") as handle:
+                    header = json.loads(handle.readline().decode("utf-8"))
+                found.append((os.path.getmtime(file_path), name, header,
+                              os.path.getsize(file_path)))
+            except (IOError, OSError, ValueError):
+                continue
+
+        for _, name, header, size in sorted(found):
+            if header["expires_at"] <= now:
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except OSError:
+                    pass
+                continue
+            self.__disk[header["key"]] = (name, header["stored_at"],
+                                          header["expires_at"], size)
+            self.__disk_used += size
+        self.__evict_disk()
+
+
+BACKENDS = {
+    "memory": MemoryBackend,
+    "sqlite": SQLiteBackend,
+    "tiered": TieredBackend,
+}
+
+
+def backend_from_url(url):
+    """Returns the backend described by ``url``: "memory" or
+    "memory://?max_entries=512" for a MemoryBackend, or
+    "sqlite:///path/to/cache.db" for a SQLiteBackend, or
+    "tiered:///path/to/directory?compression=lzma" for a TieredBackend.
+    Query parameters are passed to the backend as keyword arguments, as
+    numbers where they look like numbers. Other schemes can be added to
+    BACKENDS; their classes are called with ``path`` (when the url has one)
+    and the query parameters."""
+    parts = parse.urlparse(url if "://" in url else "{}://".format(url))
+    if parts.scheme not in BACKENDS:
+        raise ValueError("Unknown cache backend {}".format(url))
+
+    options = dict((name, _option(value))
+                   for name, value in parse.parse_qsl(parts.query))
+    path = parts.netloc + parts.path
+    if path:
+        options["path"] = path
+    return BACKENDS[parts.scheme](**options)
+
+
+class ReadCache(object):
+    """Caches the results of read calls by key in ``backend``.
+
+    A result is fresh for ``ttl`` seconds. For ``stale_while_revalidate``
+    seconds after that the cached result is still returned straight away
+    while one background thread fetches a new one. If fetching fails
+    transiently (it raises, or ``is_transient(result)`` is true) a cached
+    result up to ``stale_if_error`` seconds past its ttl is returned instead
+    of the error. Other errors (``is_error(result)`` is true) are definitive
+    answers, such as "not found" or "forbidden": they are returned and the
+    cached result is dropped. Errors are never cached. ``is_transient``
+    defaults to ``is_error``."""
+
+    def __init__(self, backend=None, ttl=60, stale_while_revalidate=60,
+                 stale_if_error=3600, is_error=None, is_transient=None):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.ttl = ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self.stale_if_error = stale_if_error
+        self.is_error = is_error or (lambda result: False)
+        self.is_transient = is_transient or self.is_error
+
+        self.__lock = threading.Lock()
+        self.__refreshing = set()
+        self.__counts = {"hits": 0, "stale_hits": 0, "misses": 0,
+                         "stale_errors": 0, "refreshes": 0}
+
+    def get(self, key, fetch):
+        """Returns the cached result for ``key``, calling ``fetch()`` when
+        there is no usable one"""
+        entry = self.backend.get(key)
+        age = time.time() - entry[1] if entry is not None else None
+
+        if entry is not None and age < self.ttl:
+            self.__count("hits")
+            return entry[0]
+
+        if entry is not None and (
+                age < self.ttl + self.stale_while_revalidate):
+            self.__count("stale_hits")
+            self.__refresh(key, fetch)
+            return entry[0]
+
+        self.__count("misses")
+        usable = entry is not None and age < self.ttl + self.stale_if_error
+        try:
+            result = fetch()
+        except Exception:
+            if usable:
+                self.__count("stale_errors")
+                return entry[0]
+            raise
+
+        if self.is_error(result):
+            if not self.is_transient(result):
+                self.invalidate(key)
+            elif usable:
+                self.__count("stale_errors")
+                return entry[0]
+            return result
+
+        self.set(key, result)
+        return result
+
+    def set(self, key, result):
+        """Store ``result`` for ``key``"""
+        now = time.time()
+        self.backend.set(key, result, now, now + self.ttl + max(
+            self.stale_while_revalidate, self.stale_if_error))
+
+    def invalidate(self, key):
+        """Forget the cached result for ``key``"""
+        self.backend.delete(key)
+
+    def invalidate_prefix(self, prefix):
+        """Forget the cached results for every key starting with
+        ``prefix``"""
+        self.backend.delete_prefix(prefix)
+
+    def clear(self):
+        """Forget every cached result"""
+        self.backend.clear()
+
+    def metrics(self):
+        """Returns hit, stale hit, miss, stale-on-error and background
+        refresh counts and the hit rate (fresh and stale hits over all
+        lookups), plus the backend's own metrics under "backend" if it has
+        any"""
+        with self.__lock:
+            metrics = dict(self.__counts)
+        lookups = metrics["hits"] + metrics["stale_hits"] + metrics["misses"]
+        metrics["hit_rate"] = (float(lookups - metrics["misses"]) / lookups
+                               if lookups else 0.0)
+        if hasattr(self.backend, "metrics"):
+            metrics["backend"] = self.backend.metrics()
+        return metrics
+
+    def __count(self, name):
+        with self.__lock:
+            self.__counts[name] += 1
+
+    def __refresh(self, key, fetch):
+        """Fetch ``key`` again in a background thread unless one already
+        is"""
+        with self.__lock:
+            if key in self.__refreshing:
+                return
+            self.__refreshing.add(key)
+            self.__counts["refreshes"] += 1
+
+        def refresh():
+            try:
+                result = fetch()
+                if not self.is_error(result):
+                    self.set(key, result)
+                elif not self.is_transient(result):
+                    self.invalidate(key)
+            except Exception:
+                # Keep serving the stale result; the next lookup retries
+                pass
+            finally:
+                with self.__lock:
+                    self.__refreshing.discard(key)
+
+        thread = threading.Thread(target=refresh, name="pymesync-refresh")
+        thread.daemon = True
+        thread.start()
+
+
+def _option(value):
+    """Converts a url query parameter to an int or float if it is one"""
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    return value
@@ -0,0 +1,396 @@
+"""
+pymesync.cli - Command line tools for TimeSync
+
+- pymesync import FILE - Stream time entries from a CSV or JSONL file to
+  TimeSync in concurrent batches, resuming from a checkpoint
+- pymesync export FILE - Stream time entries from TimeSync to a JSONL, CSV or
+  columnar file in date range shards, resuming from a checkpoint
+
+Connection options may also be set with the PYMESYNC_BASEURL,
+PYMESYNC_USERNAME, PYMESYNC_PASSWORD, PYMESYNC_AUTH_TYPE, PYMESYNC_TOKEN and
+PYMESYNC_TOKEN_CACHE environment variables.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import csv
+import datetime
+import io
+import itertools
+import json
+import os
+import sys
+import time
+
+import six
+
+from . import export
+from . import files
+from . import writebehind
+from .pymesync import TimeSync
+
+
+def is_error(result, error_key="pymesync error"):
+    """Returns True if ``result`` is a pymesync or TimeSync error dict"""
+    return not isinstance(result, dict) or error_key in result or (
+        "error" in result)
+
+
+def read_csv(path):
+    """Yield each row of the CSV file at ``path`` as a time entry dict. Empty
+    cells are dropped, ``duration`` cells holding only digits become
+    integers and ``activities`` cells are split on commas"""
+    if six.PY2:
+        handle = open(path, "rb")
+    else:
+        handle = io.open(path, "r", encoding="utf-8", newline="")
+
+    with handle:
+        for row in csv.DictReader(handle):
+            entry = {}
+            for key, value in row.items():
+                if six.PY2:
+                    key = key.decode("utf-8")
+                    value = value.decode("utf-8") if value else value
+                value = value.strip() if value else value
+                if not key or not value:
+                    continue
+                if key == "activities":
+                    value = [slug.strip() for slug in value.split(",")
+                             if slug.strip()]
+                elif key == "duration" and value.isdigit():
+                    value = int(value)
+                entry[key] = value
+            yield entry
+
+
+def read_jsonl(path):
+    """Yield each non-blank line of the JSONL file at ``path`` as a dict"""
+    with io.open(path, "r", encoding="utf-8") as handle:
+        for line in handle:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_rows(path, file_format=None):
+    """Yield time entries from ``path``. ``file_format`` is "csv" or "jsonl";
+    if it is None, it is guessed from the file extension"""
+    if file_format is None:
+        file_format = "csv" if path.lower().endswith(".csv") else "jsonl"
+    return read_csv(path) if file_format == "csv" else read_jsonl(path)
+
+
+def load_checkpoint(path, source):
+    """Returns the state saved in the checkpoint file at ``path`` for the
+    file ``source``, or an empty dict"""
+    if not path or not os.path.exists(path):
+        return {}
+    with io.open(path, "r", encoding="utf-8") as handle:
+        checkpoint = json.load(handle)
+    if checkpoint.pop("source", None) != os.path.abspath(source):
+        return {}
+    return checkpoint
+
+
+def save_checkpoint(path, source, state):
+    """Atomically replace the checkpoint file at ``path`` with ``state`` (a
+    dict) for the file ``source``"""
+    if not path:
+        return
+    checkpoint = dict(state, source=os.path.abspath(source))
+    tmp_path = "{}.tmp".format(path)
+    with io.open(tmp_path, "w", encoding="utf-8") as handle:
+        handle.write(six.text_type(json.dumps(checkpoint)))
+    files.replace(tmp_path, path)
+
+
+def import_times(ts, path, file_format=None, batch_size=500, workers=8,
+                 checkpoint=None, out=sys.stderr):
+    """Stream the time entries in ``path`` to TimeSync with
+    TimeSync.create_times() in batches of ``batch_size``. After each batch the
+    number of committed rows is saved to ``checkpoint`` so an interrupted
+    import can resume where it stopped. A row that failed transiently (see
+    writebehind.is_transient()) is not committed: the checkpoint stops
+    before it and the import stops after its batch, so resuming sends it
+    again. Rows after it in its batch, and rows of a batch that was
+    interrupted, are read again on resume, so pass a TimeSync with
+    enable_idempotency() on to avoid creating them twice. Progress and
+    failed rows are written to ``out``. No new batch is started once the
+    deadline set with TimeSync.deadline() has passed. Returns a dict with
+    "rows", "created", "failed", "skipped" and "seconds" keys, and
+    "stopped" if the deadline was reached or a row failed transiently"""
+    skipped = load_checkpoint(checkpoint, path).get("rows", 0)
+    rows = itertools.islice(read_rows(path, file_format), skipped, None)
+    summary = {"rows": skipped, "created": 0, "failed": 0,
+               "skipped": skipped}
+    started = time.time()
+
+    if skipped:
+        print("resuming after row {}".format(skipped), file=out)
+
+    while True:
+        if ts.deadline_remaining() == 0:
+            summary["stopped"] = True
+            print("deadline reached after row {}".format(summary["rows"]),
+                  file=out)
+            break
+
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+
+        results = ts.create_times(batch, workers=workers)
+        # Rows of the batch the checkpoint can move past
+        committed = len(batch)
+        for offset, result in enumerate(results):
+            if isinstance(result, dict) and result.get("status") == (
+                    "duplicate"):
+                # Submitted by an earlier run, according to the journal
+                summary["skipped"] += 1
+            elif is_error(result, ts.error):
+                summary["failed"] += 1
+                print("row {0}: {1}".format(summary["rows"] + offset + 1,
+                                            json.dumps(result, default=str)),
+                      file=out)
+                if writebehind.is_transient(result, ts.error):
+                    committed = min(committed, offset)
+            else:
+                summary["created"] += 1
+
+        committed += summary["rows"]
+        save_checkpoint(checkpoint, path, {"rows": committed})
+        summary["rows"] += len(batch)
+
+        elapsed = time.time() - started
+        print("{0} rows processed, {1} failed ({2:.1f} entries/sec)".format(
+            summary["rows"], summary["failed"],
+            (summary["rows"] - skipped) / elapsed if elapsed else 0),
+            file=out)
+
+        if checkpoint and committed < summary["rows"]:
+            summary["stopped"] = True
+            print("stopping after row {0}; resuming retries from row "
+                  "{1}".format(summary["rows"], committed + 1), file=out)
+            break
+
+    summary["seconds"] = time.time() - started
+    return summary
+
+
+def export_times(ts, path, start, end, days=7, file_format=None,
+                 query_parameters=None, depth=4, workers=4, checkpoint=None,
+                 out=sys.stderr):
+    """Stream the times from ``start`` to ``end`` to the file at ``path``.
+    The range is fetched in shards of ``days`` days, ``workers`` at a time
+    and at most ``depth`` ahead of the writer, so memory use doesn't grow
+    with the range. After each shard the file size and last exported date are
+    saved to ``checkpoint``; exporting again truncates the file to that size
+    and continues with the next date. A checkpoint saved for a different
+    range, format or query is not used and the file is left alone. Returns
+    a dict with "rows", "shards", "seconds" and, if TimeSync returned an
+    error or the checkpoint doesn't match, "error" keys"""
+    if file_format is None:
+        file_format = "csv" if path.lower().endswith(".csv") else "jsonl"
+
+    # What this export is, so a checkpoint from another one isn't resumed
+    export_state = json.loads(json.dumps({
+        "start": start, "end": end, "format": file_format,
+        "query": dict(query_parameters or {})}, default=str))
+    state = load_checkpoint(checkpoint, path)
+    size = 0
+    if state and state.get("export") != export_state:
+        error = {ts.error: "checkpoint {} was saved for a different export; "
+                           "remove it to start again".format(checkpoint)}
+        print(json.dumps(error), file=out)
+        return {"rows": 0, "shards": 0, "seconds": 0, "error": error}
+    if state:
+        size = state["bytes"]
+        start = (datetime.datetime.strptime(state["end"], "%Y-%m-%d") +
+                 datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+        print("resuming after {}".format(state["end"]), file=out)
+
+    summary = {"rows": 0, "shards": 0}
+    started = time.time()
+
+    with io.open(path, "r+b" if size else "wb") as handle:
+        handle.truncate(size)
+        handle.seek(size)
+        writer = export.WRITERS[file_format](handle)
+
+        shards = ts.prefetch_times(start, end, days, query_parameters, depth,
+                                   workers) if start <= end else []
+        for query, times in shards:
+            errors = [entry for entry in times if is_error(entry, ts.error)]
+            if errors:
+                summary["error"] = errors[0]
+                print("{0} to {1}: {2}".format(
+                    query["start"][0], query["end"][0],
+                    json.dumps(errors[0], default=str)), file=out)
+                break
+
+            writer.write(times)
+            handle.flush()
+            save_checkpoint(checkpoint, path, {"end": query["end"][0],
+                                               "bytes": handle.tell(),
+                                               "export": export_state})
+
+            summary["rows"] += len(times)
+            summary["shards"] += 1
+            elapsed = time.time() - started
+            print("{0} exported, {1} rows ({2:.1f} entries/sec)".format(
+                query["end"][0], summary["rows"],
+                summary["rows"] / elapsed if elapsed else 0), file=out)
+
+    summary["seconds"] = time.time() - started
+    return summary
+
+
+def connect(args):
+    """Returns an authenticated TimeSync object for ``args``, or an error
+    dict"""
+    ts = TimeSync(args.baseurl, token=args.token, test=args.test,
+                  timeout=args.timeout)
+    if args.token:
+        return ts
+
+    if args.token_cache:
+        ts.enable_token_cache(args.token_cache)
+    result = ts.authenticate(args.username, args.password, args.auth_type)
+    if is_error(result, ts.error) or "token" not in result:
+        return result
+    return ts
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="pymesync", description="Command line tools for TimeSync")
+    parser.add_argument("--baseurl",
+                        default=os.environ.get("PYMESYNC_BASEURL"),
+                        help="TimeSync url including the version, e.g. "
+                             "http://ts.example.com/v1")
+    parser.add_argument("--username",
+                        default=os.environ.get("PYMESYNC_USERNAME"))
+    parser.add_argument("--password",
+                        default=os.environ.get("PYMESYNC_PASSWORD"))
+    parser.add_argument("--auth-type",
+                        default=os.environ.get("PYMESYNC_AUTH_TYPE",
+                                               "password"))
+    parser.add_argument("--token", default=os.environ.get("PYMESYNC_TOKEN"),
+                        help="use an existing token instead of logging in")
+    parser.add_argument("--token-cache",
+                        default=os.environ.get("PYMESYNC_TOKEN_CACHE"),
+                        help="file sharing login tokens between runs")
+    parser.add_argument("--timeout", type=float,
+                        help="seconds to wait for each TimeSync response")
+    parser.add_argument("--deadline", type=float,
+                        help="stop sending requests after this many seconds")
+    parser.add_argument("--test", action="store_true",
+                        help="use pymesync test mode; nothing is sent")
+    commands = parser.add_subparsers(dest="command")
+
+    importer = commands.add_parser(
+        "import", help="create time entries from a CSV or JSONL file")
+    importer.add_argument("file")
+    importer.add_argument("--format", choices=["csv", "jsonl"],
+                          help="file format (default: from file extension)")
+    importer.add_argument("--batch-size", type=int, default=500)
+    importer.add_argument("--workers", type=int, default=8,
+                          help="concurrent requests per batch")
+    importer.add_argument("--checkpoint",
+                          help="file recording committed rows so an "
+                               "interrupted import can resume (add "
+                               "--journal so rows of an interrupted batch "
+                               "aren't sent twice)")
+    importer.add_argument("--journal",
+                          help="file of submitted entry keys; entries "
+                               "already in it or in TimeSync are skipped, "
+                               "including identical rows of the file")
+    importer.add_argument("--check-references", action="store_true",
+                          help="reject rows naming unknown users, projects "
+                               "or activities without sending them")
+
+    exporter = commands.add_parser(
+        "export", help="write time entries to a JSONL, CSV or columnar file")
+    exporter.add_argument("file")
+    exporter.add_argument("--start", required=True, help="yyyy-mm-dd")
+    exporter.add_argument("--end", required=True, help="yyyy-mm-dd")
+    exporter.add_argument("--format", choices=sorted(export.WRITERS),
+                          help="file format (default: csv for .csv files, "
+                               "otherwise jsonl)")
+    exporter.add_argument("--days", type=int, default=7,
+                          help="days of times per request")
+    exporter.add_argument("--workers", type=int, default=4,
+                          help="concurrent requests")
+    exporter.add_argument("--depth", type=int, default=4,
+                          help="requests fetched ahead of the writer")
+    for name in ["user", "project", "activity"]:
+        exporter.add_argument("--{}".format(name), action="append",
+                              help="only export times for this {}; may be "
+                                   "repeated".format(name))
+    exporter.add_argument("--checkpoint",
+                          help="file recording exported dates so an "
+                               "interrupted export can resume")
+
+    return parser
+
+
+def main(argv=None, out=sys.stderr):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if not args.command:
+        parser.print_help(out)
+        return 2
+    if not args.baseurl:
+        parser.error("--baseurl or PYMESYNC_BASEURL is required")
+
+    ts = connect(args)
+    if isinstance(ts, dict):
+        print("authentication failed: {}".format(json.dumps(ts, default=str)),
+              file=out)
+        return 2
+
+    if args.deadline is None:
+        return run_command(ts, args, out)
+    with ts.deadline(args.deadline):
+        return run_command(ts, args, out)
+
+
+def run_command(ts, args, out=sys.stderr):
+    """Run the import or export command in ``args`` with the authenticated
+    TimeSync object ``ts``. Returns the exit status"""
+    if args.command == "import":
+        if args.journal:
+            ts.enable_idempotency(args.journal)
+        if args.check_references:
+            ts.enable_reference_validation()
+        summary = import_times(ts, args.file, args.format, args.batch_size,
+                               args.workers, args.checkpoint, out)
+        imported = summary["rows"] - summary["skipped"]
+        print("imported {0} of {1} rows in {2:.2f} seconds "
+              "({3:.1f} entries/sec), {4} failed".format(
+                  summary["created"], imported, summary["seconds"],
+                  imported / summary["seconds"] if summary["seconds"] else 0,
+                  summary["failed"]),
+              file=out)
+        return 1 if summary["failed"] or summary.get("stopped") else 0
+
+    if args.command == "export":
+        query = dict((name, getattr(args, name))
+                     for name in ["user", "project", "activity"]
+                     if getattr(args, name))
+        summary = export_times(ts, args.file, args.start, args.end, args.days,
+                               args.format, query, args.depth, args.workers,
+                               args.checkpoint, out)
+        print("exported {0} rows in {1:.2f} seconds "
+              "({2:.1f} entries/sec)".format(
+                  summary["rows"], summary["seconds"],
+                  summary["rows"] / summary["seconds"]
+                  if summary["seconds"] else 0),
+              file=out)
+        return 1 if "error" in summary else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""
+pymesync.clients - Share authenticated TimeSync objects between requests
+
+- ClientManager - Keeps one authenticated TimeSync object per baseurl and
+  user, with a connection limit shared by all of them
+"""
+
+from __future__ import unicode_literals
+
+import datetime
+import threading
+import time
+
+from .pymesync import TimeSync
+
+
+class _Client(object):
+    """A managed TimeSync object and its bookkeeping"""
+
+    def __init__(self, ts):
+        self.ts = ts
+        self.lock = threading.Lock()
+        self.token_expires = 0
+        self.last_used = 0
+
+
+class ClientManager(object):
+    """Hands out one authenticated TimeSync object per ``(baseurl, username)``
+    so services talking to several TimeSync deployments don't create and
+    authenticate a new object for every request.
+
+    A client logs in once and keeps its token until ``refresh_margin``
+    seconds before the token expires; tokens whose expiration can't be read
+    are kept for ``token_ttl`` seconds. At most ``max_connections`` HTTP
+    requests run at once across every client. Clients unused for
+    ``idle_timeout`` seconds are dropped. Every client waits at most
+    ``timeout`` seconds for TimeSync (see TimeSync.timeout). Managed TimeSync
+    objects are shared between callers and threads.
+    """
+
+    def __init__(self, max_connections=16, idle_timeout=600,
+                 refresh_margin=60, token_ttl=3600, timeout=None, test=False):
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.refresh_margin = refresh_margin
+        self.token_ttl = token_ttl
+        self.timeout = timeout
+        self.test = test
+        self.error = "pymesync error"
+
+        self.__lock = threading.Lock()
+        self.__clients = {}
+        self.__connections = threading.BoundedSemaphore(max_connections)
+        self.__counts = {"created": 0, "authentications": 0, "evicted": 0}
+
+    def client(self, baseurl, username, password, auth_type="password"):
+        """
+        client(baseurl, username, password, auth_type="password")
+
+        Returns the authenticated TimeSync object for ``username`` at
+        ``baseurl``, creating it or logging in again if its token is about to
+        expire or ``password`` changed. If logging in fails, the error dict
+        from TimeSync.authenticate() is returned.
+        """
+        now = time.time()
+        key = (baseurl.rstrip("/"), username)
+
+        with self.__lock:
+            self.__evict_idle(now)
+            managed = self.__clients.get(key)
+            if managed is None:
+                ts = TimeSync(key[0], test=self.test, timeout=self.timeout)
+                ts.connection_limit = self.__connections
+                managed = self.__clients[key] = _Client(ts)
+                self.__counts["created"] += 1
+            managed.last_used = now
+
+        # Only one caller logs in for a client; the rest wait and reuse the
+        # new token
+        with managed.lock:
+            ts = managed.ts
+            if (managed.token_expires - self.refresh_margin <= now or
+                    ts.password != password or ts.auth_type != auth_type):
+                result = ts.authenticate(username, password, auth_type)
+                with self.__lock:
+                    self.__counts["authentications"] += 1
+                if self.error in result or "token" not in result:
+                    managed.token_expires = 0
+                    return result
+                managed.token_expires = self.__token_expires(ts, now)
+
+        return ts
+
+    def evict_idle(self):
+        """Drop clients that haven't been used for ``idle_timeout`` seconds.
+        Returns the number dropped"""
+        with self.__lock:
+            return self.__evict_idle(time.time())
+
+    def close(self):
+        """Drop every client"""
+        with self.__lock:
+            self.__counts["evicted"] += len(self.__clients)
+            self.__clients.clear()
+
+    def metrics(self):
+        """Returns the number of clients held, created, evicted and logins
+        made"""
+        with self.__lock:
+            metrics = dict(self.__counts)
+            metrics["clients"] = len(self.__clients)
+            return metrics
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__clients)
+
+    def __evict_idle(self, now):
+        """Caller holds the lock"""
+        idle = [key for key, managed in self.__clients.items()
+                if managed.last_used + self.idle_timeout < now]
+        for key in idle:
+            del self.__clients[key]
+        self.__counts["evicted"] += len(idle)
+        return len(idle)
+
+    def __token_expires(self, ts, now):
+        """Returns the epoch time ``ts``'s token expires"""
+        if ts.test:
+            return now + self.token_ttl
+
+        expires = ts.token_expiration_time()
+        if not isinstance(expires, datetime.datetime):
+            return now + self.token_ttl
+        return time.mktime(expires.timetuple())
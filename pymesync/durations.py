@@ -0,0 +1,76 @@
+"""
+pymesync.durations - Convert duration strings to seconds
+
+- parse_duration(value) - Convert one duration to seconds
+- parse_durations(values) - Convert a column of durations to seconds,
+  reporting invalid rows by index
+
+Accepted formats are non-negative integers (already in seconds), "<h>h<m>m"
+strings such as "1h30m", "2h" or "90m", and ISO-8601 durations such as
+"PT1H30M" or "P1DT2H".
+"""
+
+from __future__ import unicode_literals
+
+import re
+import sys
+
+
+if sys.version_info[0] >= 3:
+    basestring = (str, bytes)
+    integer_types = (int,)
+else:
+    integer_types = (int, long)  # noqa flake8 ignore
+
+
+# Both patterns are compiled once; every group is optional, so a match with no
+# groups set ("", "PT") is rejected below
+_HOURS_MINUTES = re.compile(r"^\s*(?:(\d+)\s*h)?\s*(?:(\d+)\s*m)?\s*$",
+                            re.IGNORECASE)
+_ISO_8601 = re.compile(r"^\s*P(?:(\d+)D)?"
+                       r"(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?\s*$",
+                       re.IGNORECASE)
+
+INVALID_DURATION = "invalid duration string"
+
+
+def parse_duration(value):
+    """Returns ``value`` converted to an integer number of seconds, or None if
+    it is not a valid duration"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, integer_types):
+        return value if value >= 0 else None
+    if not isinstance(value, basestring):
+        return None
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", "replace")
+
+    match = _HOURS_MINUTES.match(value)
+    if match:
+        hours, minutes = match.groups()
+        if hours is None and minutes is None:
+            return None
+        return int(hours or 0) * 3600 + int(minutes or 0) * 60
+
+    match = _ISO_8601.match(value)
+    if match:
+        if not any(match.groups()):
+            return None
+        days, hours, minutes, seconds = (int(group or 0)
+                                         for group in match.groups())
+        return days * 86400 + hours * 3600 + minutes * 60 + seconds
+
+    return None
+
+
+def parse_durations(values):
+    """Convert every duration in ``values`` in one pass. Returns a tuple of
+    ``(seconds, invalid)`` where ``seconds`` is a list the same length as
+    ``values`` (None for invalid rows) and ``invalid`` maps the index of each
+    invalid row to an error message"""
+    parse = parse_duration
+    seconds = [parse(value) for value in values]
+    invalid = dict((index, INVALID_DURATION)
+                   for index, value in enumerate(seconds) if value is None)
+    return seconds, invalid
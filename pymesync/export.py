@@ -0,0 +1,132 @@
+"""
+pymesync.export - Writers for streaming time entries to files
+
+- JsonlWriter - One JSON object per line
+- CsvWriter - CSV with a header row and one row per time entry
+- ColumnarWriter - Compressed column blocks, one block per write
+- read_columnar(path) - Yield the time entries in a columnar file
+- WRITERS - File format names mapped to writer classes
+
+Every writer appends to an open binary file, so output can be resumed by
+truncating the file to a known good size and writing again.
+"""
+
+from __future__ import unicode_literals
+
+import csv
+import io
+import json
+import struct
+import zlib
+
+import six
+
+
+# Columns written by CsvWriter and ColumnarWriter, in order
+TIME_FIELDS = ("uuid", "user", "project", "activities", "duration",
+               "date_worked", "notes", "issue_uri", "revision", "created_at",
+               "updated_at", "deleted_at")
+
+# Fields whose values are lists of slugs
+LIST_FIELDS = ("project", "activities")
+
+COLUMNAR_MAGIC = b"PYMESYNC-COLUMNAR-1\n"
+_BLOCK_HEADER = struct.Struct(">I")
+
+
+class JsonlWriter(object):
+    """Writes each time entry as one line of JSON"""
+
+    def __init__(self, handle):
+        self.handle = handle
+
+    def write(self, times):
+        self.handle.write(b"".join(
+            json.dumps(entry, sort_keys=True).encode("utf-8") + b"\n"
+            for entry in times))
+
+
+class CsvWriter(object):
+    """Writes time entries as CSV rows; list fields are joined with commas.
+    The header is only written to an empty file"""
+
+    def __init__(self, handle):
+        self.handle = handle
+        if handle.tell() == 0:
+            self.__write_rows([TIME_FIELDS])
+
+    def write(self, times):
+        self.__write_rows([self.__cells(entry) for entry in times])
+
+    def __cells(self, entry):
+        cells = []
+        for field in TIME_FIELDS:
+            value = entry.get(field)
+            if value is None:
+                value = ""
+            elif field in LIST_FIELDS and isinstance(value, list):
+                value = ",".join(value)
+            cells.append(six.text_type(value))
+        return cells
+
+    def __write_rows(self, rows):
+        if six.PY2:
+            buf = io.BytesIO()
+            writer = csv.writer(buf)
+            for row in rows:
+                writer.writerow([cell.encode("utf-8") for cell in row])
+            self.handle.write(buf.getvalue())
+        else:
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            writer.writerows(rows)
+            self.handle.write(buf.getvalue().encode("utf-8"))
+
+
+class ColumnarWriter(object):
+    """Writes each batch of time entries as one block: a 4-byte big-endian
+    length followed by zlib-compressed JSON of ``{"rows": n, "columns":
+    {field: [values]}}``. Storing values column by column lets repeated
+    usernames, slugs and dates compress well"""
+
+    def __init__(self, handle, level=6):
+        self.handle = handle
+        self.level = level
+        if handle.tell() == 0:
+            handle.write(COLUMNAR_MAGIC)
+
+    def write(self, times):
+        if not times:
+            return
+        columns = dict((field, [entry.get(field) for entry in times])
+                       for field in TIME_FIELDS)
+        block = zlib.compress(json.dumps(
+            {"rows": len(times), "columns": columns},
+            separators=(",", ":")).encode("utf-8"), self.level)
+        self.handle.write(_BLOCK_HEADER.pack(len(block)) + block)
+
+
+def read_columnar(path):
+    """Yield each time entry stored in the columnar file at ``path``"""
+    with io.open(path, "rb") as handle:
+        if handle.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+            raise ValueError("{} is not a pymesync columnar file".format(path))
+
+        while True:
+            header = handle.read(_BLOCK_HEADER.size)
+            if len(header) < _BLOCK_HEADER.size:
+                return
+            size, = _BLOCK_HEADER.unpack(header)
+            block = json.loads(zlib.decompress(handle.read(size))
+                               .decode("utf-8"))
+            columns = block["columns"]
+            for row in range(block["rows"]):
+                yield dict((field, values[row])
+                           for field, values in columns.items())
+
+
+WRITERS = {
+    "jsonl": JsonlWriter,
+    "csv": CsvWriter,
+    "columnar": ColumnarWriter,
+}
@@ -0,0 +1,41 @@
+"""
+pymesync.files - Small helpers for files shared between processes
+
+- locked(path) - Context manager holding an exclusive lock on a lock file
+- replace(tmp_path, path) - Atomically move a finished file into place
+"""
+
+from __future__ import unicode_literals
+
+import contextlib
+import os
+
+try:
+    import fcntl
+except ImportError:
+    # Windows; locks are then only held between the callers' threads
+    fcntl = None
+
+
+@contextlib.contextmanager
+def locked(path):
+    """Context manager holding an exclusive lock on the file at ``path``
+    (created readable only by its owner) between processes, where fcntl is
+    available. Callers sharing it between threads need their own lock"""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o600)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        # Closing the file releases the lock
+        os.close(fd)
+
+
+def replace(tmp_path, path):
+    """Move the file at ``tmp_path`` to ``path``, replacing it atomically"""
+    try:
+        os.replace(tmp_path, path)
+    except AttributeError:
+        # Python 2 has no os.replace; rename is atomic on POSIX
+        os.rename(tmp_path, path)
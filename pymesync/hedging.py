@@ -0,0 +1,129 @@
+"""
+pymesync.hedging - Hedged requests to cut tail latency
+
+- Hedger - Sends a second copy of a slow idempotent request and uses
+  whichever answers first
+"""
+
+from __future__ import unicode_literals
+
+import collections
+import sys
+import threading
+import time
+
+import six
+from six.moves import queue
+
+
+class Hedger(object):
+    """Runs a call and, if it hasn't returned after the ``percentile``
+    latency of the last ``window`` calls, starts an identical second call and
+    returns whichever result arrives first. The slower call is left to finish
+    in the background and its result is dropped.
+
+    Hedging only starts once ``min_samples`` latencies are known, never waits
+    less than ``min_delay`` seconds, and is skipped when it would make more
+    than ``max_extra`` (a fraction) of all calls hedged, which bounds the
+    extra load sent to the server. Only use it for calls that are safe to
+    repeat."""
+
+    def __init__(self, percentile=95, max_extra=0.1, min_delay=0.005,
+                 window=100, min_samples=10):
+        self.percentile = percentile
+        self.max_extra = max_extra
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+
+        self.__lock = threading.Lock()
+        self.__latencies = collections.deque(maxlen=window)
+        self.__counts = {"requests": 0, "hedged": 0, "wins": 0}
+
+    def call(self, function, *args):
+        """Returns ``function(*args)``, hedged if it is slow"""
+        started = time.time()
+        with self.__lock:
+            self.__counts["requests"] += 1
+            delay = self.__delay()
+
+        # Until the latency percentile is known, just make the call
+        if delay is None:
+            try:
+                return function(*args)
+            finally:
+                self.__record(started, False)
+
+        results = queue.Queue()
+
+        def attempt(hedge):
+            try:
+                results.put((hedge, None, function(*args)))
+            except Exception:
+                results.put((hedge, sys.exc_info(), None))
+
+        self.__start(attempt, False)
+        hedged = False
+        try:
+            outcome = results.get(timeout=delay)
+        except queue.Empty:
+            hedged = self.__may_hedge()
+            if hedged:
+                self.__start(attempt, True)
+            outcome = results.get()
+
+        # If the first answer was an exception, give the other call a chance
+        if hedged and outcome[1] is not None:
+            outcome = results.get()
+
+        hedge, exc_info, result = outcome
+        self.__record(started, hedge)
+        if exc_info is not None:
+            six.reraise(*exc_info)
+        return result
+
+    def delay(self):
+        """Returns the seconds a call may take before it is hedged, or None
+        until enough latencies are known"""
+        with self.__lock:
+            return self.__delay()
+
+    def metrics(self):
+        """Returns the number of calls, how many were hedged, how many hedges
+        answered first, the hedge rate and the current hedge delay"""
+        with self.__lock:
+            metrics = dict(self.__counts)
+            metrics["hedge_rate"] = (
+                float(metrics["hedged"]) / metrics["requests"]
+                if metrics["requests"] else 0.0)
+            metrics["delay"] = self.__delay()
+            return metrics
+
+    def __record(self, started, hedge_won):
+        with self.__lock:
+            self.__latencies.append(time.time() - started)
+            if hedge_won:
+                self.__counts["wins"] += 1
+
+    def __start(self, attempt, hedge):
+        thread = threading.Thread(target=attempt, args=(hedge,),
+                                  name="pymesync-hedge")
+        thread.daemon = True
+        thread.start()
+
+    def __may_hedge(self):
+        """Claim a hedge if the extra load budget allows one"""
+        with self.__lock:
+            if self.__counts["hedged"] + 1 > (
+                    self.max_extra * self.__counts["requests"]):
+                return False
+            self.__counts["hedged"] += 1
+            return True
+
+    def __delay(self):
+        """Caller holds the lock"""
+        if len(self.__latencies) < self.min_samples:
+            return None
+        latencies = sorted(self.__latencies)
+        index = min(int(len(latencies) * self.percentile / 100.0),
+                    len(latencies) - 1)
+        return max(latencies[index], self.min_delay)
@@ -0,0 +1,362 @@
+"""
+pymesync.indexes - Local lookup indexes built from TimeSync GET results
+
+- PermissionIndex - Project permissions by user and by permission, stored as
+  bitmasks
+- SlugIndex - Project slugs mapped to their project's uuid
+- BloomFilter - Compact set membership test with a bounded false positive
+  rate
+- ExistenceIndex - Bloom filters of the usernames, slugs and uuids known to
+  exist
+"""
+
+from __future__ import unicode_literals
+
+import hashlib
+import math
+import struct
+import threading
+
+import six
+
+
+MEMBER = 1
+SPECTATOR = 2
+MANAGER = 4
+
+# Permission names in the order they are reported, mapped to their bits
+PERMISSIONS = (("member", MEMBER),
+               ("spectator", SPECTATOR),
+               ("manager", MANAGER))
+PERMISSION_BITS = dict(PERMISSIONS)
+
+
+def permission_mask(permissions):
+    """Convert a TimeSync ``{"member": True, ...}`` dict (or an iterable of
+    permission names) to a bitmask. Unknown permissions are ignored"""
+    if isinstance(permissions, dict):
+        permissions = [name for name, value in permissions.items()
+                       if value is True]
+    mask = 0
+    for name in permissions:
+        mask |= PERMISSION_BITS.get(name, 0)
+    return mask
+
+
+def permission_names(mask):
+    """Convert a bitmask back to a list of permission names"""
+    return [name for name, bit in PERMISSIONS if mask & bit]
+
+
+class PermissionIndex(object):
+    """Maps users to ``{project slug: permission bitmask}`` and permissions to
+    ``{user: set of project slugs}``. Lookups are constant time and never
+    contact TimeSync. Projects are keyed by uuid so an update that changes a
+    project's slugs replaces the old ones."""
+
+    def __init__(self, projects=None):
+        self.__lock = threading.Lock()
+        self.__users = {}
+        self.__slugs = {}
+        self.__permissions = dict((bit, {}) for name, bit in PERMISSIONS)
+        self.__project_slugs = {}
+        for project in projects or []:
+            self.update(project)
+
+    def update(self, project):
+        """Add ``project`` (a TimeSync project dict) to the index, replacing
+        any earlier version of the same project"""
+        slugs = tuple(project.get("slugs") or ())
+        key = project.get("uuid") or slugs
+        masks = dict((user, permission_mask(perms))
+                     for user, perms in (project.get("users") or {}).items())
+
+        with self.__lock:
+            for slug in self.__project_slugs.pop(key, ()):
+                self.__remove_slug(slug)
+            for slug in slugs:
+                self.__remove_slug(slug)
+
+            self.__project_slugs[key] = slugs
+            for slug in slugs:
+                self.__slugs[slug] = masks
+                for user, mask in masks.items():
+                    self.__users.setdefault(user, {})[slug] = mask
+                    for bit, users in self.__permissions.items():
+                        if mask & bit:
+                            users.setdefault(user, set()).add(slug)
+
+    def mask(self, user, slug):
+        """Returns the permission bitmask ``user`` has on ``slug``"""
+        return self.__users.get(user, {}).get(slug, 0)
+
+    def has(self, user, slug, permission):
+        """Returns True if ``user`` has the named ``permission`` on
+        ``slug``"""
+        return bool(self.mask(user, slug) & PERMISSION_BITS.get(permission, 0))
+
+    def projects(self, user, permission):
+        """Returns the set of slugs on which ``user`` has ``permission``"""
+        bit = PERMISSION_BITS.get(permission)
+        with self.__lock:
+            return frozenset(self.__permissions.get(bit, {}).get(user, ()))
+
+    def user_projects(self, user):
+        """Returns a dict of slugs mapped to ``user``'s permission bitmask"""
+        with self.__lock:
+            return dict(self.__users.get(user, {}))
+
+    def project_users(self, slug):
+        """Returns ``{user: [permission names]}`` for ``slug``, or None if the
+        slug is not in the index"""
+        with self.__lock:
+            masks = self.__slugs.get(slug)
+            if masks is None:
+                return None
+            return dict((user, permission_names(mask))
+                        for user, mask in masks.items())
+
+    def __contains__(self, slug):
+        return slug in self.__slugs
+
+    def __remove_slug(self, slug):
+        """Remove every entry for ``slug``. Caller holds the lock"""
+        for user in self.__slugs.pop(slug, {}):
+            user_slugs = self.__users.get(user, {})
+            user_slugs.pop(slug, None)
+            if not user_slugs:
+                self.__users.pop(user, None)
+            for users in self.__permissions.values():
+                if user in users:
+                    users[user].discard(slug)
+                    if not users[user]:
+                        del(users[user])
+
+
+class SlugIndex(object):
+    """Maps every slug of every project to that project's uuid, so time
+    entries that name a project by any of its slugs can be grouped by a
+    single dictionary lookup."""
+
+    def __init__(self, projects=None):
+        self.__lock = threading.Lock()
+        self.__uuids = {}
+        self.__projects = {}
+        if projects:
+            self.refresh(projects)
+
+    def update(self, project):
+        """Add or replace a single project (a TimeSync project dict)"""
+        uuid = project.get("uuid")
+        if not uuid:
+            return
+
+        with self.__lock:
+            self.__update(uuid, project)
+
+    def refresh(self, projects):
+        """Bring the index in line with ``projects`` (a full get_projects()
+        result). Only projects whose revision changed are re-indexed and
+        projects no longer listed are dropped. Returns the number of projects
+        added, changed or removed"""
+        current = dict((project["uuid"], project) for project in projects
+                       if project.get("uuid"))
+        changed = 0
+
+        with self.__lock:
+            for uuid in set(self.__projects) - set(current):
+                self.__remove(uuid)
+                changed += 1
+
+            for uuid, project in current.items():
+                known = self.__projects.get(uuid)
+                if known is None or known[0] != project.get("revision"):
+                    self.__update(uuid, project)
+                    changed += 1
+
+        return changed
+
+    def resolve(self, slug):
+        """Returns the uuid of the project with ``slug`` or None. ``slug`` may
+        also be a list of slugs, as in time entries from get_times(); the
+        first known one is used"""
+        if isinstance(slug, (list, tuple)):
+            for item in slug:
+                uuid = self.__uuids.get(item)
+                if uuid:
+                    return uuid
+            return None
+        return self.__uuids.get(slug)
+
+    def resolve_times(self, times):
+        """Yield ``(project uuid, time)`` for each time entry in ``times``.
+        The uuid is None if the entry's project is unknown"""
+        resolve = self.resolve
+        for entry in times:
+            yield resolve(entry.get("project")), entry
+
+    def group_times(self, times):
+        """Returns a dict of project uuids mapped to lists of the time
+        entries in ``times`` for that project"""
+        groups = {}
+        for uuid, entry in self.resolve_times(times):
+            groups.setdefault(uuid, []).append(entry)
+        return groups
+
+    def slugs(self, uuid):
+        """Returns the slugs of the project with ``uuid``"""
+        known = self.__projects.get(uuid)
+        return list(known[1]) if known else []
+
+    def __contains__(self, slug):
+        return slug in self.__uuids
+
+    def __update(self, uuid, project):
+        """Index ``project`` under ``uuid``. Caller holds the lock"""
+        self.__remove(uuid)
+        slugs = tuple(project.get("slugs") or ())
+        self.__projects[uuid] = (project.get("revision"), slugs)
+        for slug in slugs:
+            self.__uuids[slug] = uuid
+
+    def __remove(self, uuid):
+        """Drop every slug of ``uuid``. Caller holds the lock"""
+        revision, slugs = self.__projects.pop(uuid, (None, ()))
+        for slug in slugs:
+            if self.__uuids.get(slug) == uuid:
+                del(self.__uuids[slug])
+
+
+class BloomFilter(object):
+    """Set of strings that answers "maybe present" or "definitely absent".
+    Sized to hold ``capacity`` items with at most ``error_rate`` chance that
+    an absent item is reported present; it never misses an item that was
+    added. Items cannot be removed."""
+
+    def __init__(self, capacity, error_rate=0.01):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be between 0 and 1")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bits = int(math.ceil(-capacity * math.log(error_rate) /
+                                  math.log(2) ** 2))
+        self.hashes = max(1, int(round(self.bits / float(capacity) *
+                                       math.log(2))))
+        self.count = 0
+        self.__array = bytearray((self.bits + 7) // 8)
+
+    def add(self, item):
+        """Add ``item``. Returns False if it may already have been added"""
+        new = False
+        array = self.__array
+        for position in self.__positions(item):
+            byte, bit = divmod(position, 8)
+            if not array[byte] & (1 << bit):
+                array[byte] |= 1 << bit
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+    def __contains__(self, item):
+        array = self.__array
+        return all(array[position // 8] & (1 << (position % 8))
+                   for position in self.__positions(item))
+
+    def __len__(self):
+        return self.count
+
+    def size(self):
+        """Returns the size of the bit array in bytes"""
+        return len(self.__array)
+
+    def __positions(self, item):
+        """The bit positions for ``item``, by double hashing one digest"""
+        digest = hashlib.sha256(six.text_type(item).encode("utf-8")).digest()
+        first, second = struct.unpack(">QQ", digest[:16])
+        second |= 1
+        return [(first + i * second) % self.bits
+                for i in range(self.hashes)]
+
+
+# The fields naming each kind of object, as returned by the get_* methods
+EXISTENCE_FIELDS = {
+    "users": ("username",),
+    "projects": ("slugs", "uuid"),
+    "activities": ("slug", "uuid"),
+    "times": ("uuid",),
+}
+
+
+class ExistenceIndex(object):
+    """Bloom filters of the usernames, project and activity slugs and uuids,
+    and time entry uuids known to exist. A name missing from the index
+    definitely did not exist when the index was last refreshed; a name found
+    may exist (with at most ``error_rate`` chance that it doesn't) and should
+    be confirmed with a lookup.
+
+    Each kind starts with a filter for ``capacity`` names. When it fills up
+    another twice as large is added, and each filter gets half the error
+    rate of the one before it, so the overall rate stays under
+    ``error_rate`` however large the index grows."""
+
+    def __init__(self, capacity=10000, error_rate=0.01):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.__lock = threading.Lock()
+        self.__filters = dict((kind, []) for kind in EXISTENCE_FIELDS)
+
+    def update(self, kind, objects):
+        """Add the names of ``objects`` (TimeSync dicts of ``kind``, such as
+        a get_users() result) to the index. Names already present are
+        skipped, so refreshing with a full listing only adds what is new.
+        Returns the number of names added"""
+        fields = EXISTENCE_FIELDS[kind]
+        added = 0
+        with self.__lock:
+            for obj in objects:
+                if not isinstance(obj, dict):
+                    continue
+                for field in fields:
+                    values = obj.get(field)
+                    if not isinstance(values, list):
+                        values = [values]
+                    for name in values:
+                        if name and self.__add(kind, name):
+                            added += 1
+        return added
+
+    def might_exist(self, kind, name):
+        """Returns False if ``name`` is definitely not in the index"""
+        return any(name in bloom for bloom in self.__filters[kind])
+
+    def partition(self, kind, names):
+        """Split ``names`` into ``(new, possible)`` lists: names that
+        definitely don't exist, and names that may exist"""
+        new, possible = [], []
+        for name in names:
+            (possible if self.might_exist(kind, name) else new).append(name)
+        return new, possible
+
+    def metrics(self):
+        """Returns ``{kind: {"names", "filters", "bytes"}}``"""
+        with self.__lock:
+            return dict((kind, {
+                "names": sum(len(bloom) for bloom in filters),
+                "filters": len(filters),
+                "bytes": sum(bloom.size() for bloom in filters),
+            }) for kind, filters in self.__filters.items())
+
+    def __add(self, kind, name):
+        """Add ``name`` unless it may already be present. Caller holds the
+        lock"""
+        filters = self.__filters[kind]
+        if any(name in bloom for bloom in filters):
+            return False
+        if not filters or len(filters[-1]) >= filters[-1].capacity:
+            number = len(filters)
+            filters.append(BloomFilter(self.capacity * 2 ** number,
+                                       self.error_rate / 2 ** (number + 1)))
+        return filters[-1].add(name)
@@ -0,0 +1,161 @@
+"""
+pymesync.journal - Local journals that make time submissions safe to retry
+
+- time_key(time) - Deduplication key for a time entry
+- KeyJournal - Append-only file of submitted time entry keys
+"""
+
+from __future__ import unicode_literals
+
+import contextlib
+import errno
+import hashlib
+import io
+import json
+import os
+import socket
+import threading
+import time as clock
+
+from . import files
+
+
+# Fields that identify a time entry for deduplication
+KEY_FIELDS = ("user", "project", "date_worked", "duration", "notes")
+
+
+def time_key(time):
+    """Returns a hex digest identifying ``time`` by its user, project,
+    date_worked, duration (in seconds) and notes"""
+    values = [time.get(field) for field in KEY_FIELDS]
+    if isinstance(values[1], list):
+        # Entries from get_times() list every slug of the project
+        values[1] = values[1][0] if values[1] else None
+    if values[4] == "":
+        values[4] = None
+    return hashlib.sha1(json.dumps(values, sort_keys=True)
+                        .encode("utf-8")).hexdigest()
+
+
+def same_time(submitted, existing):
+    """Returns True if the time entry ``existing`` (from get_times()) matches
+    the ``submitted`` time entry on every key field"""
+    project = existing.get("project")
+    projects = project if isinstance(project, list) else [project]
+    return (submitted.get("project") in projects and
+            all((submitted.get(field) or None) == (existing.get(field) or None)
+                for field in ("user", "date_worked", "duration", "notes")))
+
+
+class KeyJournal(object):
+    """Set of submitted time entry keys backed by an append-only file shared
+    by every worker and process submitting the same data.
+
+    The file holds one line per event: a bare key once it was submitted,
+    "reserve <key> <time> <host> <pid>" when a worker claims it and
+    "release <key>" when a worker gives up its claim. Claims are checked and
+    written while holding an exclusive lock on "<path>.lock" (where fcntl is
+    available), so two processes never hold the same key. A claim is ignored
+    once the process that made it on this host has exited, or after
+    ``reservation_ttl`` seconds."""
+
+    def __init__(self, path, reservation_ttl=600):
+        self.path = path
+        self.reservation_ttl = reservation_ttl
+        self.__lock = threading.Lock()
+        self.__keys = set()
+        # Keys claimed in the file, mapped to (time, host, pid)
+        self.__reserved = {}
+        self.__offset = 0
+        with self.__lock:
+            self.__read_new_keys()
+
+    def reserve(self, key):
+        """Claim ``key`` for submission. Returns False if it was already
+        submitted or is being submitted by another worker"""
+        with self.__file_lock():
+            self.__read_new_keys()
+            claim = self.__reserved.get(key)
+            if key in self.__keys or claim is not None and (
+                    self.__claim_active(*claim)):
+                return False
+            claim = (clock.time(), socket.gethostname(), os.getpid())
+            self.__append("reserve {0} {1!r} {2} {3}".format(key, *claim))
+            self.__reserved[key] = claim
+            return True
+
+    def commit(self, key):
+        """Record ``key`` as submitted"""
+        with self.__file_lock():
+            self.__append(key)
+            self.__keys.add(key)
+            self.__reserved.pop(key, None)
+
+    def release(self, key):
+        """Give up a reservation after a failed submission"""
+        with self.__file_lock():
+            self.__append("release {}".format(key))
+            self.__reserved.pop(key, None)
+
+    def __contains__(self, key):
+        with self.__lock:
+            self.__read_new_keys()
+            return key in self.__keys
+
+    def __len__(self):
+        return len(self.__keys)
+
+    def __claim_active(self, claimed_at, host, pid):
+        """Returns False for a claim that expired or whose process on this
+        host has exited"""
+        if claimed_at <= clock.time() - self.reservation_ttl:
+            return False
+        if host != socket.gethostname() or pid == os.getpid():
+            return True
+        try:
+            os.kill(pid, 0)
+        except OSError as e:
+            return e.errno != errno.ESRCH
+        return True
+
+    @contextlib.contextmanager
+    def __file_lock(self):
+        """Hold the lock between threads and, where fcntl is available,
+        between processes"""
+        with self.__lock:
+            with files.locked("{}.lock".format(self.path)):
+                yield
+
+    def __append(self, line):
+        """Append one line to the journal. Caller holds the lock"""
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                     0o600)
+        try:
+            os.write(fd, "{}\n".format(line).encode("ascii"))
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def __read_new_keys(self):
+        """Load lines appended since the last read. Caller holds the lock"""
+        if not os.path.exists(self.path):
+            return
+        with io.open(self.path, "rb") as handle:
+            handle.seek(self.__offset)
+            data = handle.read()
+        # Only consume complete lines
+        end = data.rfind(b"\n") + 1
+        self.__offset += end
+        for line in data[:end].decode("ascii").splitlines():
+            fields = line.split()
+            if not fields:
+                continue
+            if fields[0] == "reserve" and len(fields) == 5:
+                if fields[1] not in self.__keys:
+                    self.__reserved[fields[1]] = (float(fields[2]),
+                                                  fields[3], int(fields[4]))
+            elif fields[0] == "release" and len(fields) == 2:
+                self.__reserved.pop(fields[1], None)
+            else:
+                self.__keys.add(fields[0])
+                self.__reserved.pop(fields[0], None)
@@ -0,0 +1,32 @@
+"""
+pymesync.lazy - Import modules the first time they are used
+
+- LazyModule(name) - Stands in for a module until one of its attributes is
+  needed
+"""
+
+from __future__ import unicode_literals
+
+import importlib
+
+
+class LazyModule(object):
+    """Proxy for the module ``name``, which is imported on the first
+    attribute lookup. Every lookup is forwarded to the real module, so
+    attributes patched onto it later (as the tests do with requests.get) are
+    seen through the proxy."""
+
+    def __init__(self, name):
+        self.__name = name
+        self.__module = None
+
+    def __getattr__(self, attribute):
+        # Only called for attributes not found on the proxy itself
+        module = self.__module
+        if module is None:
+            module = self.__module = importlib.import_module(self.__name)
+        return getattr(module, attribute)
+
+    def __repr__(self):
+        return "<lazy module {!r}{}>".format(
+            self.__name, "" if self.__module is None else " (loaded)")
@@ -16,8 +16,8 @@ def create_time(p_dict):
     p_dict["deleted_at"] = None
     p_dict["uuid"] = "838853e3-3635-4076-a26f-7efr4e60981f"
     p_dict["revision"] = 1
-    p_dict["notes"] = p_dict["notes"] if p_dict["notes"] else None
-    p_dict["issue_uri"] = p_dict["issue_uri"] if p_dict["issue_uri"] else None
+    p_dict["notes"] = p_dict.get("notes") or None
+    p_dict["issue_uri"] = p_dict.get("issue_uri") or None
     return p_dict
 
 
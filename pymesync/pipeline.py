@@ -0,0 +1,77 @@
+"""
+pymesync.pipeline - Read-ahead helpers for TimeSync GET methods
+
+- prefetch(fetch, queries, depth, workers) - Fetch queries in the background
+  while the caller consumes earlier results
+- date_shards(start, end, days) - Split a date range into smaller ranges
+"""
+
+from __future__ import unicode_literals
+
+import collections
+import datetime
+import itertools
+
+from . import lazy
+
+# Loaded on first use; multiprocessing is slow to import
+pool = lazy.LazyModule("multiprocessing.pool")
+
+
+DATE_FORMAT = "%Y-%m-%d"
+
+
+def prefetch(fetch, queries, depth=2, workers=1):
+    """Call ``fetch(query)`` for each item in ``queries`` in background
+    threads and yield ``(query, result)`` tuples in order.
+
+    At most ``depth`` queries are in flight or finished and waiting for the
+    consumer; once that many are outstanding no new query is started until
+    the consumer takes a result, so a slow consumer never causes unbounded
+    memory growth. Up to ``workers`` queries run at the same time.
+    ``queries`` may be any iterable, including a lazy generator. Exceptions
+    raised by ``fetch`` are re-raised in the consumer. Closing the generator
+    early stops the remaining work.
+    """
+    if depth < 1:
+        raise ValueError("depth must be at least 1")
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+
+    queries = iter(queries)
+    pending = collections.deque()
+    threads = pool.ThreadPool(min(workers, depth))
+
+    def fill():
+        for query in itertools.islice(queries, depth - len(pending)):
+            pending.append((query, threads.apply_async(fetch, (query,))))
+
+    try:
+        fill()
+        while pending:
+            query, result = pending.popleft()
+            result = result.get()
+            fill()
+            yield query, result
+    finally:
+        threads.terminate()
+
+
+def date_shards(start, end, days=1):
+    """Yield ``(shard_start, shard_end)`` pairs of "yyyy-mm-dd" strings that
+    cover ``start`` through ``end`` (inclusive) in ranges of ``days`` days.
+    ``start`` and ``end`` may be date strings or ``datetime.date`` objects."""
+    if days < 1:
+        raise ValueError("days must be at least 1")
+
+    if not isinstance(start, datetime.date):
+        start = datetime.datetime.strptime(start, DATE_FORMAT).date()
+    if not isinstance(end, datetime.date):
+        end = datetime.datetime.strptime(end, DATE_FORMAT).date()
+
+    step = datetime.timedelta(days=days)
+    one_day = datetime.timedelta(days=1)
+    while start <= end:
+        shard_end = min(start + step - one_day, end)
+        yield start.strftime(DATE_FORMAT), shard_end.strftime(DATE_FORMAT)
+        start = shard_end + one_day
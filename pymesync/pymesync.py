@@ -7,6 +7,22 @@ Allows for interactions with the TimeSync API
 - token_expiration_time() - Returns datetime expiration of user authentication
 - create_time(time) - Sends time to baseurl (TimeSync)
 - update_time(time, uuid) - Updates time by uuid
+- create_times(times) - Sends many times to TimeSync concurrently
+- enable_idempotency(path) - Never submit the same time entry twice
+- enable_write_behind(path) - Queue time submissions in a local journal and
+  send them in the background
+- flush_write_behind(timeout) - Wait for queued time submissions to be sent
+- write_behind_failures(clear) - Queued time submissions TimeSync rejected
+- metrics() - Returns request and optional feature counters
+- enable_circuit_breakers() - Fail fast while a TimeSync endpoint is failing
+- enable_hedging() - Resend slow GET requests and use the first response
+- enable_cache() - Cache GET results, serving stale results while refreshing
+  and when TimeSync fails
+- enable_negative_cache() - Remember users and projects that don't exist
+- enable_token_cache(path) - Share login tokens between processes
+- request_timeout(timeout) - Context manager overriding the request timeout
+- deadline(seconds) - Context manager bounding the time left for requests
+- deadline_remaining() - Returns the seconds left before the deadline
 - create_project(project) - Creates project
 - update_project(project, slug) - Updates project by slug
 - create_activity(activity) - Creates activity
@@ -17,6 +33,22 @@ Allows for interactions with the TimeSync API
 - get_projects(query_parameters) - Get project information from TimeSync
 - get_activities(query_parameters) - Get activity information from TimeSync
 - get_users(username) - Get user information from TimeSync
+- project_users_many(slugs) - Returns users and permissions for many projects
+- has_permission(user, project, permission) - Checks a user's project
+  permission
+- validate(objects, object_name, create_object) - Validates a batch of objects
+- permission_index() - Returns the cached PermissionIndex of all projects
+- slug_index() - Returns the cached SlugIndex of all project slugs
+- enable_existence_index() - Configure the bloom filter existence index
+- existence_index(kinds) - Returns the ExistenceIndex of known usernames,
+  slugs and uuids
+- find_existing(kind, names) - Returns which names exist, looking up only
+  those the existence index can't rule out
+- enable_reference_validation() - Reject time entries naming unknown users,
+  projects or activities before sending them
+- prefetch(method, queries, depth) - Pipeline several GET requests
+- prefetch_times(start, end, days, query_parameters, depth) - Get times in
+  date range shards, fetching ahead of the caller
 
 Supported TimeSync versions:
 v1
@@ -24,27 +56,50 @@ v1
 
 from __future__ import unicode_literals
 
+import contextlib
+import hashlib
 import json
-import requests
-import operator
 import base64
-import ast
+import os
+import re
 import datetime
 import time
-import bcrypt
 import six
-import sys
-
-from . import mock_pymesync
-
-
-if sys.version_info[0] >= 3:
-    basestring = (str, bytes)
+import threading
+
+from . import breaker
+from . import cache
+from . import durations
+from . import hedging
+from . import indexes
+from . import journal
+from . import lazy
+from . import pipeline
+from . import query
+from . import singleflight
+from . import tokens
+from . import validators
+from . import writebehind
+
+# Loaded on first use so importing pymesync stays fast for programs that
+# never send a request, hash a password or run in test mode
+ast = lazy.LazyModule("ast")
+bcrypt = lazy.LazyModule("bcrypt")
+mock_pymesync = lazy.LazyModule("pymesync.mock_pymesync")
+pool = lazy.LazyModule("multiprocessing.pool")
+requests = lazy.LazyModule("requests")
+
+# Marks a thread that has not overridden TimeSync.timeout
+_DEFAULT_TIMEOUT = object()
+
+# The token query parameter, left out of cache keys
+_TOKEN_PARAMETER = re.compile(r"token=[^&]*&?")
 
 
 class TimeSync(object):
 
-    def __init__(self, baseurl, token=None, test=False):
+    def __init__(self, baseurl, token=None, test=False, permission_ttl=300,
+                 timeout=None):
         self.baseurl = baseurl[:-1] if baseurl.endswith("/") else baseurl
         self.user = None
         self.password = None
@@ -52,22 +107,54 @@ class TimeSync(object):
         self.token = token
         self.error = "pymesync error"
         self.test = test
+        self.permission_ttl = permission_ttl
+        # Seconds to wait for TimeSync, as a number or a (connect, read)
+        # tuple; None waits forever
+        self.timeout = timeout
+        self.max_workers = 8
+        # Semaphore limiting concurrent HTTP requests, e.g. shared between
+        # several TimeSync objects by a ClientManager; None for no limit
+        self.connection_limit = None
+        self.__permission_lock = threading.Lock()
+        self.__permission_index = indexes.PermissionIndex()
+        self.__slug_index = indexes.SlugIndex()
+        self.__permissions_expire = 0
+        self.__idempotency_journal = None
+        self.__write_behind = None
+        self.__single_flight = singleflight.SingleFlight()
+        self.__auth_lock = threading.Lock()
+        # Per-thread timeout override and deadline, see request_timeout()
+        # and deadline()
+        self.__call_context = threading.local()
+        self.__breaker_settings = None
+        self.__breakers = {}
+        self.__hedger = None
+        self.__cache = None
+        self.__negative_cache = None
+        self.__existence_lock = threading.Lock()
+        self.__existence_index = None
+        self.__existence_ttl = 300
+        self.__existence_refreshed = {}
+        # Seconds between re-checks of unknown references, or None when
+        # enable_reference_validation() is off
+        self.__reference_recheck = None
+        self.__token_cache = None
+        self.__token_refresh_margin = 300
         self.valid_get_queries = ["user", "project", "activity",
                                   "start", "end", "include_revisions",
                                   "include_deleted", "uuid"]
-        self.required_params = {
-            "time":     ["duration", "project", "user", "date_worked"],
-            "project":  ["name", "slugs"],
-            "activity": ["name", "slug"],
-            "user":     ["username", "password"],
-        }
-        self.optional_params = {
-            "time":     ["notes", "issue_uri", "activities"],
-            "project":  ["uri", "users", "default_activity"],
-            "activity": [],
-            "user":     ["display_name", "email", "site_admin",
-                         "site_spectator", "site_manager", "meta", "active"],
-        }
+        self.prefetch_methods = ["get_times", "get_projects", "get_activities",
+                                 "get_users", "project_users"]
+        # Field lists are defined once in pymesync.validators
+        self.required_params = dict(
+            (name, list(fields))
+            for name, fields in validators.REQUIRED_PARAMS.items())
+        self.optional_params = dict(
+            (name, list(fields))
+            for name, fields in validators.OPTIONAL_PARAMS.items())
+        # Lets deployments turn on a shared cache without code changes
+        if os.environ.get("PYMESYNC_CACHE"):
+            self.enable_cache(backend=os.environ["PYMESYNC_CACHE"])
 
     def authenticate(self, username=None, password=None, auth_type=None):
         """
@@ -102,25 +189,55 @@ class TimeSync(object):
 
         del(arg_error_list)
 
-        self.user = username
-        self.password = password
-        self.auth_type = auth_type
-
+        # Threads sharing this object may log in at the same time; only one
+        # changes the credentials and token at once
+        with self.__auth_lock:
+            self.user = username
+            self.password = password
+            self.auth_type = auth_type
+
+            # Test mode, set self.token and return it from the mocked method
+            if self.test:
+                self.token = "TESTTOKEN"
+                return mock_pymesync.authenticate()
+
+            token_cache = self.__token_cache
+            if token_cache is None:
+                return self.__login()
+
+            # Hold the cache lock while logging in, so other processes
+            # starting now wait for this login and reuse its token
+            with token_cache.lock():
+                token = token_cache.get(self.baseurl, username, auth_type,
+                                        password,
+                                        self.__token_refresh_margin)
+                if token:
+                    self.token = token
+                    return {"token": token}
+
+                token_response = self.__login()
+                if "token" in token_response and (
+                        self.error not in token_response):
+                    expires = self.token_expiration_time()
+                    # Tokens whose expiry can't be read are not shared
+                    if isinstance(expires, datetime.datetime):
+                        token_cache.set(self.baseurl, username, auth_type,
+                                        password, self.token,
+                                        time.mktime(expires.timetuple()))
+                return token_response
+
+    def __login(self):
+        """POST the credentials to the login endpoint and keep the token"""
         # Create the auth block to send to the login endpoint
         auth = {"auth": self.__auth()}
 
         # Construct the url with the login endpoint
         url = "{}/login".format(self.baseurl)
 
-        # Test mode, set self.token and return it from the mocked method
-        if self.test:
-            self.token = "TESTTOKEN"
-            return mock_pymesync.authenticate()
-
         # Send the request, then convert the resonse to a python dictionary
         try:
             # Success!
-            response = requests.post(url, json=auth)
+            response = self.__request(requests.post, url, json=auth)
             token_response = self.__response_to_python(response)
         except requests.exceptions.RequestException as e:
             # Request error
@@ -152,13 +269,24 @@ class TimeSync(object):
 
         if not isinstance(time["duration"], int):
             duration = self.__duration_to_seconds(time["duration"])
-            time["duration"] = duration
+            # Convert a copy; the caller's dict is never modified
+            time = dict(time, duration=duration)
 
             # Duration at this point contains an error_msg if not an int
             if not isinstance(time["duration"], int):
                 return duration
 
-        return self.__create_or_update(time, None, "time", "times")
+        if self.__reference_recheck is not None:
+            errors = self.__reference_errors([time])
+            if errors:
+                return {self.error: "; ".join(errors[0])}
+
+        if self.__write_behind is not None:
+            return self.__queue_time("create_time", time, None)
+
+        result = self.__submit_time(time)
+        self.__record_existing("times", time, result)
+        return result
 
     def update_time(self, time, uuid):
         """
@@ -180,14 +308,398 @@ class TimeSync(object):
 
             if not isinstance(time["duration"], int):
                 duration = self.__duration_to_seconds(time["duration"])
-                time["duration"] = duration
+                # Convert a copy; the caller's dict is never modified
+                time = dict(time, duration=duration)
 
                 # Duration at this point contains an error_msg if not an int
                 if not isinstance(time["duration"], int):
                     return duration
 
+        if self.__write_behind is not None:
+            return self.__queue_time("update_time", time, uuid)
+
         return self.__create_or_update(time, uuid, "time", "times", False)
 
+    def create_times(self, times, workers=None):
+        """
+        create_times(times, workers=None)
+
+        Send many time entries to TimeSync. All durations are converted to
+        seconds in a single pass and every entry is validated (including its
+        references, after enable_reference_validation()) before any
+        request is sent; valid entries are then posted concurrently. Returns a
+        list with one result per entry, in the same order as ``times``. Each
+        result is the created time or a dict with error information.
+
+        ``times`` is a list of python dictionaries as accepted by
+        create_time(). It is not modified.
+        ``workers`` is the number of concurrent requests, defaults to
+        ``self.max_workers``.
+        """
+        # Check that user has authenticated
+        local_auth_error = self.__local_auth_error()
+        if local_auth_error:
+            return [{self.error: local_auth_error} for entry in times]
+
+        # Convert the whole duration column at once
+        seconds, invalid = durations.parse_durations(
+            entry.get("duration") if isinstance(entry, dict) else None
+            for entry in times)
+
+        results = [None] * len(times)
+        entries = []
+        for index, entry in enumerate(times):
+            if not isinstance(entry, dict):
+                results[index] = {self.error:
+                                  "time object: must be python dictionary"}
+                continue
+            if "duration" in entry and index in invalid:
+                results[index] = {self.error: "time object: {}".format(
+                    invalid[index])}
+                continue
+
+            entry = dict(entry)
+            if "duration" in entry:
+                entry["duration"] = seconds[index]
+
+            errors = validators.SCHEMAS["time"].errors(entry)
+            if errors:
+                results[index] = {self.error: "; ".join(errors)}
+            else:
+                entries.append((index, entry))
+
+        # Reject entries naming unknown users, projects or activities before
+        # anything is sent
+        if entries and self.__reference_recheck is not None:
+            unknown = self.__reference_errors([entry for index, entry
+                                               in entries])
+            for position, errors in sorted(unknown.items()):
+                results[entries[position][0]] = {self.error: "; ".join(errors)}
+            entries = [item for position, item in enumerate(entries)
+                       if position not in unknown]
+
+        if entries:
+            threads = pool.ThreadPool(min(len(entries),
+                                          workers or self.max_workers))
+            try:
+                posted = threads.map(self.__in_context(self.__submit_time),
+                                     [entry for index, entry in entries])
+            finally:
+                threads.close()
+
+            for (index, entry), result in zip(entries, posted):
+                results[index] = result
+
+        return results
+
+    def enable_idempotency(self, path):
+        """
+        enable_idempotency(path)
+
+        Make create_time() and create_times() safe to retry and to run from
+        several workers at once. Each time entry gets a key computed from its
+        user, project, date_worked, duration and notes. Before an entry is
+        sent, its key is checked against the journal file at ``path`` (keys
+        of entries already sent) and get_times() is asked for a matching
+        entry on that date. A journaled entry returns ``{"status":
+        "duplicate", "key": key}``, an entry another worker is sending
+        returns an error, a matching existing entry is returned instead of
+        being created again, and only new entries are sent and then
+        journaled.
+
+        ``path`` is the journal file; share it between processes that submit
+        the same data. Pass None to turn idempotency off.
+        """
+        self.__idempotency_journal = journal.KeyJournal(path) if path else (
+            None)
+
+    def enable_write_behind(self, path, batch_size=50, retries=5,
+                            retry_delay=1.0):
+        """
+        enable_write_behind(path, batch_size=50, retries=5, retry_delay=1.0)
+
+        Make create_time() and update_time() return as soon as the time entry
+        is checked locally and durably appended to the journal file at
+        ``path``. A background thread sends queued entries to TimeSync in
+        batches of ``batch_size``, retrying connection failures, timeouts and
+        TimeSync server errors with exponential backoff starting at
+        ``retry_delay`` seconds. After ``retries`` retries it pauses, trying
+        the entry again every ``retry_delay * 2 ** retries`` seconds and
+        sending nothing else until TimeSync answers, so an outage of any
+        length loses nothing. Entries left in the journal by a previous
+        process are sent again when write-behind is enabled. Entries
+        TimeSync rejects are returned by write_behind_failures().
+
+        Queued calls return ``{"status": "queued", "id": <journal id>}``.
+        Queue depth and drain rate are reported by metrics().
+        Pass None as ``path`` to send queued entries and turn write-behind off.
+        """
+        if self.__write_behind is not None:
+            self.__write_behind.close()
+            self.__write_behind = None
+
+        if path:
+            self.__write_behind = writebehind.WriteBehindQueue(
+                self.__send_queued_time, path, batch_size, retries,
+                retry_delay, self.error)
+
+    def flush_write_behind(self, timeout=None):
+        """
+        flush_write_behind(timeout=None)
+
+        Wait until every time entry queued by write-behind mode has been sent.
+        Returns False if ``timeout`` seconds passed first, otherwise True.
+        """
+        if self.__write_behind is None:
+            return True
+        return self.__write_behind.flush(timeout)
+
+    def write_behind_failures(self, clear=False):
+        """
+        write_behind_failures(clear=False)
+
+        Returns the time entries queued by write-behind mode that TimeSync
+        rejected, oldest first, including those rejected before this process
+        started. Each is a dict with the journal "id", the "op"
+        ("create_time" or "update_time"), the time "object", its
+        "identifier" (the uuid updated, or None) and TimeSync's error as
+        "result". If ``clear`` is True they are removed from the journal.
+        """
+        if self.__write_behind is None:
+            return []
+        failures = self.__write_behind.failures()
+        if clear:
+            self.__write_behind.clear_failures(
+                [failure["id"] for failure in failures])
+        return failures
+
+    def metrics(self):
+        """
+        metrics()
+
+        Returns a dict of counters for the optional features in use, keyed by
+        feature. "write_behind" holds the queue depth, submitted, failed and
+        retried counts, whether it is paused retrying an entry, and the
+        drain rate in entries per second.
+        "single_flight" holds the number of GET calls and how many of them
+        shared an identical request already in flight. "circuit_breakers"
+        maps each endpoint to its breaker's state, failure rate and counts.
+        "hedging" holds the number of GET requests, how many were hedged,
+        how many hedges answered first, the hedge rate and the hedge delay.
+        "cache" holds the GET cache's hit, stale hit, miss, stale-on-error
+        and refresh counts, its hit rate and any metrics of its backend.
+        "negative_cache" holds the hit, miss and invalidation counts of
+        enable_negative_cache() and the number of names it remembers.
+        """
+        metrics = {"single_flight": self.__single_flight.metrics()}
+        if self.__write_behind is not None:
+            metrics["write_behind"] = self.__write_behind.metrics()
+        if self.__hedger is not None:
+            metrics["hedging"] = self.__hedger.metrics()
+        if self.__cache is not None:
+            metrics["cache"] = self.__cache.metrics()
+        if self.__negative_cache is not None:
+            metrics["negative_cache"] = self.__negative_cache.metrics()
+        if self.__breaker_settings is not None:
+            metrics["circuit_breakers"] = dict(
+                (endpoint, circuit.metrics())
+                for endpoint, circuit in list(self.__breakers.items()))
+        return metrics
+
+    def enable_circuit_breakers(self, failure_rate=0.5, window=20,
+                                min_requests=10, reset_timeout=30.0,
+                                half_open_requests=1):
+        """
+        enable_circuit_breakers(failure_rate=0.5, window=20, min_requests=10,
+                                reset_timeout=30.0, half_open_requests=1)
+
+        Guard each TimeSync endpoint (times, projects, activities, users and
+        login) with its own circuit breaker. When at least ``failure_rate``
+        of the last ``window`` requests to an endpoint (and at least
+        ``min_requests`` of them) failed to connect, timed out or got a 5xx
+        response, the breaker opens: requests to that endpoint return a
+        pymesync error at once without being sent. After ``reset_timeout``
+        seconds up to ``half_open_requests`` requests at a time are let
+        through as probes; the first success closes the breaker and a failure
+        opens it again. Breaker states are reported by metrics().
+        """
+        self.__breakers = {}
+        self.__breaker_settings = {
+            "failure_rate": failure_rate, "window": window,
+            "min_requests": min_requests, "reset_timeout": reset_timeout,
+            "half_open_requests": half_open_requests}
+
+    def enable_hedging(self, percentile=95, max_extra=0.1, min_delay=0.005):
+        """
+        enable_hedging(percentile=95, max_extra=0.1, min_delay=0.005)
+
+        Hedge the GET requests made by get_times(), get_projects(),
+        get_activities(), get_users() and project_users(): when a request
+        takes longer than the ``percentile`` latency of recent requests (and
+        at least ``min_delay`` seconds), an identical request is sent and the
+        first response is used. At most ``max_extra`` (a fraction) of
+        requests are hedged. Hedging starts once a few latencies have been
+        measured. Hedge counts are reported by metrics().
+        """
+        self.__hedger = hedging.Hedger(percentile, max_extra, min_delay)
+
+    def disable_hedging(self):
+        """
+        disable_hedging()
+
+        Stop hedging GET requests.
+        """
+        self.__hedger = None
+
+    def enable_token_cache(self, path, refresh_margin=300):
+        """
+        enable_token_cache(path, refresh_margin=300)
+
+        Share tokens between processes through the file at ``path``.
+        authenticate() returns a token cached there for the same baseurl,
+        username and auth_type until ``refresh_margin`` seconds before it
+        expires, instead of logging in again. The file is locked while a
+        process checks it and logs in, so processes starting together make a
+        single login. A cached token is only reused for the password it was
+        issued for, checked against a salted PBKDF2 hash kept with it; any
+        other password logs in again. Pass None to stop using it.
+        """
+        self.__token_cache = tokens.TokenCache(path) if path else None
+        self.__token_refresh_margin = refresh_margin
+
+    def enable_cache(self, ttl=60, stale_while_revalidate=60,
+                     stale_if_error=3600, backend=None):
+        """
+        enable_cache(ttl=60, stale_while_revalidate=60, stale_if_error=3600,
+                     backend=None)
+
+        Cache the results of get_times(), get_projects(), get_activities(),
+        get_users() and project_users() for ``ttl`` seconds. For
+        ``stale_while_revalidate`` seconds after that, the cached result is
+        returned at once while it is fetched again in the background. If
+        fetching fails (TimeSync can't be reached, times out or answers with
+        a 5xx), a result up to ``stale_if_error`` seconds past its ttl is
+        returned instead of the error. Other errors, such as "Object not
+        found" or a refused permission, are returned and drop the cached
+        result. Errors are not cached. A successful create, update or delete
+        forgets this user's cached results for the endpoint it wrote to.
+
+        ``backend`` stores the entries; it defaults to a
+        ``pymesync.cache.MemoryBackend``. It may also be a url passed to
+        ``pymesync.cache.backend_from_url()``, such as
+        "sqlite:///var/cache/pymesync.db" for a cache shared by every process
+        on the host. Setting the PYMESYNC_CACHE environment variable to such
+        a url enables the cache for every new TimeSync object. Cache counts
+        are reported by metrics().
+        """
+        if isinstance(backend, six.string_types):
+            backend = cache.backend_from_url(backend)
+        self.__cache = cache.ReadCache(backend, ttl, stale_while_revalidate,
+                                       stale_if_error, self.__is_error,
+                                       self.__is_transient)
+
+    def disable_cache(self):
+        """
+        disable_cache()
+
+        Stop caching GET results.
+        """
+        self.__cache = None
+
+    def clear_cache(self):
+        """
+        clear_cache()
+
+        Forget every cached GET result, including remembered missing users
+        and projects.
+        """
+        if self.__cache is not None:
+            self.__cache.clear()
+        if self.__negative_cache is not None:
+            self.__negative_cache.clear()
+
+    def enable_negative_cache(self, ttl=30):
+        """
+        enable_negative_cache(ttl=30)
+
+        Remember for ``ttl`` seconds that get_users(username) or
+        get_projects({"slug": slug}) found no such user or project, and
+        return the same "Object not found" error again without contacting
+        TimeSync. Creating the user or project with this TimeSync object
+        (or renaming one to that username or slug) forgets it at once.
+        Counts are reported by metrics().
+        """
+        self.__negative_cache = cache.NegativeCache(ttl)
+
+    def disable_negative_cache(self):
+        """
+        disable_negative_cache()
+
+        Stop remembering missing users and projects.
+        """
+        self.__negative_cache = None
+
+    def disable_circuit_breakers(self):
+        """
+        disable_circuit_breakers()
+
+        Send every request again, whatever its endpoint's breaker state.
+        """
+        self.__breaker_settings = None
+        self.__breakers = {}
+
+    @contextlib.contextmanager
+    def request_timeout(self, timeout):
+        """
+        request_timeout(timeout)
+
+        Context manager that makes requests sent by this thread inside the
+        ``with`` block wait ``timeout`` seconds (a number, a (connect, read)
+        tuple or None) instead of ``self.timeout``.
+        """
+        context = self.__call_context
+        previous = getattr(context, "timeout", _DEFAULT_TIMEOUT)
+        context.timeout = timeout
+        try:
+            yield
+        finally:
+            context.timeout = previous
+
+    @contextlib.contextmanager
+    def deadline(self, seconds):
+        """
+        deadline(seconds)
+
+        Context manager that makes every request sent inside the ``with``
+        block, including those sent for it by worker threads (create_times(),
+        project_users_many(), prefetch()) and waits for an identical GET
+        another thread sent, finish within ``seconds`` seconds of entering
+        it. Each request's timeout is cut down to the time left; once none
+        is left, requests are not sent and return a pymesync error. Nested
+        deadlines never extend an outer one.
+        """
+        context = self.__call_context
+        previous = getattr(context, "deadline", None)
+        deadline = time.time() + seconds
+        context.deadline = deadline if previous is None else min(previous,
+                                                                 deadline)
+        try:
+            yield
+        finally:
+            context.deadline = previous
+
+    def deadline_remaining(self):
+        """
+        deadline_remaining()
+
+        Returns the seconds left before this thread's deadline() expires (0
+        once it has), or None outside a deadline() block.
+        """
+        deadline = getattr(self.__call_context, "deadline", None)
+        if deadline is None:
+            return None
+        return max(deadline - time.time(), 0)
+
     def create_project(self, project):
         """
         create_project(project)
@@ -200,7 +712,10 @@ class TimeSync(object):
         ``project`` is a python dictionary containing the project information
         to send to TimeSync.
         """
-        return self.__create_or_update(project, None, "project", "projects")
+        result = self.__create_or_update(project, None, "project", "projects")
+        self.__index_project(result)
+        self.__record_existing("projects", project, result)
+        return result
 
     def update_project(self, project, slug):
         """
@@ -216,8 +731,11 @@ class TimeSync(object):
         to send to TimeSync.
         ``slug`` contains the slug for a project entry to update.
         """
-        return self.__create_or_update(project, slug, "project", "projects",
-                                       False)
+        result = self.__create_or_update(project, slug, "project", "projects",
+                                         False)
+        self.__index_project(result)
+        self.__record_existing("projects", project, result)
+        return result
 
     def create_activity(self, activity):
         """
@@ -231,8 +749,10 @@ class TimeSync(object):
         ``activity`` is a python dictionary containing the activity information
         to send to TimeSync.
         """
-        return self.__create_or_update(activity, None,
-                                       "activity", "activities")
+        result = self.__create_or_update(activity, None,
+                                         "activity", "activities")
+        self.__record_existing("activities", activity, result)
+        return result
 
     def update_activity(self, activity, slug):
         """
@@ -248,9 +768,11 @@ class TimeSync(object):
         to send to TimeSync.
         ``slug`` contains the slug for an activity entry to update.
         """
-        return self.__create_or_update(activity, slug,
-                                       "activity", "activities",
-                                       False)
+        result = self.__create_or_update(activity, slug,
+                                         "activity", "activities",
+                                         False)
+        self.__record_existing("activities", activity, result)
+        return result
 
     def create_user(self, user):
         """
@@ -269,9 +791,11 @@ class TimeSync(object):
                 return {self.error: "user object: "
                         "{} must be True or False".format(perm)}
 
-        self.__hash_user_password(user)
+        user = self.__hash_user_password(user)
 
-        return self.__create_or_update(user, None, "user", "users")
+        result = self.__create_or_update(user, None, "user", "users")
+        self.__record_existing("users", user, result)
+        return result
 
     def update_user(self, user, username):
         """
@@ -292,9 +816,12 @@ class TimeSync(object):
                 return {self.error: "user object: "
                         "{} must be True or False".format(perm)}
 
-        self.__hash_user_password(user)
+        user = self.__hash_user_password(user)
 
-        return self.__create_or_update(user, username, "user", "users", False)
+        result = self.__create_or_update(user, username, "user", "users",
+                                         False)
+        self.__record_existing("users", user, result)
+        return result
 
     def get_times(self, query_parameters=None):
         """
@@ -309,7 +836,8 @@ class TimeSync(object):
         query parameters described in the TimeSync documentation. If
         ``query_parameters`` is empty or None, ``get_times()`` will return all
         times in the database. The syntax for each argument is
-        ``{"query": ["parameter"]}``.
+        ``{"query": ["parameter"]}``. A ``pymesync.Query`` may be passed
+        instead of a dictionary.
         """
         # Check that user has authenticated
         local_auth_error = self.__local_auth_error()
@@ -348,8 +876,7 @@ class TimeSync(object):
         # dictionary. Always returns a list.
         try:
             # Success!
-            response = requests.get(url)
-            res_dict = self.__response_to_python(response)
+            res_dict = self.__get(url)
 
             return [res_dict] if type(res_dict) is not list else res_dict
         except requests.exceptions.RequestException as e:
@@ -369,7 +896,8 @@ class TimeSync(object):
         parameters described in the TimeSync documentation. If
         ``query_parameters`` is empty or None, ``get_projects()`` will return
         all projects in the database. The syntax for each argument is
-        ``{"query": "parameter"}`` or ``{"bool_query": <boolean>}``.
+        ``{"query": "parameter"}`` or ``{"bool_query": <boolean>}``. A
+        ``pymesync.Query`` may be passed instead of a dictionary.
 
         Optional parameters:
         "slug": "<slug>"
@@ -384,8 +912,7 @@ class TimeSync(object):
         if local_auth_error:
             return [{self.error: local_auth_error}]
 
-        # Save for passing to test mode since __format_endpoints deletes
-        # kwargs["slug"] if it exists
+        # Save for passing to test mode
         if query_parameters and "slug" in query_parameters:
             slug = query_parameters["slug"]
         else:
@@ -408,6 +935,7 @@ class TimeSync(object):
         # Construct query url - at this point query_string ends with
         # ?token=self.token
         url = "{0}/projects{1}".format(self.baseurl, query_string)
+        missing_key = "projects/{}".format(slug) if slug else None
 
         # Test mode, return list of projects if slug is None, or a single
         # project
@@ -418,8 +946,7 @@ class TimeSync(object):
         # dictionary. Always returns a list.
         try:
             # Success!
-            response = requests.get(url)
-            res_dict = self.__response_to_python(response)
+            res_dict = self.__get_existing(missing_key, url)
 
             return [res_dict] if type(res_dict) is not list else res_dict
         except requests.exceptions.RequestException as e:
@@ -439,7 +966,8 @@ class TimeSync(object):
         parameters described in the TimeSync documentation. If
         ``query_parameters`` is empty or None, ``get_activities()`` will
         return all activities in the database. The syntax for each argument is
-        ``{"query": "parameter"}`` or ``{"bool_query": <boolean>}``.
+        ``{"query": "parameter"}`` or ``{"bool_query": <boolean>}``. A
+        ``pymesync.Query`` may be passed instead of a dictionary.
 
         Optional parameters:
         "slug": "<slug>"
@@ -454,8 +982,7 @@ class TimeSync(object):
         if local_auth_error:
             return [{self.error: local_auth_error}]
 
-        # Save for passing to test mode since __format_endpoints deletes
-        # kwargs["slug"] if it exists
+        # Save for passing to test mode
         if query_parameters and "slug" in query_parameters:
             slug = query_parameters["slug"]
         else:
@@ -488,8 +1015,7 @@ class TimeSync(object):
         # dictionary. Always returns a list.
         try:
             # Success!
-            response = requests.get(url)
-            res_dict = self.__response_to_python(response)
+            res_dict = self.__get(url)
 
             return [res_dict] if type(res_dict) is not list else res_dict
         except requests.exceptions.RequestException as e:
@@ -518,6 +1044,7 @@ class TimeSync(object):
         # /users/username
         url = "{0}/users/{1}".format(self.baseurl, username) if username else (
               "{}/users".format(self.baseurl))
+        missing_key = "users/{}".format(username) if username else None
 
         # The url should always end with a token
         url += "?token={}".format(self.token)
@@ -531,8 +1058,7 @@ class TimeSync(object):
         # dictionary. Always returns a list.
         try:
             # Success!
-            response = requests.get(url)
-            res_dict = self.__response_to_python(response)
+            res_dict = self.__get_existing(missing_key, url)
 
             return [res_dict] if type(res_dict) is not list else res_dict
         except requests.exceptions.RequestException as e:
@@ -683,8 +1209,7 @@ class TimeSync(object):
         # Try to get the project object
         try:
             # Success!
-            response = requests.get(url)
-            project_object = self.__response_to_python(response)
+            project_object = self.__get(url)
         except requests.exceptions.RequestException as e:
             # Request Error
             return {self.error: e}
@@ -694,19 +1219,308 @@ class TimeSync(object):
         if "error" in project_object:
             return project_object
 
-        # Get the user object from the project
-        users = project_object.setdefault("users", {})
-
         # Convert the nested permissions dict to a list containing only
         # relevant (true) permissions
-        for user in users:
-            perm = []
-            for permission in users[user]:
-                if users[user][permission] is True:
-                    perm.append(permission)
-            users[user] = perm
+        return self.__flatten_permissions(project_object.get("users", {}))
+
+    def project_users_many(self, slugs=None):
+        """
+        project_users_many(slugs)
+
+        Returns a dict mapping each project slug in ``slugs`` to the same
+        dict project_users() would return for it. All projects are fetched
+        with a single get_projects() call and cached for
+        ``self.permission_ttl`` seconds; slugs that get_projects() does not
+        return are fetched concurrently with project_users().
+
+        ``slugs`` is a list of project slugs.
+        """
+        # Check that user has authenticated
+        local_auth_error = self.__local_auth_error()
+        if local_auth_error:
+            return {self.error: local_auth_error}
+
+        if not slugs:
+            return {self.error: "Missing project slugs, please "
+                                "include in method call"}
+
+        refresh_error = self.__refresh_project_permissions()
+        if refresh_error:
+            return refresh_error
+
+        index = self.__permission_index
+        missing = [slug for slug in slugs if slug not in index]
+
+        # Fetch projects get_projects() didn't know about one at a time
+        fetched = {}
+        if missing:
+            threads = pool.ThreadPool(min(len(missing), self.max_workers))
+            try:
+                fetched = dict(zip(missing,
+                                   threads.map(
+                                       self.__in_context(self.project_users),
+                                       missing)))
+            finally:
+                threads.close()
+
+        # Fetched values are either a permission dict or an error dict
+        return dict((slug, fetched[slug] if slug in fetched else (
+                     index.project_users(slug)))
+                    for slug in slugs)
+
+    def has_permission(self, user=None, project=None, permission=None):
+        """
+        has_permission(user, project, permission)
+
+        Returns True if ``user`` has ``permission`` ("member", "spectator" or
+        "manager") on the project with slug ``project``, otherwise False. The
+        answer comes from the project permission cache, which is refreshed
+        with get_projects() every ``self.permission_ttl`` seconds. Returns
+        False if the cache cannot be refreshed.
+        """
+        if self.__local_auth_error() or self.__refresh_project_permissions():
+            return False
+
+        return self.__permission_index.has(user, project, permission)
+
+    def validate(self, objects, object_name, create_object=True):
+        """
+        validate(objects, object_name, create_object=True)
+
+        Validate a batch of objects locally, without contacting TimeSync.
+        Returns a dict mapping the index of each invalid object in
+        ``objects`` to a list of every error found in it. An empty dict means
+        every object is valid.
+
+        ``objects`` is a list of python dictionaries.
+        ``object_name`` is "time", "project", "activity" or "user".
+        ``create_object`` checks for required fields when True; pass False to
+        validate update objects.
+        """
+        if object_name not in validators.SCHEMAS:
+            return {self.error: "invalid object type: {}".format(object_name)}
+
+        return validators.validate_many(objects, object_name, create_object)
+
+    def permission_index(self):
+        """
+        permission_index()
+
+        Returns the pymesync.indexes.PermissionIndex behind has_permission(),
+        refreshing it first if it has expired. The index answers questions
+        such as "which projects can this user manage" in constant time:
+
+        ``index.projects(user, "manager")`` returns a frozenset of slugs.
+        ``index.mask(user, slug)`` returns a bitmask of
+        ``indexes.MEMBER | indexes.SPECTATOR | indexes.MANAGER``.
+
+        Returns an error dict if the index cannot be refreshed.
+        """
+        # Check that user has authenticated
+        local_auth_error = self.__local_auth_error()
+        if local_auth_error:
+            return {self.error: local_auth_error}
+
+        return self.__refresh_project_permissions() or self.__permission_index
+
+    def slug_index(self):
+        """
+        slug_index()
+
+        Returns the pymesync.indexes.SlugIndex that maps every project slug to
+        its project's uuid, refreshing it first if it has expired. The index
+        shares its refresh (and ``self.permission_ttl``) with
+        permission_index(); a refresh only re-indexes projects whose revision
+        changed.
+
+        ``index.resolve(slug)`` returns a project uuid.
+        ``index.group_times(times)`` groups get_times() results by project
+        uuid.
+
+        Returns an error dict if the index cannot be refreshed.
+        """
+        # Check that user has authenticated
+        local_auth_error = self.__local_auth_error()
+        if local_auth_error:
+            return {self.error: local_auth_error}
+
+        return self.__refresh_project_permissions() or self.__slug_index
+
+    def enable_existence_index(self, capacity=10000, error_rate=0.01,
+                               ttl=300):
+        """
+        enable_existence_index(capacity=10000, error_rate=0.01, ttl=300)
+
+        Start a new pymesync.indexes.ExistenceIndex sized for ``capacity``
+        names of each kind, with at most ``error_rate`` chance of reporting
+        that a missing name may exist. existence_index() refreshes each kind
+        of name from TimeSync when it is more than ``ttl`` seconds old.
+        Users, projects, activities and times created or updated with this
+        TimeSync object are added straight away.
+        """
+        with self.__existence_lock:
+            self.__existence_index = indexes.ExistenceIndex(capacity,
+                                                            error_rate)
+            self.__existence_ttl = ttl
+            self.__existence_refreshed = {}
+
+    def existence_index(self, kinds=("users", "projects", "activities"),
+                        refresh=False):
+        """
+        existence_index(kinds=("users", "projects", "activities"),
+                        refresh=False)
+
+        Returns the pymesync.indexes.ExistenceIndex of usernames, project
+        and activity slugs and uuids, and time entry uuids, enabling it with
+        the default settings if needed. Each of ``kinds`` ("users",
+        "projects", "activities" or "times") older than the index's ttl, or
+        every one of them if ``refresh`` is True, is first refreshed with
+        get_users(), get_projects(), get_activities() or get_times().
+        Refreshing only adds names the index doesn't have. Refreshing
+        "times" fetches every time entry.
+
+        ``index.partition(kind, names)`` returns ``(new, possible)``: the
+        names that definitely did not exist at the last refresh, and those
+        that may exist.
+
+        Returns an error dict if a kind cannot be refreshed.
+        """
+        # Check that user has authenticated
+        local_auth_error = self.__local_auth_error()
+        if local_auth_error:
+            return {self.error: local_auth_error}
+
+        for kind in kinds:
+            if kind not in indexes.EXISTENCE_FIELDS:
+                return {self.error: "invalid kind: {}".format(kind)}
+
+        return self.__refresh_existence(
+            kinds, 0 if refresh else self.__existence_ttl)
+
+    def find_existing(self, kind, names):
+        """
+        find_existing(kind, names)
+
+        Returns the list of ``names`` that exist in TimeSync. ``kind`` is
+        "users" (usernames), "projects" or "activities" (slugs) or "times"
+        (uuids). Names the existence index rules out are not looked up;
+        the rest are confirmed with one get_* call each, up to
+        ``self.max_workers`` at a time.
+
+        Returns an error dict if the index cannot be refreshed or a lookup
+        fails for a reason other than the name not existing.
+        """
+        index = self.existence_index([kind])
+        if not isinstance(index, indexes.ExistenceIndex):
+            return index
+
+        new, possible = index.partition(kind, names)
+        if not possible:
+            return []
+
+        lookups = {
+            "users": self.get_users,
+            "projects": lambda slug: self.get_projects({"slug": slug}),
+            "activities": lambda slug: self.get_activities({"slug": slug}),
+            "times": lambda uuid: self.get_times({"uuid": uuid}),
+        }
+        threads = pool.ThreadPool(min(len(possible), self.max_workers))
+        try:
+            results = threads.map(self.__in_context(lookups[kind]), possible)
+        finally:
+            threads.close()
+
+        existing = []
+        for name, result in zip(possible, results):
+            found = [obj for obj in result if not self.__is_error(obj)]
+            if found:
+                existing.append(name)
+                continue
+            for obj in result:
+                if not self.__is_not_found(obj):
+                    return obj
+        return existing
+
+    def enable_reference_validation(self, recheck=30):
+        """
+        enable_reference_validation(recheck=30)
+
+        Check the user, project and activities of every time entry against
+        the existence index (see existence_index()) before create_time() or
+        create_times() sends it. Entries naming a user, project slug or
+        activity slug that doesn't exist are rejected with an error instead
+        of being sent. Before rejecting, the kinds of names not found are
+        fetched again if that was last done more than ``recheck`` seconds
+        ago, so things created elsewhere since the last refresh are not
+        rejected. If the index cannot be refreshed, entries are sent
+        unchecked.
+        """
+        self.__reference_recheck = recheck
+
+    def disable_reference_validation(self):
+        """
+        disable_reference_validation()
 
-        return users
+        Stop checking time entry references before sending them.
+        """
+        self.__reference_recheck = None
+
+    def refresh_permissions(self):
+        """
+        refresh_permissions()
+
+        Discards the project permission cache used by project_users_many()
+        and has_permission() so the next call fetches fresh data.
+        """
+        with self.__permission_lock:
+            self.__permissions_expire = 0
+
+    def prefetch(self, method, queries, depth=2, workers=1):
+        """
+        prefetch(method, queries, depth=2, workers=1)
+
+        Call the GET method named ``method`` once for each item in ``queries``
+        and yield ``(query, result)`` tuples in order. Requests are issued in
+        background threads while the caller processes earlier results, so
+        network time and processing time overlap.
+
+        ``method`` is one of "get_times", "get_projects", "get_activities",
+        "get_users" or "project_users".
+        ``queries`` is an iterable of arguments for ``method``, such as query
+        parameter dicts or usernames. It may be a lazy generator.
+        ``depth`` is the number of requests allowed to be in flight or waiting
+        for the caller. When that many are outstanding, no further requests
+        are issued until the caller consumes a result.
+        ``workers`` is the number of requests sent at the same time.
+        """
+        if method not in self.prefetch_methods:
+            return iter([(None, [{self.error: "invalid prefetch method: "
+                                              "{}".format(method)}])])
+
+        return pipeline.prefetch(self.__in_context(getattr(self, method)),
+                                 queries, depth, workers)
+
+    def prefetch_times(self, start, end, days=7, query_parameters=None,
+                       depth=2, workers=1):
+        """
+        prefetch_times(start, end, days=7, query_parameters=None, depth=2,
+                       workers=1)
+
+        Split the dates from ``start`` to ``end`` (inclusive, "yyyy-mm-dd")
+        into shards of ``days`` days and get the times for each shard with
+        ``prefetch()``. Yields ``(query, times)`` tuples in date order.
+
+        ``query_parameters`` is an optional dict of additional get_times()
+        filters applied to every shard; it is not modified.
+        """
+        base = dict(query_parameters) if query_parameters else {}
+
+        def shard_queries():
+            for shard_start, shard_end in pipeline.date_shards(start, end,
+                                                               days):
+                yield dict(base, start=[shard_start], end=[shard_end])
+
+        return self.prefetch("get_times", shard_queries(), depth, workers)
 
 ###############################################################################
 # Internal methods
@@ -729,8 +1543,330 @@ class TimeSync(object):
         return None if self.token else ("Not authenticated with TimeSync, "
                                         "call self.authenticate() first")
 
+    def __flatten_permissions(self, users):
+        """Convert a project's nested {user: {permission: bool}} dict to a
+        dict of users mapped to their list of true permissions"""
+        return dict((user, [perm for perm, value in perms.items()
+                            if value is True])
+                    for user, perms in users.items())
+
+    def __refresh_project_permissions(self):
+        """Rebuild the project permission and slug indexes from
+        get_projects() if they have expired. Returns None on success or an
+        error dict"""
+        with self.__permission_lock:
+            if time.time() < self.__permissions_expire:
+                return None
+
+            with self.__uncached():
+                projects = self.get_projects()
+            for project in projects:
+                if self.error in project or "error" in project:
+                    return project
+
+            # Build the new index on the side so readers never see a
+            # half-built one
+            self.__permission_index = indexes.PermissionIndex(projects)
+            self.__slug_index.refresh(projects)
+            self.__permissions_expire = time.time() + self.permission_ttl
+            return None
+
+    def __refresh_existence(self, kinds, max_age):
+        """Refresh each of ``kinds`` in the existence index that was last
+        refreshed more than ``max_age`` seconds ago. Returns the index or
+        an error dict"""
+        if self.__existence_index is None:
+            self.enable_existence_index()
+
+        with self.__existence_lock:
+            index = self.__existence_index
+            for kind in kinds:
+                refreshed = self.__existence_refreshed.get(kind)
+                if refreshed is not None and (
+                        time.time() - refreshed < max_age):
+                    continue
+
+                with self.__uncached():
+                    objects = getattr(self, "get_{}".format(kind))()
+                for obj in objects:
+                    if self.__is_error(obj):
+                        return obj
+                index.update(kind, objects)
+                self.__existence_refreshed[kind] = time.time()
+        return index
+
+    def __reference_errors(self, times):
+        """Returns a dict mapping the index of each entry in ``times`` that
+        refers to an unknown user, project or activity to its errors. Returns
+        an empty dict if the existence index cannot be refreshed"""
+        def kinds(entries, index=None):
+            return sorted(set(
+                kind for entry in entries if isinstance(entry, dict)
+                for kind, singular, name in validators.time_references(entry)
+                if index is None or not index.might_exist(kind, name)))
+
+        index = self.__refresh_existence(kinds(times), self.__existence_ttl)
+        if not isinstance(index, indexes.ExistenceIndex):
+            return {}
+        errors = validators.reference_errors(times, index.might_exist)
+        if not errors:
+            return errors
+
+        # Look again for names that may have been created since the last
+        # refresh
+        index = self.__refresh_existence(
+            kinds([times[position] for position in errors], index),
+            self.__reference_recheck)
+        if not isinstance(index, indexes.ExistenceIndex):
+            return {}
+        return validators.reference_errors(times, index.might_exist)
+
+    def __index_project(self, project):
+        """Keep the project indexes current after a project is created or
+        updated"""
+        if not isinstance(project, dict) or "error" in project or (
+                self.error in project):
+            return
+
+        with self.__permission_lock:
+            if self.__permissions_expire:
+                self.__permission_index.update(project)
+                self.__slug_index.update(project)
+
+    def __get(self, url):
+        """GET ``url`` and convert the response to python. Concurrent calls
+        for the same url share one request, and results are cached if
+        enable_cache() was called"""
+        read_cache = self.__cache
+        if read_cache is None:
+            return self.__shared_fetch(url)
+        if getattr(self.__call_context, "uncached", False):
+            # Fetch a fresh result, but keep it for later cached reads
+            result = self.__shared_fetch(url)
+            if not self.__is_error(result):
+                read_cache.set(self.__cache_key(url), result)
+            return result
+        return read_cache.get(self.__cache_key(url),
+                              lambda: self.__shared_fetch(url))
+
+    def __shared_fetch(self, url):
+        """GET ``url``, sharing the request with an identical one already in
+        flight. Waiting for that one is bounded by this thread's timeout and
+        deadline like a request of its own; raises
+        requests.exceptions.Timeout when they run out"""
+        timeout = self.__request_timeout()
+        if isinstance(timeout, tuple):
+            timeout = None if None in timeout else sum(timeout)
+        try:
+            return self.__single_flight.do(url, self.__fetch, url,
+                                           timeout=timeout)
+        except singleflight.Timeout:
+            raise requests.exceptions.Timeout(
+                "timed out waiting for an identical request to {}".format(
+                    self.baseurl))
+
+    def __get_existing(self, missing_key, url):
+        """GET ``url``, a lookup of one user or project named by
+        ``missing_key`` (e.g. "users/malcolm"), answering from the negative
+        cache if it is known not to exist"""
+        negative_cache = self.__negative_cache
+        if negative_cache is None or missing_key is None:
+            return self.__get(url)
+
+        result = negative_cache.get(missing_key)
+        if result is not None:
+            return result
+        result = self.__get(url)
+        if self.__is_not_found(result):
+            negative_cache.add(missing_key, result)
+        return result
+
+    def __record_existing(self, endpoint, obj, result):
+        """After ``obj`` was created or updated, drop its username or slugs
+        from the negative cache and add it to the existence index"""
+        if not isinstance(result, dict) or self.__is_error(result):
+            return
+
+        negative_cache = self.__negative_cache
+        if negative_cache is not None:
+            if endpoint == "projects":
+                names = obj.get("slugs") or []
+            elif endpoint == "users":
+                names = [obj.get("username")]
+            else:
+                names = []
+            for name in names:
+                if name:
+                    negative_cache.discard("{0}/{1}".format(endpoint, name))
+
+        existence_index = self.__existence_index
+        if existence_index is not None:
+            existence_index.update(endpoint, [result])
+
+    def __cache_key(self, url):
+        """Returns ``url`` without its token, qualified by the user it was
+        requested for"""
+        return "{0} {1}".format(self.__cache_user(),
+                                _TOKEN_PARAMETER.sub("", url))
+
+    def __cache_user(self):
+        """Returns the part of a cache key naming the user the request was
+        made for"""
+        return self.user or hashlib.sha1(
+            six.text_type(self.token).encode("utf-8")).hexdigest()
+
+    def __invalidate(self, endpoint, result):
+        """After a write to ``endpoint`` returned ``result``, forget this
+        user's cached reads of that endpoint unless the write failed"""
+        read_cache = self.__cache
+        if read_cache is None or self.__is_error(result):
+            return
+        read_cache.invalidate_prefix("{0} {1}/{2}".format(
+            self.__cache_user(), self.baseurl, endpoint))
+
+    @contextlib.contextmanager
+    def __uncached(self):
+        """Context manager that makes this thread's GET requests skip the
+        read cache, for lookups that must see TimeSync's current state"""
+        context = self.__call_context
+        previous = getattr(context, "uncached", False)
+        context.uncached = True
+        try:
+            yield
+        finally:
+            context.uncached = previous
+
+    def __is_error(self, result):
+        return isinstance(result, dict) and (
+            self.error in result or "error" in result)
+
+    def __is_transient(self, result):
+        """Returns True if ``result`` is an error that may not happen again
+        (see writebehind.is_transient())"""
+        return writebehind.is_transient(result, self.error)
+
+    def __is_not_found(self, result):
+        """Returns True if ``result`` is TimeSync's "Object not found"
+        error"""
+        return isinstance(result, dict) and (
+            result.get("status") == 404 or
+            result.get("error") == "Object not found")
+
+    def __fetch(self, url):
+        hedger = self.__hedger
+        if hedger is None:
+            response = self.__request(requests.get, url)
+        else:
+            # The hedge runs in another thread, which needs this thread's
+            # timeout and deadline
+            response = hedger.call(self.__in_context(self.__request),
+                                   requests.get, url)
+        return self.__response_to_python(response)
+
+    def __request(self, method, url, **kwargs):
+        """Send an HTTP request with ``method`` (requests.get, post or
+        delete), waiting for a free connection if connection_limit is set"""
+        timeout = self.__request_timeout()
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+
+        circuit = self.__breaker(url)
+        if circuit is None:
+            return self.__send(method, url, kwargs)
+
+        if not circuit.allow():
+            return breaker.Rejection(
+                "{0}{1}/{2}; not retrying for {3:.1f} seconds".format(
+                    breaker.REJECTED, self.baseurl, self.__endpoint(url),
+                    circuit.retry_after()))
+        try:
+            response = self.__send(method, url, kwargs)
+        except Exception:
+            circuit.record(False)
+            raise
+        # 5xx responses mean TimeSync is unhealthy; anything else, including
+        # a rejected request, means it is answering
+        status = getattr(response, "status_code", None)
+        circuit.record(not isinstance(status, int) or status < 500)
+        return response
+
+    def __send(self, method, url, kwargs):
+        """Send the request, holding a connection_limit slot if set"""
+        limit = self.connection_limit
+        if limit is None:
+            return method(url, **kwargs)
+        with limit:
+            return method(url, **kwargs)
+
+    def __endpoint(self, url):
+        """Returns the endpoint ("times", "login", ...) ``url`` is for"""
+        return url[len(self.baseurl) + 1:].split("?")[0].split("/")[0]
+
+    def __breaker(self, url):
+        """Returns the circuit breaker for ``url``'s endpoint, or None if
+        circuit breakers are disabled"""
+        settings = self.__breaker_settings
+        if settings is None:
+            return None
+
+        endpoint = self.__endpoint(url)
+        circuit = self.__breakers.get(endpoint)
+        if circuit is None:
+            circuit = self.__breakers.setdefault(
+                endpoint, breaker.CircuitBreaker(**settings))
+        return circuit
+
+    def __request_timeout(self):
+        """Returns the timeout for a request made now on this thread, cut
+        down to the time left before the thread's deadline. Raises
+        requests.exceptions.Timeout without sending anything if the deadline
+        has passed"""
+        context = self.__call_context
+        timeout = getattr(context, "timeout", _DEFAULT_TIMEOUT)
+        if timeout is _DEFAULT_TIMEOUT:
+            timeout = self.timeout
+
+        deadline = getattr(context, "deadline", None)
+        if deadline is None:
+            return timeout
+
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise requests.exceptions.Timeout(
+                "deadline exceeded; request to {} not sent".format(
+                    self.baseurl))
+        if timeout is None:
+            return remaining
+        if isinstance(timeout, tuple):
+            return tuple(remaining if part is None else min(part, remaining)
+                         for part in timeout)
+        return min(timeout, remaining)
+
+    def __in_context(self, function):
+        """Returns a wrapper that runs ``function`` with the calling thread's
+        timeout override and deadline, for handing work to other threads"""
+        context = self.__call_context
+        timeout = getattr(context, "timeout", _DEFAULT_TIMEOUT)
+        deadline = getattr(context, "deadline", None)
+
+        def call(*args):
+            worker = self.__call_context
+            saved = (getattr(worker, "timeout", _DEFAULT_TIMEOUT),
+                     getattr(worker, "deadline", None))
+            worker.timeout, worker.deadline = timeout, deadline
+            try:
+                return function(*args)
+            finally:
+                worker.timeout, worker.deadline = saved
+
+        return call
+
     def __response_to_python(self, response):
         """Convert response to native python list of objects"""
+        # The circuit breaker refused to send the request
+        if isinstance(response, breaker.Rejection):
+            return {self.error: response.message}
+
         # DELETE returns an empty body if successful
         if not response.text and response.status_code == 200:
             return {"status": 200}
@@ -757,128 +1893,27 @@ class TimeSync(object):
     def __format_endpoints(self, queries):
         """Format endpoints for GET projects and activities requests. Returns
         None if invalid combination of slug and include_deleted"""
-        query_string = "?"
-        query_list = []
-
-        # The following combination is not allowed
-        if "slug" in queries and "include_deleted" in queries:
+        query_string = query.Query.from_filters(queries).endpoint_string()
+        if query_string is None:
             return None
-        # slug goes first, then delete it so it doesn't show up after the ?
-        elif "slug" in queries:
-            query_string = "/{}?".format(queries["slug"])
-            del(queries["slug"])
-
-        # Check for the "user" field for a get_projects query
-        if "user" in queries:
-            for user in queries["user"]:
-                query_list.append("{0}={1}".format("user", user))
-
-            # Delete "user" so the code below doesn't try to use it
-            del(queries["user"])
-
-        # Convert True and False booleans to TimeSync compatible strings
-        for k, v in sorted(queries.items(), key=operator.itemgetter(0)):
-            queries[k] = "true" if v else "false"
-            query_list.append("{0}={1}".format(k, queries[k]))
-
-        # Check for items in query_list after slug was removed, create
-        # query string
-        if query_list:
-            query_string += "{}&".format("&".join(query_list))
 
         # Authenticate and return
-        query_string += "token={}".format(self.token)
-
-        return query_string
+        return "{0}token={1}".format(query_string, self.token)
 
     def __construct_filter_query(self, queries):
         """Construct the query string for filtering GET queries, such as
         get_times()"""
-        query_string = "?"
-        query_list = []
-
-        # Format the include_* queries similarly to other queries for easier
-        # processing
-        if "include_deleted" in queries.keys():
-            queries["include_deleted"] = (["true"]
-                                          if queries["include_deleted"]
-                                          else ["false"])
-
-        if "include_revisions" in queries.keys():
-            queries["include_revisions"] = (["true"]
-                                            if queries["include_revisions"]
-                                            else ["false"])
-
-        # If uuid is included, the only other accepted queries are the
-        # include_*s
-        if "uuid" in queries.keys():
-            query_string = "/{}?".format(queries["uuid"])
-            if "include_deleted" in queries.keys():
-                query_string += "include_deleted={}&".format(
-                    queries["include_deleted"][0])
-            if "include_revisions" in queries.keys():
-                query_string += "include_revisions={}&".format(
-                    queries["include_revisions"][0])
-
-        # Everthing is a list now, so iterate through and append
-        else:
-            # If "start" or "end" parameters are strings, convert them to
-            # single-item lists internally so the query string construction
-            # below can process them
-            if "start" in queries and isinstance(queries["start"], basestring):
-                queries["start"] = [queries["start"]]
-
-            if "end" in queries and isinstance(queries["end"], basestring):
-                queries["end"] = [queries["end"]]
-
-            # Sort them into an alphabetized list for easier testing
-            sorted_qs = sorted(queries.items(), key=operator.itemgetter(0))
-            for query, param in sorted_qs:
-                for slug in param:
-                    # Format each query in the list
-                    query_list.append("{0}={1}".format(query, slug))
-
-            # Construct the query_string using the list.
-            # Last character will be an & so we can append the token
-            for string in query_list:
-                query_string += "{}&".format(string)
-
-        return query_string
+        return query.Query.from_filters(queries).filter_string()
 
     def __get_field_errors(self, actual, object_name, create_object):
         """Checks that ``actual`` parameter passed to POST method contains
         items in required or optional lists for that ``object_name``.
         Returns None if no errors found or error string if error found. If
         ``create_object`` then ``actual`` gets checked for required fields"""
-        # Check that actual is a python dict
-        if not isinstance(actual, dict):
-            return "{} object: must be python dictionary".format(object_name)
-
-        # missing_list contains a list of all the required parameters that were
-        # not passed. It is initialized to all required parameters.
-        missing_list = list(self.required_params[object_name])
-
-        # For each key, if it is not required or optional, it is not allowed
-        # If it is requried, remove that parameter from the missing_list, since
-        # it is no longer missing
-        for key in actual:
-            if (key not in self.required_params[object_name]
-                    and key not in self.optional_params[object_name]):
-                return "{0} object: invalid field: {1}".format(object_name,
-                                                               key)
-
-            # Remove field from copied list if the field is in required
-            if key in self.required_params[object_name]:
-                del(missing_list[missing_list.index(key)])
-
-        # If there is anything in missing_list, it is an absent required field
-        # This only needs to be checked if the create_object flag is passed
-        if create_object and missing_list:
-            return "{0} object: missing required field(s): {1}".format(
-                object_name, ", ".join(missing_list))
-
-        # No errors if we made it this far
-        return None
+        # The schema reports invalid fields first, then missing required
+        # fields (only checked if create_object), then bad field types
+        return validators.SCHEMAS[object_name].first_error(actual,
+                                                           create_object)
 
     def __create_or_update(self, object_fields, identifier,
                            object_name, endpoint, create_object=True):
@@ -922,11 +1957,81 @@ class TimeSync(object):
         # dictionary
         try:
             # Success!
-            response = requests.post(url, json=values)
-            return self.__response_to_python(response)
+            response = self.__request(requests.post, url, json=values)
+            result = self.__response_to_python(response)
         except requests.exceptions.RequestException as e:
             # Request error
             return {self.error: e}
+        self.__invalidate(endpoint, result)
+        return result
+
+    def __submit_time(self, time):
+        """Create ``time`` (durations already converted), skipping entries
+        that were already submitted when idempotency is enabled"""
+        key_journal = self.__idempotency_journal
+        if key_journal is None:
+            return self.__create_or_update(time, None, "time", "times")
+
+        # Don't reserve a key for an entry TimeSync would reject anyway
+        local_error = self.__local_auth_error() or self.__get_field_errors(
+            time, "time", True)
+        if local_error:
+            return {self.error: local_error}
+
+        key = journal.time_key(time)
+        if not key_journal.reserve(key):
+            if key in key_journal:
+                # Already created; retrying it is not a failure
+                return {"status": "duplicate", "key": key}
+            return {self.error: "time object: entry is being submitted by "
+                                "another worker ({})".format(key)}
+
+        try:
+            # The entry may have been created by a run that died before it
+            # could write the journal
+            with self.__uncached():
+                existing = self.get_times({"user": [time["user"]],
+                                           "project": [time["project"]],
+                                           "start": [time["date_worked"]],
+                                           "end": [time["date_worked"]]})
+            for entry in existing:
+                if self.error in entry or "error" in entry:
+                    key_journal.release(key)
+                    return entry
+                if journal.same_time(time, entry):
+                    key_journal.commit(key)
+                    return entry
+
+            result = self.__create_or_update(time, None, "time", "times")
+        except Exception:
+            key_journal.release(key)
+            raise
+
+        if isinstance(result, dict) and self.error not in result and (
+                "error" not in result):
+            key_journal.commit(key)
+        else:
+            key_journal.release(key)
+        return result
+
+    def __queue_time(self, operation, time, identifier):
+        """Check ``time`` locally, then append it to the write-behind
+        journal"""
+        local_error = self.__local_auth_error() or self.__get_field_errors(
+            time, "time", operation == "create_time")
+        if local_error:
+            return {self.error: local_error}
+
+        return {"status": "queued",
+                "id": self.__write_behind.enqueue(operation, time,
+                                                  identifier)}
+
+    def __send_queued_time(self, operation, time, identifier):
+        """Send a time entry taken from the write-behind journal"""
+        if operation == "create_time":
+            return self.__submit_time(time)
+        return self.__create_or_update(time, identifier, "time", "times",
+                                       False)
 
     def __duration_to_seconds(self, duration):
         """When a time_entry is created, a user will enter a time duration as
@@ -934,20 +2039,15 @@ class TimeSync(object):
            entry (if it's entered as a string) into the appropriate integer
            equivalent (in seconds).
         """
-        try:
-            t = time.strptime(duration, "%Hh%Mm")
-            hours_spent = t.tm_hour
-            minutes_spent = t.tm_min
-
-            # Convert duration to seconds
-            return (hours_spent * 3600) + (minutes_spent * 60)
-        except:
-            error_msg = [{self.error: "time object: invalid duration string"}]
-            return error_msg
+        seconds = durations.parse_duration(duration)
+        if seconds is None:
+            return [{self.error: "time object: invalid duration string"}]
+        return seconds
 
     def __hash_user_password(self, user):
-        """Hashes the password field in a user object. If the password is
-        Unicode, encode it to UTF-8 first"""
+        """Returns a copy of a user object with the password field hashed. If
+        the password is Unicode, encode it to UTF-8 first"""
+        user = dict(user)
         # Only hash password if it is present
         # Don't error out here so that internal methods can catch all missing
         # fields later on and return a more meaningful error if necessary.
@@ -963,6 +2063,8 @@ class TimeSync(object):
                                                             rounds=10))
             user["password"] = hashed
 
+        return user
+
     def __delete_object(self, endpoint, identifier):
         """Deletes object at ``endpoint`` identified by ``identifier``"""
         # Construct url
@@ -978,11 +2080,13 @@ class TimeSync(object):
         # Attempt to DELETE object
         try:
             # Success!
-            response = requests.delete(url)
-            return self.__response_to_python(response)
+            response = self.__request(requests.delete, url)
+            result = self.__response_to_python(response)
         except requests.exceptions.RequestException as e:
             # Request error
             return {self.error: e}
+        self.__invalidate(endpoint, result)
+        return result
 
     def __test_handler(self, parameters, identifier, obj_name, create_object):
         """Handle test methods in test mode for creating or updating an
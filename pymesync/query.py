@@ -0,0 +1,130 @@
+"""
+pymesync.query - Immutable filters for the TimeSync get_* methods
+
+- Query - Canonical, hashable query parameters that cache their encoded
+  query strings
+"""
+
+from __future__ import unicode_literals
+
+import six
+from six.moves.urllib.parse import quote
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    # Python 2
+    from collections import Mapping
+
+
+def _freeze(value):
+    """Lists become tuples so the query can be hashed; other values are kept
+    as they are"""
+    if isinstance(value, (list, tuple)):
+        return tuple(value)
+    return value
+
+
+def _values(value):
+    """Returns ``value`` as a tuple of one or more values"""
+    return value if isinstance(value, tuple) else (value,)
+
+
+def _quote(value):
+    """URL-encode one query value"""
+    if isinstance(value, bool):
+        value = "true" if value else "false"
+    value = six.text_type(value)
+    if six.PY2:
+        value = value.encode("utf-8")
+    return quote(value, safe="")
+
+
+class Query(Mapping):
+    """Read-only mapping of get_* query parameters.
+
+    Values are stored in canonical form (lists become tuples) and keys are
+    kept in sorted order, so two queries with the same filters are equal,
+    hash the same and can be used as cache keys. The encoded query strings
+    are built once per query and reused, so the same Query can be passed to
+    get_times(), get_projects() or get_activities() any number of times.
+    Queries are never modified by pymesync.
+
+    Values are written the same way the get_* methods document them::
+
+        Query(user=["malcolm", "jayne"], start="2016-01-01")
+        Query({"slug": "pyme", "include_revisions": True})
+    """
+
+    __slots__ = ("_items", "_hash", "_encoded")
+
+    def __init__(self, filters=None, **kwargs):
+        items = dict(filters or {}, **kwargs)
+        self._items = tuple(sorted((key, _freeze(value))
+                                   for key, value in items.items()))
+        self._hash = None
+        self._encoded = {}
+
+    @classmethod
+    def from_filters(cls, filters):
+        """Returns ``filters`` if it is already a Query, otherwise a new Query
+        built from the ``filters`` dict"""
+        return filters if isinstance(filters, cls) else cls(filters)
+
+    def __getitem__(self, key):
+        for name, value in self._items:
+            if name == key:
+                return value
+        raise KeyError(key)
+
+    def __iter__(self):
+        return (name for name, _ in self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash(self._items)
+        return self._hash
+
+    def __repr__(self):
+        return "Query({!r})".format(dict(self._items))
+
+    def filter_string(self):
+        """Returns the get_times() query string: ``"?"`` or ``"/uuid?"``
+        followed by ``name=value&`` for each filter, ready for the token to be
+        appended. With a uuid, only the include_* filters are sent"""
+        if "filter" not in self._encoded:
+            if "uuid" in self:
+                prefix = "/{}?".format(_quote(self["uuid"]))
+                items = [(name, value) for name, value in self._items
+                         if name in ("include_deleted", "include_revisions")]
+            else:
+                prefix = "?"
+                items = self._items
+            self._encoded["filter"] = prefix + "".join(
+                "{0}={1}&".format(name, _quote(value))
+                for name, values in items for value in _values(values))
+        return self._encoded["filter"]
+
+    def endpoint_string(self):
+        """Returns the get_projects() and get_activities() query string:
+        ``"?"`` or ``"/slug?"`` followed by ``name=value&`` for each filter,
+        ready for the token to be appended. Users come first; the other
+        filters besides slug are sent as "true" or "false". Returns None for
+        the invalid combination of slug and include_deleted"""
+        if "endpoint" not in self._encoded:
+            if "slug" in self and "include_deleted" in self:
+                encoded = None
+            else:
+                parts = ["user={}".format(_quote(user))
+                         for user in _values(self.get("user", ()))]
+                parts.extend("{0}={1}".format(name, _quote(bool(value)))
+                             for name, value in self._items
+                             if name not in ("slug", "user"))
+                encoded = "{0}?{1}".format(
+                    "/{}".format(_quote(self["slug"])) if "slug" in self
+                    else "", "".join(part + "&" for part in parts))
+            self._encoded["endpoint"] = encoded
+        return self._encoded["endpoint"]
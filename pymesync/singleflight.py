@@ -0,0 +1,93 @@
+"""
+pymesync.singleflight - Share one call between concurrent identical requests
+
+- SingleFlight - Runs a function once per key while callers are waiting on it
+- Timeout - Raised to a caller that stopped waiting for another's call
+"""
+
+from __future__ import unicode_literals
+
+import copy
+import sys
+import threading
+
+import six
+
+
+class Timeout(Exception):
+    """Raised to a follower whose timeout passed before the leader's call
+    returned"""
+
+
+class _Call(object):
+    """A call in flight; followers wait on ``done``"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+        self.followers = 0
+
+
+class SingleFlight(object):
+    """Deduplicates concurrent calls by key. The first caller for a key (the
+    leader) runs the function; callers arriving with the same key before it
+    returns wait for it and get a deep copy of its result, or have its
+    exception re-raised. Nothing is cached: once the leader returns, the next
+    call for that key runs the function again."""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__calls = {}
+        self.__counts = {"calls": 0, "shared": 0}
+
+    def do(self, key, function, *args, **options):
+        """Returns ``function(*args)``, sharing the call with any concurrent
+        caller using the same ``key``. If the ``timeout`` option is given
+        and not None, a follower waits at most that many seconds for the
+        leader, then raises Timeout"""
+        timeout = options.pop("timeout", None)
+        if options:
+            raise TypeError("unexpected options: {}".format(
+                ", ".join(sorted(options))))
+
+        with self.__lock:
+            self.__counts["calls"] += 1
+            call = self.__calls.get(key)
+            if call is not None:
+                call.followers += 1
+                self.__counts["shared"] += 1
+                leader = False
+            else:
+                call = self.__calls[key] = _Call()
+                leader = True
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise Timeout("gave up after {0} seconds waiting for an "
+                              "identical request".format(timeout))
+            if call.exc_info:
+                six.reraise(*call.exc_info)
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = function(*args)
+        except Exception:
+            call.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self.__lock:
+                del self.__calls[key]
+            call.done.set()
+
+        if call.followers:
+            # Followers copy the result, so the leader's copy must not be
+            # handed out before they have it
+            return copy.deepcopy(call.result)
+        return call.result
+
+    def metrics(self):
+        """Returns the number of calls made and how many of them shared
+        another caller's request"""
+        with self.__lock:
+            return dict(self.__counts)
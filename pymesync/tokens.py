@@ -0,0 +1,108 @@
+"""
+pymesync.tokens - Tokens shared between processes through a file
+
+- TokenCache - JSON file of tokens keyed by baseurl, username and auth_type,
+  locked while it is read and written, each only returned for the password
+  it was issued for
+"""
+
+from __future__ import unicode_literals
+
+import binascii
+import contextlib
+import hashlib
+import hmac
+import io
+import json
+import os
+import threading
+import time
+
+import six
+
+from . import files
+
+# PBKDF2-HMAC-SHA256 rounds for new password verifiers
+VERIFIER_ITERATIONS = 100000
+
+
+class TokenCache(object):
+    """Tokens for ``(baseurl, username, auth_type)`` stored in the JSON file
+    at ``path`` (readable only by its owner) with their expiry times and a
+    salted PBKDF2 verifier of the password they were issued for. A token is
+    only returned for a matching password. Hold lock() while checking for a
+    token and logging in, so that processes starting together wait for one
+    login instead of each making their own."""
+
+    def __init__(self, path):
+        self.path = path
+        self.__thread_lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def lock(self):
+        """Context manager holding an exclusive lock on the cache, between
+        threads and (where fcntl is available) between processes"""
+        with self.__thread_lock:
+            with files.locked("{}.lock".format(self.path)):
+                yield
+
+    def get(self, baseurl, username, auth_type, password, margin=0):
+        """Returns the cached token if it was issued for ``password`` and is
+        valid for more than ``margin`` seconds, otherwise None"""
+        entry = self.__read().get(self.__key(baseurl, username, auth_type))
+        if not entry or entry["expires"] - margin <= time.time():
+            return None
+        try:
+            verifier = self.__verifier(password, entry["salt"],
+                                       entry["iterations"])
+            matches = hmac.compare_digest(verifier, entry["verifier"])
+        except (KeyError, TypeError, ValueError):
+            # Written without a verifier or damaged; log in again
+            return None
+        return entry["token"] if matches else None
+
+    def set(self, baseurl, username, auth_type, password, token, expires):
+        """Store ``token``, issued for ``password`` and expiring at the epoch
+        time ``expires``. Expired tokens are dropped at the same time"""
+        now = time.time()
+        entries = dict((key, entry) for key, entry in self.__read().items()
+                       if entry["expires"] > now)
+        salt = binascii.hexlify(os.urandom(16)).decode("ascii")
+        entries[self.__key(baseurl, username, auth_type)] = {
+            "token": token, "expires": expires, "salt": salt,
+            "iterations": VERIFIER_ITERATIONS,
+            "verifier": self.__verifier(password, salt,
+                                        VERIFIER_ITERATIONS)}
+        self.__write(entries)
+
+    def delete(self, baseurl, username, auth_type):
+        """Forget the token for ``username``"""
+        entries = self.__read()
+        if entries.pop(self.__key(baseurl, username, auth_type), None):
+            self.__write(entries)
+
+    def __key(self, baseurl, username, auth_type):
+        return json.dumps([baseurl, username, auth_type])
+
+    def __verifier(self, password, salt, iterations):
+        """Returns the hex PBKDF2-HMAC-SHA256 of ``password`` with the hex
+        ``salt``"""
+        digest = hashlib.pbkdf2_hmac(
+            "sha256", six.text_type(password).encode("utf-8"),
+            binascii.unhexlify(salt), iterations)
+        return binascii.hexlify(digest).decode("ascii")
+
+    def __read(self):
+        try:
+            with io.open(self.path, "r", encoding="utf-8") as handle:
+                return json.load(handle)
+        except (IOError, OSError, ValueError):
+            # Missing or unreadable; treat as empty
+            return {}
+
+    def __write(self, entries):
+        tmp_path = "{}.tmp".format(self.path)
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with io.open(fd, "w", encoding="utf-8") as handle:
+            handle.write(six.text_type(json.dumps(entries, sort_keys=True)))
+        files.replace(tmp_path, self.path)
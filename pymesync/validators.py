@@ -0,0 +1,205 @@
+"""
+pymesync.validators - Precompiled field validation for TimeSync objects
+
+- SCHEMAS - Schema for each object type ("time", "project", "activity",
+  "user")
+- validate_many(objects, object_name, create_object) - Validate a batch of
+  objects, reporting every error for every invalid object
+- time_references(time) - The users, projects and activities a time entry
+  refers to
+- reference_errors(times, exists) - Report time entries that refer to
+  unknown users, projects or activities
+"""
+
+from __future__ import unicode_literals
+
+import re
+import sys
+
+
+if sys.version_info[0] >= 3:
+    basestring = (str, bytes)
+    integer_types = (int,)
+else:
+    integer_types = (int, long)  # noqa flake8 ignore
+
+
+REQUIRED_PARAMS = {
+    "time":     ("duration", "project", "user", "date_worked"),
+    "project":  ("name", "slugs"),
+    "activity": ("name", "slug"),
+    "user":     ("username", "password"),
+}
+
+OPTIONAL_PARAMS = {
+    "time":     ("notes", "issue_uri", "activities"),
+    "project":  ("uri", "users", "default_activity"),
+    "activity": (),
+    "user":     ("display_name", "email", "site_admin", "site_spectator",
+                 "site_manager", "meta", "active"),
+}
+
+# Time entry fields that name other objects: (field, kind, singular)
+TIME_REFERENCES = (("user", "users", "user"),
+                   ("project", "projects", "project"),
+                   ("activities", "activities", "activity"))
+
+_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_SLUG = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+def _is_string(value):
+    return isinstance(value, basestring)
+
+
+def _is_duration(value):
+    # Strings are converted to seconds before they are sent to TimeSync
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, integer_types):
+        return value >= 0
+    return _is_string(value)
+
+
+def _is_date(value):
+    return _is_string(value) and _DATE.match(value) is not None
+
+
+def _is_slug(value):
+    return _is_string(value) and _SLUG.match(value) is not None
+
+
+def _is_slug_list(value):
+    return isinstance(value, (list, tuple)) and all(_is_slug(v)
+                                                    for v in value)
+
+
+def _is_bool(value):
+    return isinstance(value, bool)
+
+
+def _is_dict(value):
+    return isinstance(value, dict)
+
+
+_CHECKS = {
+    "time": {
+        "duration": (_is_duration, "duration must be a positive integer or "
+                                   "duration string"),
+        "project": (_is_slug, "project must be a slug"),
+        "user": (_is_string, "user must be a string"),
+        "date_worked": (_is_date, "date_worked must be a yyyy-mm-dd string"),
+        "activities": (_is_slug_list, "activities must be a list of slugs"),
+    },
+    "project": {
+        "name": (_is_string, "name must be a string"),
+        "slugs": (_is_slug_list, "slugs must be a list of slugs"),
+        "users": (_is_dict, "users must be a python dictionary"),
+        "default_activity": (_is_slug, "default_activity must be a slug"),
+    },
+    "activity": {
+        "name": (_is_string, "name must be a string"),
+        "slug": (_is_slug, "slug must be a slug"),
+    },
+    "user": {
+        "username": (_is_string, "username must be a string"),
+        "site_admin": (_is_bool, "site_admin must be True or False"),
+        "site_manager": (_is_bool, "site_manager must be True or False"),
+        "site_spectator": (_is_bool, "site_spectator must be True or False"),
+        "active": (_is_bool, "active must be True or False"),
+    },
+}
+
+
+class Schema(object):
+    """Field rules for one TimeSync object type, compiled once into frozen
+    sets and a field -> check table"""
+
+    def __init__(self, name, required, optional, checks=None):
+        self.name = name
+        self.required = tuple(required)
+        self.optional = tuple(optional)
+        self.required_set = frozenset(self.required)
+        self.allowed = frozenset(self.required + self.optional)
+        self.checks = dict(checks or {})
+        self.prefix = "{} object: ".format(name)
+
+    def errors(self, actual, create_object=True):
+        """Returns a list of every error in ``actual``: unknown fields, then
+        missing required fields (only if ``create_object``), then fields with
+        a bad type or format. An empty list means ``actual`` is valid"""
+        if not isinstance(actual, dict):
+            return [self.prefix + "must be python dictionary"]
+
+        errors = [self.prefix + "invalid field: {}".format(key)
+                  for key in actual if key not in self.allowed]
+
+        if create_object:
+            missing = self.required_set.difference(actual)
+            if missing:
+                errors.append(self.prefix +
+                              "missing required field(s): {}".format(
+                                  ", ".join(field for field in self.required
+                                            if field in missing)))
+
+        checks = self.checks
+        for key, value in actual.items():
+            if key in checks and not checks[key][0](value):
+                errors.append(self.prefix + checks[key][1])
+
+        return errors
+
+    def first_error(self, actual, create_object=True):
+        """Returns the first error string for ``actual`` or None"""
+        errors = self.errors(actual, create_object)
+        return errors[0] if errors else None
+
+    def validate_many(self, objects, create_object=True):
+        """Returns a dict mapping the index of each invalid object in
+        ``objects`` to its list of errors"""
+        errors = self.errors
+        invalid = {}
+        for index, actual in enumerate(objects):
+            found = errors(actual, create_object)
+            if found:
+                invalid[index] = found
+        return invalid
+
+
+SCHEMAS = dict((name, Schema(name, REQUIRED_PARAMS[name],
+                             OPTIONAL_PARAMS[name], _CHECKS.get(name)))
+               for name in REQUIRED_PARAMS)
+
+
+def validate_many(objects, object_name, create_object=True):
+    """Validate every object in ``objects`` against the ``object_name``
+    schema. Returns a dict mapping the index of each invalid object to its
+    list of errors; an empty dict means every object is valid"""
+    return SCHEMAS[object_name].validate_many(objects, create_object)
+
+
+def time_references(time):
+    """Yield ``(kind, singular, name)`` for each username, project slug and
+    activity slug the time entry ``time`` refers to"""
+    for field, kind, singular in TIME_REFERENCES:
+        value = time.get(field)
+        for name in value if isinstance(value, (list, tuple)) else [value]:
+            if _is_string(name) and name:
+                yield kind, singular, name
+
+
+def reference_errors(times, exists):
+    """Check the references of every time entry in ``times`` with
+    ``exists(kind, name)``, where kind is "users", "projects" or
+    "activities". Returns a dict mapping the index of each entry with an
+    unknown reference to its list of errors"""
+    prefix = SCHEMAS["time"].prefix
+    invalid = {}
+    for index, time in enumerate(times):
+        if not isinstance(time, dict):
+            continue
+        for kind, singular, name in time_references(time):
+            if not exists(kind, name):
+                invalid.setdefault(index, []).append(
+                    prefix + "unknown {0}: {1}".format(singular, name))
+    return invalid
@@ -0,0 +1,309 @@
+"""
+pymesync.writebehind - Durable write-behind queue for time submissions
+
+- WriteBehindQueue - Appends submissions to a local journal file and sends
+  them from a background thread in batches, with retries
+"""
+
+from __future__ import unicode_literals
+
+import collections
+import io
+import json
+import os
+import threading
+import time
+
+from . import breaker
+from . import files
+
+
+# Completions within this many seconds count towards the drain rate
+RATE_WINDOW = 60.0
+
+
+def is_transient(result, error_key):
+    """Returns True if ``result`` is an error worth retrying: a request that
+    failed, timed out or was refused by a circuit breaker (a pymesync error
+    holding the exception or the breaker's message), or a TimeSync error
+    other than a 4xx rejection. Entries pymesync rejected without sending
+    them are not"""
+    if not isinstance(result, dict):
+        return False
+    if error_key in result:
+        error = result[error_key]
+        return isinstance(error, Exception) or breaker.is_rejection(error)
+    status = result.get("status")
+    return "error" in result and not (
+        isinstance(status, int) and 400 <= status < 500)
+
+
+def is_error(result, error_key):
+    return not isinstance(result, dict) or error_key in result or (
+        "error" in result)
+
+
+class WriteBehindQueue(object):
+    """Queue of ``(operation, object, identifier)`` submissions backed by an
+    append-only JSON lines journal at ``path``.
+
+    enqueue() appends a record and fsyncs it before returning, so a queued
+    submission survives a crash; submissions found in the journal without a
+    matching "done" record are queued again when the queue is created. A
+    daemon thread takes up to ``batch_size`` submissions at a time, sends
+    each with ``submit(operation, object, identifier)`` and records it as
+    done straight away, syncing the journal to disk once per batch.
+
+    A submission that fails transiently (see is_transient()) is retried
+    with exponential backoff starting at ``retry_delay`` seconds. After
+    ``retries`` retries the worker pauses, trying it again every
+    ``retry_delay * 2 ** retries`` seconds until it gets an answer or the
+    queue is closed, and sends nothing else meanwhile; it stays queued in
+    the journal. Submissions TimeSync rejects are recorded as failed and
+    kept in the journal, across restarts, until clear_failures()."""
+
+    def __init__(self, submit, path, batch_size=50, retries=5,
+                 retry_delay=1.0, error_key="pymesync error"):
+        self.submit = submit
+        self.path = path
+        self.batch_size = batch_size
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.error_key = error_key
+
+        self.__cond = threading.Condition()
+        self.__pending = collections.deque()
+        self.__in_flight = 0
+        self.__next_id = 1
+        self.__closed = False
+        self.__completed = collections.deque()
+        self.__counts = {"submitted": 0, "failed": 0, "retried": 0}
+        self.__paused = False
+        self.__failures = collections.OrderedDict()
+
+        self.__recover()
+
+        self.__thread = threading.Thread(target=self.__drain,
+                                         name="pymesync-write-behind")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def enqueue(self, operation, obj, identifier=None):
+        """Durably queue a submission. Returns its journal id"""
+        with self.__cond:
+            if self.__closed:
+                raise RuntimeError("write-behind queue is closed")
+            record = {"id": self.__next_id, "op": operation, "object": obj,
+                      "identifier": identifier}
+            self.__next_id += 1
+            self.__append([record])
+            self.__pending.append(record)
+            self.__cond.notify_all()
+            return record["id"]
+
+    def flush(self, timeout=None):
+        """Wait until every queued submission has been sent. Returns False if
+        ``timeout`` seconds passed first"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self.__cond:
+            while self.__pending or self.__in_flight:
+                remaining = None if deadline is None else (
+                    deadline - time.time())
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.__cond.wait(remaining)
+            return True
+
+    def close(self, timeout=None):
+        """Stop accepting submissions, send what is queued (waiting at most
+        ``timeout`` seconds) and stop the worker after the submission it is
+        sending, or while it waits to retry one. Anything not yet sent stays
+        in the journal for next time"""
+        self.flush(timeout)
+        with self.__cond:
+            self.__closed = True
+            self.__cond.notify_all()
+        self.__thread.join(timeout)
+
+    def failures(self):
+        """Returns the submissions TimeSync rejected, oldest first, each as
+        ``{"id", "op", "object", "identifier", "result"}``"""
+        with self.__cond:
+            return list(self.__failures.values())
+
+    def clear_failures(self, ids=None):
+        """Forget the failed submissions with the journal ids ``ids``, or
+        every one of them if ``ids`` is None"""
+        with self.__cond:
+            ids = list(self.__failures) if ids is None else [
+                submission_id for submission_id in ids
+                if submission_id in self.__failures]
+            if ids:
+                self.__append([{"id": submission_id, "cleared": True}
+                               for submission_id in ids])
+            for submission_id in ids:
+                del self.__failures[submission_id]
+
+    def metrics(self):
+        """Returns a dict with the queue depth (queued plus in flight),
+        submitted, failed and retried counts, whether the worker is paused
+        retrying a submission, and the drain rate in submissions per second
+        over the last minute"""
+        with self.__cond:
+            now = time.time()
+            self.__trim_completed(now)
+            metrics = dict(self.__counts)
+            metrics["paused"] = self.__paused
+            metrics["depth"] = len(self.__pending) + self.__in_flight
+            metrics["drain_rate"] = len(self.__completed) / RATE_WINDOW
+            return metrics
+
+    def __drain(self):
+        while True:
+            with self.__cond:
+                while not self.__pending and not self.__closed:
+                    self.__cond.wait()
+                if self.__closed:
+                    # Whatever is still queued is sent next time
+                    return
+                batch = [self.__pending.popleft() for _ in
+                         range(min(self.batch_size, len(self.__pending)))]
+                self.__in_flight = len(batch)
+
+            for record in batch:
+                with self.__cond:
+                    if self.__closed:
+                        self.__in_flight = 0
+                        break
+                result = self.__send(record)
+                if result is None:
+                    # Closed while waiting to retry; it stays queued
+                    break
+                failed = is_error(result, self.error_key)
+
+                with self.__cond:
+                    # Recorded before the next send, so a crash never
+                    # replays a submission TimeSync accepted
+                    done = {"id": record["id"], "done": True,
+                            "failed": failed}
+                    if failed:
+                        done["result"] = result
+                        self.__failures[record["id"]] = dict(record,
+                                                             result=result)
+                    self.__append([done], sync=False)
+                    self.__counts["failed" if failed else "submitted"] += 1
+                    self.__completed.append(time.time())
+                    self.__in_flight -= 1
+
+            with self.__cond:
+                self.__sync()
+                self.__in_flight = 0
+                self.__cond.notify_all()
+
+    def __send(self, record):
+        """Send one submission, retrying transient errors until it gets an
+        answer. Returns None if the queue was closed first"""
+        delay = self.retry_delay
+        attempt = 0
+        try:
+            while True:
+                try:
+                    result = self.submit(record["op"], record["object"],
+                                         record["identifier"])
+                except Exception as e:
+                    result = {self.error_key: e}
+                if not is_transient(result, self.error_key):
+                    return result
+
+                attempt += 1
+                with self.__cond:
+                    self.__counts["retried"] += 1
+                    if attempt > self.retries:
+                        self.__paused = True
+                    if not self.__wait_unless_closed(delay):
+                        return None
+                if attempt < self.retries:
+                    delay *= 2
+        finally:
+            with self.__cond:
+                self.__paused = False
+
+    def __wait_unless_closed(self, seconds):
+        """Wait ``seconds`` seconds. Returns False if the queue was closed
+        first. Caller holds the lock"""
+        deadline = time.time() + seconds
+        while not self.__closed:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return True
+            self.__cond.wait(remaining)
+        return False
+
+    def __append(self, records, sync=True):
+        """Append ``records`` to the journal with one write, fsynced unless
+        ``sync`` is False. Caller holds the lock"""
+        data = "".join(json.dumps(record, default=str) + "\n"
+                       for record in records).encode("utf-8")
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            os.write(fd, data)
+            if sync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def __sync(self):
+        """Flush unsynced journal writes to disk. Caller holds the lock"""
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def __recover(self):
+        """Queue the submissions left unsent in the journal, load the failed
+        ones, and compact it so it only holds those"""
+        if not os.path.exists(self.path):
+            return
+
+        records = collections.OrderedDict()
+        with io.open(self.path, "r", encoding="utf-8") as handle:
+            for line in handle:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn final line from a crash mid-write
+                    continue
+                self.__next_id = max(self.__next_id, record["id"] + 1)
+                if record.get("cleared"):
+                    self.__failures.pop(record["id"], None)
+                elif record.get("done"):
+                    sent = records.pop(record["id"], None)
+                    if record.get("failed") and sent is not None:
+                        self.__failures[record["id"]] = dict(
+                            sent, result=record.get("result"))
+                else:
+                    records[record["id"]] = record
+
+        self.__pending.extend(records.values())
+
+        kept = []
+        for failure in self.__failures.values():
+            sent = dict(failure)
+            result = sent.pop("result")
+            kept.extend([sent, {"id": sent["id"], "done": True,
+                                "failed": True, "result": result}])
+        kept.extend(records.values())
+
+        tmp_path = "{}.tmp".format(self.path)
+        with io.open(tmp_path, "wb") as handle:
+            handle.write("".join(json.dumps(record, default=str) + "\n"
+                                 for record in kept)
+                         .encode("utf-8"))
+            handle.flush()
+            os.fsync(handle.fileno())
+        files.replace(tmp_path, self.path)
+
+    def __trim_completed(self, now):
+        while self.__completed and self.__completed[0] < now - RATE_WINDOW:
+            self.__completed.popleft()
@@ -19,6 +19,9 @@ setup(
     author='OSU Open Source Lab',
     author_email='support@osuosl.org',
     packages=['pymesync'],
+    entry_points={
+        'console_scripts': ['pymesync = pymesync.cli:main'],
+    },
     url='https://github.com/osuosl/pymesync',
     license='Apache Version 2.0',
     description="pymesync - python module for the OSUOSL TimeSync API",
@@ -0,0 +1,23 @@
+"""
+Helpers shared by the test modules
+
+- resp - stand-in for a requests response with a JSON body
+- make_token - a JWT-shaped token expiring at a given time
+"""
+
+import base64
+import json
+
+
+class resp(object):
+
+    def __init__(self, body, status_code=200):
+        self.text = json.dumps(body)
+        self.status_code = status_code
+
+
+def make_token(expires, name="header"):
+    """A JWT-shaped token with an "exp" claim in ms"""
+    payload = base64.b64encode(json.dumps({"exp": int(expires * 1000)})
+                               .encode("utf-8")).decode("ascii")
+    return "{0}.{1}.signature".format(name, payload)
@@ -0,0 +1,118 @@
+import time
+import unittest
+import requests
+from pymesync import breaker
+from pymesync import pymesync
+from helpers import resp
+
+try:
+    from unittest.mock import patch
+except:
+    from mock import patch
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_opens_on_failure_rate(self):
+        """Tests that the breaker opens once enough requests failed"""
+        circuit = breaker.CircuitBreaker(failure_rate=0.5, window=4,
+                                         min_requests=4, reset_timeout=60)
+        for success in [True, False, True]:
+            self.assertTrue(circuit.allow())
+            circuit.record(success)
+        self.assertEquals(circuit.state(), breaker.CLOSED)
+
+        self.assertTrue(circuit.allow())
+        circuit.record(False)
+        self.assertEquals(circuit.state(), breaker.OPEN)
+        self.assertFalse(circuit.allow())
+        self.assertTrue(circuit.retry_after() > 59)
+
+        metrics = circuit.metrics()
+        self.assertEquals((metrics["failures"], metrics["rejected"],
+                           metrics["opened"]), (2, 1, 1))
+
+    def test_half_open(self):
+        """Tests that an open breaker lets limited probes through and closes
+        after a successful one"""
+        circuit = breaker.CircuitBreaker(window=2, min_requests=2,
+                                         reset_timeout=0, half_open_requests=1)
+        circuit.allow()
+        circuit.record(False)
+        circuit.allow()
+        circuit.record(False)
+
+        self.assertEquals(circuit.state(), breaker.HALF_OPEN)
+        self.assertTrue(circuit.allow())
+        self.assertFalse(circuit.allow())
+        circuit.record(False)
+        self.assertEquals(circuit.metrics()["opened"], 2)
+
+        self.assertTrue(circuit.allow())
+        circuit.record(True)
+        self.assertEquals(circuit.state(), breaker.CLOSED)
+        self.assertEquals(circuit.metrics()["failure_rate"], 0.0)
+
+
+class TestTimeSyncCircuitBreakers(unittest.TestCase):
+
+    def setUp(self):
+        baseurl = "http://ts.example.com/v1"
+        self.ts = pymesync.TimeSync(baseurl, token="TESTTOKEN")
+        self.ts.enable_circuit_breakers(window=3, min_requests=3,
+                                        reset_timeout=60)
+
+        self.get_patcher = patch("requests.get")
+        requests.get = self.get_patcher.start()
+        self.addCleanup(self.get_patcher.stop)
+
+    def test_fast_fail(self):
+        """Tests that an endpoint fails fast once its breaker opens, while
+        other endpoints are still sent"""
+        requests.get.side_effect = requests.exceptions.ConnectionError("down")
+        for _ in range(3):
+            self.ts.get_times()
+        self.assertEquals(requests.get.call_count, 3)
+
+        result = self.ts.get_times()
+        self.assertEquals(requests.get.call_count, 3)
+        self.assertTrue(result[0][self.ts.error].startswith(
+            "circuit breaker open for http://ts.example.com/v1/times"))
+
+        requests.get.side_effect = None
+        requests.get.return_value = resp([])
+        self.assertEquals(self.ts.get_users(), [])
+
+        metrics = self.ts.metrics()["circuit_breakers"]
+        self.assertEquals(metrics["times"]["state"], "open")
+        self.assertEquals(metrics["users"]["state"], "closed")
+
+    def test_server_errors(self):
+        """Tests that 5xx responses count as failures and 4xx don't"""
+        requests.get.return_value = resp({"error": "Not found"}, 404)
+        for _ in range(3):
+            self.ts.get_projects({"slug": "nope"})
+        self.assertEquals(self.ts.metrics()["circuit_breakers"]["projects"]
+                          ["state"], "closed")
+
+        requests.get.return_value = resp({"error": "Server error"}, 500)
+        for _ in range(3):
+            self.ts.get_projects({"slug": "nope"})
+        self.assertEquals(self.ts.metrics()["circuit_breakers"]["projects"]
+                          ["state"], "open")
+
+    def test_recovers(self):
+        """Tests that a successful probe closes the breaker"""
+        self.ts.enable_circuit_breakers(window=1, min_requests=1,
+                                        reset_timeout=0.01)
+        requests.get.return_value = resp({"error": "Server error"}, 503)
+        self.ts.get_times()
+        time.sleep(0.02)
+
+        requests.get.return_value = resp([])
+        self.assertEquals(self.ts.get_times(), [])
+        self.assertEquals(self.ts.metrics()["circuit_breakers"]["times"]
+                          ["state"], "closed")
+
+        self.ts.disable_circuit_breakers()
+        self.assertFalse("circuit_breakers" in self.ts.metrics())
@@ -0,0 +1,512 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import zlib
+import requests
+from pymesync import cache
+from pymesync import pymesync
+from helpers import resp
+
+try:
+    from unittest.mock import patch
+except:
+    from mock import patch
+
+
+class TestMemoryBackend(unittest.TestCase):
+
+    def test_lru_and_expiry(self):
+        """Tests that the least recently used and expired entries go"""
+        backend = cache.MemoryBackend(max_entries=2)
+        now = time.time()
+        backend.set("a", 1, now, now + 60)
+        backend.set("b", 2, now, now + 60)
+        backend.get("a")
+        backend.set("c", 3, now, now + 60)
+        self.assertIsNone(backend.get("b"))
+        self.assertEquals(backend.get("a"), (1, now))
+
+        backend.set("d", 4, now, now - 1)
+        self.assertIsNone(backend.get("d"))
+
+    def test_delete_prefix(self):
+        """Tests that only entries starting with the prefix are deleted"""
+        backend = cache.MemoryBackend()
+        now = time.time()
+        for key in ["u /projects", "u /projects?slug=a", "u /users", "v /p"]:
+            backend.set(key, 1, now, now + 60)
+        backend.delete_prefix("u /projects")
+        self.assertEquals(len(backend), 2)
+        self.assertIsNone(backend.get("u /projects?slug=a"))
+        self.assertEquals(backend.get("u /users"), (1, now))
+
+    def test_copies(self):
+        """Tests that cached values can't be changed by callers"""
+        backend = cache.MemoryBackend()
+        value = [{"slug": "pyme"}]
+        backend.set("a", value, 0, time.time() + 60)
+        value[0]["slug"] = "changed"
+        backend.get("a")[0][0]["slug"] = "changed"
+        self.assertEquals(backend.get("a")[0], [{"slug": "pyme"}])
+
+
+class TestSQLiteBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "cache.db")
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def test_shared(self):
+        """Tests that backends using one file share entries"""
+        first = cache.SQLiteBackend(self.path)
+        second = cache.SQLiteBackend(self.path)
+        now = time.time()
+        first.set("a", [{"slug": "pyme"}], now, now + 60)
+        self.assertEquals(second.get("a"), ([{"slug": "pyme"}], now))
+
+        second.set("a", [{"slug": "timesync"}], now, now + 60)
+        self.assertEquals(first.get("a")[0], [{"slug": "timesync"}])
+
+        first.delete("a")
+        self.assertIsNone(second.get("a"))
+        first.set("b", 1, now, now + 60)
+        first.set("c_d", 1, now, now + 60)
+        first.set("cde", 1, now, now + 60)
+        second.delete_prefix("c_")
+        self.assertEquals(len(first), 2)
+        self.assertIsNone(first.get("c_d"))
+        second.clear()
+        self.assertEquals(len(first), 0)
+
+    def test_purge(self):
+        """Tests that expired and the oldest entries are purged"""
+        backend = cache.SQLiteBackend(self.path, max_entries=2,
+                                      purge_interval=4)
+        now = time.time()
+        backend.set("expired", 0, now - 120, now - 60)
+        for number, key in enumerate(["a", "b", "c"]):
+            backend.set(key, number, now + number, now + 60)
+        self.assertIsNone(backend.get("expired"))
+        self.assertIsNone(backend.get("a"))
+        self.assertEquals(backend.get("c"), (2, now + 2))
+        self.assertEquals(len(backend), 2)
+
+    def test_threads(self):
+        """Tests that one backend can be used from several threads"""
+        backend = cache.SQLiteBackend(self.path)
+        now = time.time()
+        threads = [threading.Thread(
+            target=backend.set, args=(str(n), n, now, now + 60))
+            for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEquals(len(backend), 8)
+
+
+class TestTieredBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.now = time.time()
+        # Each value is 104 bytes of JSON
+        self.values = dict((key, [key * 100]) for key in "abcd")
+
+    def backend(self, **options):
+        return cache.TieredBackend(self.tmp, **options)
+
+    def fill(self, backend):
+        for key, value in sorted(self.values.items()):
+            backend.set(key, value, self.now, self.now + 60)
+
+    def test_tiers(self):
+        """Tests that the least recently used entries move to disk and come
+        back to memory when read"""
+        backend = self.backend(memory_bytes=250)
+        self.fill(backend)
+        metrics = backend.metrics()
+        self.assertEquals(metrics["memory_entries"], 2)
+        self.assertEquals(metrics["memory_bytes"], 208)
+        self.assertEquals(metrics["disk_entries"], 2)
+        self.assertTrue(metrics["disk_bytes"] > 0)
+
+        for key in "abcd":
+            self.assertEquals(backend.get(key), (self.values[key], self.now))
+        self.assertIsNone(backend.get("e"))
+        metrics = backend.metrics()
+        self.assertEquals((metrics["memory_hits"], metrics["disk_hits"],
+                           metrics["misses"]), (0, 4, 1))
+        self.assertEquals(metrics["hit_rate"], 0.8)
+        self.assertEquals(backend.get("d"), (self.values["d"], self.now))
+        self.assertEquals(backend.metrics()["memory_hits"], 1)
+
+        backend.get("d")[0].append("changed")
+        self.assertEquals(backend.get("d")[0], self.values["d"])
+
+    def test_writes_outside_lock(self):
+        """Tests that other entries, and the one being written, can be read
+        while an entry is compressed for the disk tier"""
+        backend = self.backend(memory_bytes=150)
+        backend.set("a", self.values["a"], self.now, self.now + 60)
+        compressing = threading.Event()
+        release = threading.Event()
+        original = zlib.compress
+
+        def compress(data):
+            compressing.set()
+            release.wait(5)
+            return original(data)
+
+        with patch.object(cache.zlib, "compress", compress):
+            writer = threading.Thread(target=backend.set, args=(
+                "b", self.values["b"], self.now, self.now + 60))
+            writer.start()
+            self.assertTrue(compressing.wait(5))
+            begun = time.time()
+            self.assertEquals(backend.get("b"), (self.values["b"], self.now))
+            self.assertEquals(backend.get("a"), (self.values["a"], self.now))
+            self.assertTrue(time.time() - begun < 1)
+            release.set()
+            writer.join(5)
+
+        self.assertEquals(backend.metrics()["disk_entries"], 1)
+        self.assertEquals(backend.get("a")[0], self.values["a"])
+        self.assertEquals(backend.get("b")[0], self.values["b"])
+
+    def test_disk_budget(self):
+        """Tests that expired, then least recently used, files are deleted
+        to stay within the disk budget"""
+        backend = self.backend(memory_bytes=0, disk_bytes=500)
+        backend.set("expired", [], self.now - 120, self.now - 60)
+        self.fill(backend)
+        metrics = backend.metrics()
+        self.assertTrue(metrics["disk_bytes"] <= 500)
+        self.assertEquals(metrics["disk_entries"], len(os.listdir(self.tmp)))
+        self.assertEquals(metrics["evictions"], 5 - len(backend))
+        self.assertIsNone(backend.get("a"))
+        self.assertEquals(backend.get("d")[0], self.values["d"])
+
+    def test_reload(self):
+        """Tests that entries on disk are used by a new backend and deleted
+        ones are not"""
+        backend = self.backend(memory_bytes=0, compression="lzma")
+        self.fill(backend)
+        backend.delete("b")
+        backend = self.backend()
+        self.assertEquals(len(backend), 3)
+        self.assertEquals(backend.get("a")[0], self.values["a"])
+        self.assertIsNone(backend.get("b"))
+
+        backend.delete_prefix("c")
+        self.assertEquals(len(self.backend()), 2)
+
+        backend.clear()
+        self.assertEquals(os.listdir(self.tmp), [])
+
+
+class TestBackendFromUrl(unittest.TestCase):
+
+    def test_urls(self):
+        """Tests that urls select and configure backends"""
+        backend = cache.backend_from_url("memory")
+        self.assertTrue(isinstance(backend, cache.MemoryBackend))
+        backend = cache.backend_from_url("memory://?max_entries=5")
+        self.assertEquals(backend.max_entries, 5)
+
+        backend = cache.backend_from_url(
+            "sqlite:///tmp/cache.db?max_entries=10&timeout=0.5")
+        self.assertTrue(isinstance(backend, cache.SQLiteBackend))
+        self.assertEquals(backend.path, "/tmp/cache.db")
+        self.assertEquals(backend.max_entries, 10)
+        self.assertEquals(backend.timeout, 0.5)
+
+        backend = cache.backend_from_url(
+            "tiered://{}?compression=lzma".format(tempfile.gettempdir()))
+        self.assertTrue(isinstance(backend, cache.TieredBackend))
+        self.assertEquals(backend.compression, "lzma")
+
+        with self.assertRaises(ValueError):
+            cache.backend_from_url("redis://localhost")
+
+
+class TestReadCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = cache.ReadCache(
+            ttl=60, stale_while_revalidate=60, stale_if_error=600,
+            is_error=lambda result: isinstance(result, dict))
+        self.calls = []
+
+    def fetch(self, result):
+        def fetch():
+            self.calls.append(result)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return fetch
+
+    def store(self, key, value, age):
+        stored_at = time.time() - age
+        self.cache.backend.set(key, value, stored_at, stored_at + 10000)
+
+    def test_fresh(self):
+        """Tests that a fresh result is returned without fetching"""
+        self.assertEquals(self.cache.get("k", self.fetch([1])), [1])
+        self.assertEquals(self.cache.get("k", self.fetch([2])), [1])
+        self.assertEquals(self.calls, [[1]])
+        self.assertEquals(self.cache.metrics()["hit_rate"], 0.5)
+
+    def test_stale_while_revalidate(self):
+        """Tests that a stale result is returned while a background thread
+        fetches a new one"""
+        self.store("k", [1], 90)
+        release = threading.Event()
+        refreshed = threading.Event()
+
+        def fetch():
+            release.wait(5)
+            refreshed.set()
+            return [2]
+
+        self.assertEquals(self.cache.get("k", fetch), [1])
+        self.assertEquals(self.cache.get("k", fetch), [1])
+        release.set()
+        refreshed.wait(5)
+        for _ in range(100):
+            if self.cache.backend.get("k")[0] == [2]:
+                break
+            time.sleep(0.01)
+        self.assertEquals(self.cache.get("k", fetch), [2])
+        self.assertEquals(self.cache.metrics()["refreshes"], 1)
+
+    def test_stale_if_error(self):
+        """Tests that old results are returned when fetching fails"""
+        self.store("k", [1], 300)
+        self.assertEquals(self.cache.get("k", self.fetch({"error": 1})), [1])
+        self.assertEquals(self.cache.get("k", self.fetch(ValueError())), [1])
+        self.assertEquals(self.cache.metrics()["stale_errors"], 2)
+
+    def test_definitive_error(self):
+        """Tests that errors that aren't transient are returned and drop
+        the cached result"""
+        self.cache.is_transient = lambda result: result.get("status") == 500
+        self.store("k", [1], 300)
+        self.assertEquals(self.cache.get("k", self.fetch({"status": 404})),
+                          {"status": 404})
+        self.assertIsNone(self.cache.backend.get("k"))
+
+        self.store("k", [1], 90)
+        self.assertEquals(self.cache.get("k", self.fetch({"status": 403})),
+                          [1])
+        for _ in range(100):
+            if self.cache.backend.get("k") is None:
+                break
+            time.sleep(0.01)
+        self.assertIsNone(self.cache.backend.get("k"))
+
+    def test_too_stale(self):
+        """Tests that results older than stale_if_error are not used and
+        errors are not cached"""
+        self.store("k", [1], 700)
+        self.assertEquals(self.cache.get("k", self.fetch({"error": 1})),
+                          {"error": 1})
+        with self.assertRaises(ValueError):
+            self.cache.get("k", self.fetch(ValueError()))
+        self.assertEquals(self.cache.get("k", self.fetch([2])), [2])
+
+
+class TestTimeSyncCache(unittest.TestCase):
+
+    def setUp(self):
+        baseurl = "http://ts.example.com/v1"
+        self.ts = pymesync.TimeSync(baseurl, token="TESTTOKEN")
+        self.ts.enable_cache(ttl=60)
+
+        self.get_patcher = patch("requests.get")
+        requests.get = self.get_patcher.start()
+        self.addCleanup(self.get_patcher.stop)
+
+        self.post_patcher = patch("requests.post")
+        requests.post = self.post_patcher.start()
+        self.addCleanup(self.post_patcher.stop)
+
+        self.delete_patcher = patch("requests.delete")
+        requests.delete = self.delete_patcher.start()
+        self.addCleanup(self.delete_patcher.stop)
+
+    def test_cached_reads(self):
+        """Tests that GET results are cached per query and user"""
+        requests.get.return_value = resp([{"slugs": ["pyme"]}])
+        self.ts.get_projects()
+        self.ts.get_projects({"include_revisions": True})
+        result = self.ts.get_projects()
+        self.assertEquals(result, [{"slugs": ["pyme"]}])
+        self.assertEquals(requests.get.call_count, 2)
+
+        self.ts.token = "OTHERTOKEN"
+        self.ts.get_projects()
+        self.assertEquals(requests.get.call_count, 3)
+
+        self.ts.clear_cache()
+        self.ts.token = "TESTTOKEN"
+        self.ts.get_projects()
+        self.assertEquals(requests.get.call_count, 4)
+        self.assertEquals(self.ts.metrics()["cache"]["hits"], 1)
+
+    def test_writes_invalidate(self):
+        """Tests that successful writes forget cached reads of the endpoint
+        they wrote to, and failed writes don't"""
+        requests.get.return_value = resp([{"slugs": ["pyme"]}])
+        self.ts.get_projects()
+        self.ts.get_projects({"slug": "pyme"})
+        self.ts.get_activities()
+        self.assertEquals(requests.get.call_count, 3)
+
+        requests.post.return_value = resp({"error": "Bad object"}, 400)
+        self.ts.create_project({"name": "Ganeti", "uri": "http://x.org",
+                                "slugs": ["gwm"]})
+        self.ts.get_projects()
+        self.assertEquals(requests.get.call_count, 3)
+
+        requests.post.return_value = resp({"slugs": ["gwm"]})
+        self.ts.create_project({"name": "Ganeti", "uri": "http://x.org",
+                                "slugs": ["gwm"]})
+        self.ts.get_projects()
+        self.ts.get_projects({"slug": "pyme"})
+        self.ts.get_activities()
+        self.assertEquals(requests.get.call_count, 5)
+
+        requests.delete.return_value = resp({"status": 200})
+        requests.delete.return_value.text = ""
+        self.ts.delete_project("gwm")
+        self.ts.get_projects()
+        self.assertEquals(requests.get.call_count, 6)
+
+    def test_internal_refresh_uncached(self):
+        """Tests that refreshing the existence index fetches from TimeSync
+        and updates the cache"""
+        requests.get.return_value = resp([{"slugs": ["pyme"]}])
+        self.ts.get_projects()
+        requests.get.return_value = resp([{"slugs": ["pyme"]},
+                                          {"slugs": ["gwm"]}])
+        self.assertEquals(self.ts.find_existing("projects", ["gwm"]),
+                          ["gwm"])
+        self.assertEquals(len(self.ts.get_projects()), 2)
+        self.assertEquals(requests.get.call_count, 3)
+
+    def test_serves_stale_on_error(self):
+        """Tests that a cached result is returned when TimeSync is down"""
+        self.ts.enable_cache(ttl=0, stale_while_revalidate=0)
+        requests.get.return_value = resp([{"username": "malcolm"}])
+        self.ts.get_users("malcolm")
+
+        requests.get.side_effect = requests.exceptions.ConnectionError()
+        self.assertEquals(self.ts.get_users("malcolm"),
+                          [{"username": "malcolm"}])
+
+        requests.get.side_effect = None
+        requests.get.return_value = resp({"error": "Server error"}, 500)
+        self.assertEquals(self.ts.get_users("malcolm"),
+                          [{"username": "malcolm"}])
+
+    def test_passes_definitive_errors(self):
+        """Tests that 4xx answers are returned instead of a cached result,
+        and fill the negative cache"""
+        self.ts.enable_cache(ttl=0, stale_while_revalidate=0)
+        self.ts.enable_negative_cache()
+        requests.get.return_value = resp([{"username": "jayne"}])
+        self.ts.get_users("jayne")
+
+        forbidden = {"status": 401, "error": "Authentication failure"}
+        requests.get.return_value = resp(forbidden, 401)
+        self.assertEquals(self.ts.get_users("jayne"), [forbidden])
+
+        missing = {"status": 404, "error": "Object not found"}
+        requests.get.return_value = resp(missing, 404)
+        self.assertEquals(self.ts.get_users("jayne"), [missing])
+        self.assertEquals(self.ts.get_users("jayne"), [missing])
+        self.assertEquals(requests.get.call_count, 3)
+
+    def test_environment(self):
+        """Tests that PYMESYNC_CACHE enables a shared cache"""
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        url = "sqlite:///{}".format(os.path.join(tmp, "cache.db"))
+        requests.get.return_value = resp([{"slugs": ["pyme"]}])
+
+        with patch.dict(os.environ, {"PYMESYNC_CACHE": url}):
+            for _ in range(3):
+                ts = pymesync.TimeSync("http://ts.example.com/v1",
+                                       token="TESTTOKEN")
+                self.assertEquals(ts.get_projects(), [{"slugs": ["pyme"]}])
+        self.assertEquals(requests.get.call_count, 1)
+        self.assertEquals(ts.metrics()["cache"]["hits"], 1)
+
+
+class TestNegativeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.ts = pymesync.TimeSync("http://ts.example.com/v1",
+                                    token="TESTTOKEN")
+        self.ts.enable_negative_cache(ttl=30)
+        self.missing = {"status": 404, "error": "Object not found",
+                        "text": "Nonexistent user"}
+
+        for method in ("get", "post"):
+            patcher = patch("requests.{}".format(method))
+            setattr(requests, method, patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def test_missing_user(self):
+        """Tests that a missing user is remembered until it is created"""
+        requests.get.return_value = resp(self.missing, 404)
+        self.assertEquals(self.ts.get_users("kaylee"), [self.missing])
+        self.assertEquals(self.ts.get_users("kaylee"), [self.missing])
+        self.assertEquals(requests.get.call_count, 1)
+
+        requests.post.return_value = resp({"username": "kaylee"})
+        self.ts.create_user({"username": "kaylee", "password": "pass"})
+        requests.get.return_value = resp({"username": "kaylee"})
+        self.assertEquals(self.ts.get_users("kaylee"),
+                          [{"username": "kaylee"}])
+        self.assertEquals(requests.get.call_count, 2)
+        self.assertEquals(self.ts.metrics()["negative_cache"],
+                          {"hits": 1, "misses": 2, "invalidations": 1,
+                           "entries": 0})
+
+    def test_missing_project(self):
+        """Tests that a missing project slug is remembered until a project
+        with that slug is created, and other results are not"""
+        requests.get.return_value = resp({"error": "Object not found",
+                                          "text": "Nonexistent project"}, 404)
+        self.ts.get_projects({"slug": "serenity"})
+        self.ts.get_projects({"slug": "serenity"})
+        self.assertEquals(requests.get.call_count, 1)
+
+        requests.post.return_value = resp({"error": "Bad object"}, 400)
+        self.ts.create_project({"uri": "u", "name": "Serenity",
+                                "slugs": ["serenity"]})
+        self.ts.get_projects({"slug": "serenity"})
+        self.assertEquals(requests.get.call_count, 1)
+
+        requests.post.return_value = resp({"slugs": ["serenity"]})
+        self.ts.create_project({"uri": "u", "name": "Serenity",
+                                "slugs": ["serenity"]})
+        requests.get.return_value = resp({"error": "Server error"}, 500)
+        self.ts.get_projects({"slug": "serenity"})
+        self.ts.get_projects({"slug": "serenity"})
+        self.assertEquals(requests.get.call_count, 3)
+
+    def test_expiry(self):
+        """Tests that missing names are looked up again after the ttl"""
+        self.ts.enable_negative_cache(ttl=0)
+        requests.get.return_value = resp(self.missing, 404)
+        self.ts.get_users("kaylee")
+        self.ts.get_users("kaylee")
+        self.assertEquals(requests.get.call_count, 2)
@@ -0,0 +1,249 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import requests
+import pymesync
+from pymesync import cli
+from pymesync import export
+from helpers import resp
+
+try:
+    from unittest.mock import patch
+except:
+    from mock import patch
+
+
+class TestCli(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.out = io.StringIO()
+        self.csv = os.path.join(self.tmp, "times.csv")
+        with io.open(self.csv, "w", encoding="utf-8") as handle:
+            handle.write(u"duration,project,user,date_worked,activities\n"
+                         u"1h30m,gwm,userone,2016-01-01,\"docs, dev\"\n"
+                         u"3600,gwm,userone,2016-01-02,\n"
+                         u"soon,gwm,userone,2016-01-03,\n")
+        self.args = ["--baseurl", "http://ts.example.com/v1", "--test",
+                     "--username", "userone", "--password", "pass"]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_read_csv(self):
+        """Tests that CSV rows become time entries"""
+        rows = list(cli.read_rows(self.csv))
+        self.assertEquals(rows[0], {"duration": "1h30m", "project": "gwm",
+                                    "user": "userone",
+                                    "date_worked": "2016-01-01",
+                                    "activities": ["docs", "dev"]})
+        self.assertEquals(rows[1]["duration"], 3600)
+
+    def test_read_jsonl(self):
+        """Tests that JSONL lines become time entries"""
+        path = os.path.join(self.tmp, "times.jsonl")
+        with io.open(path, "w", encoding="utf-8") as handle:
+            handle.write(u'{"duration": 60}\n\n{"duration": 120}\n')
+        self.assertEquals(list(cli.read_rows(path)),
+                          [{"duration": 60}, {"duration": 120}])
+
+    def test_import(self):
+        """Tests that main imports every row and reports failures"""
+        code = cli.main(self.args + ["import", self.csv, "--batch-size", "2"],
+                        out=self.out)
+        output = self.out.getvalue()
+        self.assertEquals(code, 1)
+        self.assertTrue("row 3: " in output)
+        self.assertTrue("imported 2 of 3 rows" in output)
+
+    def test_import_deadline(self):
+        """Tests that an import stops starting batches after the deadline"""
+        code = cli.main(self.args + ["--deadline", "0", "import", self.csv],
+                        out=self.out)
+        self.assertEquals(code, 1)
+        self.assertTrue("deadline reached after row 0" in self.out.getvalue())
+
+    def test_import_check_references(self):
+        """Tests that rows naming unknown projects are rejected"""
+        with io.open(self.csv, "a", encoding="utf-8") as handle:
+            handle.write(u"60,nope,userone,2016-01-04,\n")
+        code = cli.main(self.args + ["import", self.csv,
+                                     "--check-references"], out=self.out)
+        output = self.out.getvalue()
+        self.assertEquals(code, 1)
+        self.assertTrue("row 4: " in output and "unknown project: nope" in
+                        output)
+        self.assertTrue("imported 2 of 4 rows" in output)
+
+    def test_import_journal_rerun(self):
+        """Tests that rows already in the journal are skipped on a re-run"""
+        journal_path = os.path.join(self.tmp, "journal")
+        valid = os.path.join(self.tmp, "valid.csv")
+        with io.open(valid, "w", encoding="utf-8") as handle:
+            handle.write(u"duration,project,user,date_worked\n"
+                         u"3600,gwm,userone,2016-01-02\n"
+                         u"60,gwm,userone,2016-01-03\n")
+        args = self.args + ["import", valid, "--journal", journal_path]
+        self.assertEquals(cli.main(args, out=self.out), 0)
+
+        out = io.StringIO()
+        self.assertEquals(cli.main(args, out=out), 0)
+        self.assertTrue("imported 0 of 0 rows" in out.getvalue())
+        self.assertTrue("0 failed" in out.getvalue())
+
+    def test_import_resumes_from_checkpoint(self):
+        """Tests that an import with a checkpoint skips committed rows"""
+        checkpoint = os.path.join(self.tmp, "checkpoint.json")
+        cli.save_checkpoint(checkpoint, self.csv, {"rows": 2})
+
+        code = cli.main(self.args + ["import", self.csv, "--checkpoint",
+                                     checkpoint], out=self.out)
+        self.assertEquals(code, 1)
+        self.assertTrue("resuming after row 2" in self.out.getvalue())
+        self.assertTrue("imported 0 of 1 rows" in self.out.getvalue())
+        with io.open(checkpoint, encoding="utf-8") as handle:
+            self.assertEquals(json.load(handle)["rows"], 3)
+
+    def test_import_interrupted_batch(self):
+        """Tests that rows of a batch sent before the checkpoint was saved
+        are not created again"""
+        checkpoint = os.path.join(self.tmp, "checkpoint.json")
+        args = self.args + ["import", self.csv, "--checkpoint", checkpoint,
+                            "--journal", os.path.join(self.tmp, "journal")]
+        cli.main(args, out=self.out)
+
+        # As if the process died before saving the checkpoint
+        os.remove(checkpoint)
+        out = io.StringIO()
+        cli.main(args, out=out)
+        self.assertTrue("imported 0 of 1 rows" in out.getvalue())
+
+    def test_import_transient_failure(self):
+        """Tests that the checkpoint stops before a row that failed
+        transiently, and resuming sends it again"""
+        path = os.path.join(self.tmp, "valid.csv")
+        with io.open(path, "w", encoding="utf-8") as handle:
+            handle.write(u"duration,project,user,date_worked\n")
+            for day in range(1, 5):
+                handle.write(u"60,gwm,userone,2016-01-0{}\n".format(day))
+        checkpoint = os.path.join(self.tmp, "checkpoint.json")
+        ts = pymesync.TimeSync("http://ts.example.com/v1", token="TOKEN")
+        post_patcher = patch("requests.post")
+        requests.post = post_patcher.start()
+        self.addCleanup(post_patcher.stop)
+        sent = []
+
+        def post(url, json=None, timeout=None):
+            sent.append(json["object"]["date_worked"])
+            if json["object"]["date_worked"] == "2016-01-02":
+                raise requests.exceptions.ConnectionError()
+            return resp({"uuid": "1"})
+
+        requests.post.side_effect = post
+        summary = cli.import_times(ts, path, batch_size=3, workers=1,
+                                   checkpoint=checkpoint, out=self.out)
+        self.assertTrue(summary["stopped"])
+        self.assertEquals(summary["rows"], 3)
+        self.assertTrue("resuming retries from row 2" in self.out.getvalue())
+        self.assertEquals(cli.load_checkpoint(checkpoint, path), {"rows": 1})
+
+        requests.post.side_effect = None
+        requests.post.return_value = resp({"uuid": "1"})
+        summary = cli.import_times(ts, path, batch_size=3, workers=1,
+                                   checkpoint=checkpoint, out=self.out)
+        self.assertEquals((summary["created"], summary["failed"]), (3, 0))
+        self.assertEquals(cli.load_checkpoint(checkpoint, path), {"rows": 4})
+
+    def test_import_identical_rows(self):
+        """Tests that identical rows are all created when no journal is
+        used"""
+        with io.open(self.csv, "a", encoding="utf-8") as handle:
+            handle.write(u"3600,gwm,userone,2016-01-02,\n")
+        checkpoint = os.path.join(self.tmp, "checkpoint.json")
+        cli.main(self.args + ["import", self.csv, "--checkpoint",
+                              checkpoint], out=self.out)
+        self.assertTrue("imported 3 of 4 rows" in self.out.getvalue())
+        self.assertFalse(os.path.exists(checkpoint + ".journal"))
+
+    def test_checkpoint_other_file(self):
+        """Tests that a checkpoint for a different file is ignored"""
+        checkpoint = os.path.join(self.tmp, "checkpoint.json")
+        cli.save_checkpoint(checkpoint, "other.csv", {"rows": 2})
+        self.assertEquals(cli.load_checkpoint(checkpoint, self.csv), {})
+
+    def test_auth_failure(self):
+        """Tests that main exits when authentication fails"""
+        code = cli.main(["--baseurl", "http://ts.example.com/v1", "--test",
+                         "import", self.csv], out=self.out)
+        self.assertEquals(code, 2)
+        self.assertTrue("authentication failed" in self.out.getvalue())
+
+    def test_export_jsonl(self):
+        """Tests that export writes every shard's times as JSON lines"""
+        path = os.path.join(self.tmp, "times.jsonl")
+        code = cli.main(self.args + ["export", path, "--start", "2016-01-01",
+                                     "--end", "2016-01-10", "--days", "5"],
+                        out=self.out)
+        self.assertEquals(code, 0)
+        # Test mode returns three times per shard
+        self.assertEquals(len(list(cli.read_jsonl(path))), 6)
+        self.assertTrue("exported 6 rows" in self.out.getvalue())
+
+    def test_export_csv(self):
+        """Tests that CSV exports have one header and joined list fields"""
+        path = os.path.join(self.tmp, "out.csv")
+        cli.main(self.args + ["export", path, "--start", "2016-01-01",
+                              "--end", "2016-01-02", "--days", "1"],
+                 out=self.out)
+        with io.open(path, encoding="utf-8") as handle:
+            lines = handle.read().splitlines()
+        self.assertEquals(len(lines), 7)
+        self.assertTrue(lines[0].startswith("uuid,user,project"))
+        self.assertTrue('"ganeti-webmgr,gwm"' in lines[1])
+
+    def test_export_columnar_resume(self):
+        """Tests that a resumed columnar export drops partial output and
+        continues after the checkpoint"""
+        path = os.path.join(self.tmp, "times.col")
+        checkpoint = os.path.join(self.tmp, "export.checkpoint")
+        args = self.args + ["export", path, "--format", "columnar",
+                            "--start", "2016-01-01", "--days", "1",
+                            "--checkpoint", checkpoint]
+
+        cli.main(args + ["--end", "2016-01-01"], out=self.out)
+        # Simulate an export to 2016-01-02 that crashed halfway through
+        # writing its second shard
+        with io.open(checkpoint, encoding="utf-8") as handle:
+            state = json.load(handle)
+        state["export"]["end"] = "2016-01-02"
+        with io.open(checkpoint, "w", encoding="utf-8") as handle:
+            handle.write(json.dumps(state))
+        with io.open(path, "ab") as handle:
+            handle.write(b"partial")
+
+        cli.main(args + ["--end", "2016-01-02"], out=self.out)
+        self.assertTrue("resuming after 2016-01-01" in self.out.getvalue())
+        times = list(export.read_columnar(path))
+        self.assertEquals(len(times), 6)
+        self.assertEquals(times[0]["user"], "userone")
+
+    def test_export_checkpoint_mismatch(self):
+        """Tests that a checkpoint from a different export is refused and
+        the file is left alone"""
+        path = os.path.join(self.tmp, "times.jsonl")
+        checkpoint = os.path.join(self.tmp, "export.checkpoint")
+        args = self.args + ["export", path, "--start", "2016-01-01",
+                            "--end", "2016-01-01", "--checkpoint", checkpoint]
+        self.assertEquals(cli.main(args, out=self.out), 0)
+        with io.open(path, "rb") as handle:
+            exported = handle.read()
+
+        for extra in [["--user", "userone"], ["--end", "2016-01-05"]]:
+            out = io.StringIO()
+            self.assertEquals(cli.main(args + extra, out=out), 1)
+            self.assertTrue("different export" in out.getvalue())
+            with io.open(path, "rb") as handle:
+                self.assertEquals(handle.read(), exported)
@@ -0,0 +1,111 @@
+import threading
+import time
+import unittest
+import requests
+from pymesync import clients
+from helpers import resp, make_token
+
+try:
+    from unittest.mock import patch
+except:
+    from mock import patch
+
+
+class TestClientManager(unittest.TestCase):
+
+    def setUp(self):
+        self.get_patcher = patch("requests.get")
+        self.post_patcher = patch("requests.post")
+        requests.get = self.get_patcher.start()
+        requests.post = self.post_patcher.start()
+        self.addCleanup(self.get_patcher.stop)
+        self.addCleanup(self.post_patcher.stop)
+
+        self.expires = time.time() + 3600
+        requests.post.side_effect = lambda url, json=None: resp(
+            {"token": make_token(self.expires)})
+        requests.get.return_value = resp([])
+
+        self.manager = clients.ClientManager()
+
+    def test_reuses_client(self):
+        """Tests that one client per baseurl and user logs in once"""
+        one = self.manager.client("http://a.example.com/v1", "malcolm", "pw")
+        two = self.manager.client("http://a.example.com/v1/", "malcolm", "pw")
+        other = self.manager.client("http://b.example.com/v1", "malcolm",
+                                    "pw")
+        self.assertIs(one, two)
+        self.assertIsNot(one, other)
+        self.assertEquals(requests.post.call_count, 2)
+        self.assertEquals(self.manager.metrics(),
+                          {"clients": 2, "created": 2, "authentications": 2,
+                           "evicted": 0})
+
+    def test_refreshes_expiring_token(self):
+        """Tests that a token close to expiring is replaced"""
+        self.expires = time.time() + 30
+        ts = self.manager.client("http://a.example.com/v1", "malcolm", "pw")
+        self.assertIs(self.manager.client("http://a.example.com/v1",
+                                          "malcolm", "pw"), ts)
+        self.assertEquals(requests.post.call_count, 2)
+
+    def test_password_change(self):
+        """Tests that a different password logs in again"""
+        self.manager.client("http://a.example.com/v1", "malcolm", "pw")
+        self.manager.client("http://a.example.com/v1", "malcolm", "new")
+        self.assertEquals(requests.post.call_count, 2)
+
+    def test_failed_login(self):
+        """Tests that login errors are returned and retried next time"""
+        requests.post.side_effect = lambda url, json=None: resp(
+            {"error": "Authentication failure"}, 401)
+        self.assertEquals(self.manager.client("http://a.example.com/v1",
+                                              "malcolm", "bad"),
+                          {"error": "Authentication failure"})
+        self.manager.client("http://a.example.com/v1", "malcolm", "bad")
+        self.assertEquals(requests.post.call_count, 2)
+
+    def test_evicts_idle(self):
+        """Tests that unused clients are dropped"""
+        self.manager.idle_timeout = 0
+        self.manager.client("http://a.example.com/v1", "malcolm", "pw")
+        time.sleep(0.01)
+        self.assertEquals(self.manager.evict_idle(), 1)
+        self.assertEquals(len(self.manager), 0)
+
+    def test_connection_limit(self):
+        """Tests that requests across every client share one connection
+        limit"""
+        self.manager = clients.ClientManager(max_connections=2)
+        active = [0]
+        peak = [0]
+        lock = threading.Lock()
+
+        def get(url):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+            return resp([])
+
+        requests.get.side_effect = get
+        tss = [self.manager.client("http://{}.example.com/v1".format(name),
+                                   "malcolm", "pw") for name in "abcd"]
+        threads = [threading.Thread(target=ts.get_times,
+                                    args=({"user": [str(n)]},))
+                   for n, ts in enumerate(tss * 2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEquals(peak[0], 2)
+
+    def test_test_mode(self):
+        """Tests that test mode clients log in once"""
+        manager = clients.ClientManager(test=True)
+        ts = manager.client("http://a.example.com/v1", "malcolm", "pw")
+        self.assertEquals(ts.token, "TESTTOKEN")
+        self.assertIs(manager.client("http://a.example.com/v1", "malcolm",
+                                     "pw"), ts)
@@ -0,0 +1,73 @@
+import unittest
+import pymesync
+from pymesync import durations
+
+
+class TestDurations(unittest.TestCase):
+
+    def test_parse_duration_formats(self):
+        """Tests every supported duration format"""
+        self.assertEquals(durations.parse_duration("1h30m"), 5400)
+        self.assertEquals(durations.parse_duration("90m"), 5400)
+        self.assertEquals(durations.parse_duration("2h"), 7200)
+        self.assertEquals(durations.parse_duration("36h"), 129600)
+        self.assertEquals(durations.parse_duration("PT1H30M"), 5400)
+        self.assertEquals(durations.parse_duration("P1DT15S"), 86415)
+        self.assertEquals(durations.parse_duration(b"0h30m"), 1800)
+        self.assertEquals(durations.parse_duration(600), 600)
+
+    def test_parse_duration_invalid(self):
+        """Tests that invalid durations return None"""
+        for value in ["", "PT", "junktime", "3hh30m", "3h30m15h", "12", -1,
+                      True, None, 1.5]:
+            self.assertIsNone(durations.parse_duration(value))
+
+    def test_parse_durations(self):
+        """Tests that parse_durations reports invalid rows by index"""
+        self.assertEquals(durations.parse_durations(["1h", "bad", 60, None]),
+                          ([3600, None, 60, None],
+                           {1: "invalid duration string",
+                            3: "invalid duration string"}))
+
+
+class TestCreateTimes(unittest.TestCase):
+
+    def setUp(self):
+        baseurl = "http://ts.example.com/v1"
+        self.ts = pymesync.TimeSync(baseurl, test=True)
+        self.ts.authenticate("testuser", "testpassword", "password")
+        self.time = {
+            "duration": "1h30m",
+            "project": "gwm",
+            "user": "example-user",
+            "date_worked": "2016-01-01",
+        }
+
+    def tearDown(self):
+        del(self.ts)
+
+    def test_create_times(self):
+        """Tests that create_times converts durations, reports bad rows in
+        place and does not modify its argument"""
+        times = [self.time, dict(self.time, duration="soon"),
+                 dict(self.time, date_worked="yesterday")]
+        results = self.ts.create_times(times, workers=2)
+
+        self.assertEquals(results[0]["duration"], 5400)
+        self.assertEquals(results[0]["uuid"],
+                          "838853e3-3635-4076-a26f-7efr4e60981f")
+        self.assertEquals(results[1],
+                          {self.ts.error: "time object: invalid duration "
+                                          "string"})
+        self.assertEquals(results[2],
+                          {self.ts.error: "time object: date_worked must be a "
+                                          "yyyy-mm-dd string"})
+        self.assertEquals(self.time["duration"], "1h30m")
+
+    def test_create_times_no_auth(self):
+        """Tests that create_times returns an error for every entry when not
+        authenticated"""
+        self.ts.token = None
+        self.assertEquals(self.ts.create_times([self.time]),
+                          [{self.ts.error: "Not authenticated with TimeSync, "
+                                           "call self.authenticate() first"}])
@@ -0,0 +1,113 @@
+import threading
+import unittest
+import requests
+from pymesync import hedging
+from pymesync import pymesync
+from helpers import resp
+
+try:
+    from unittest.mock import patch
+except:
+    from mock import patch
+
+
+class TestHedger(unittest.TestCase):
+
+    def setUp(self):
+        self.hedger = hedging.Hedger(percentile=95, max_extra=0.5,
+                                     min_delay=0.01, min_samples=3)
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        self.calls = []
+
+    def prime(self):
+        for _ in range(3):
+            self.hedger.call(lambda: None)
+
+    def slow_first(self, value):
+        """The first call blocks until released, later ones answer"""
+        self.calls.append(value)
+        if len(self.calls) == 1:
+            self.release.wait(5)
+            return "slow"
+        return "fast"
+
+    def test_no_hedge_until_primed(self):
+        """Tests that calls are made directly until latencies are known"""
+        self.assertIsNone(self.hedger.delay())
+        self.prime()
+        self.assertEquals(self.hedger.delay(), 0.01)
+        self.assertEquals(self.hedger.metrics()["hedged"], 0)
+
+    def test_hedge_wins(self):
+        """Tests that a slow call is hedged and the hedge's result used"""
+        self.prime()
+        self.assertEquals(self.hedger.call(self.slow_first, 1), "fast")
+        self.assertEquals(len(self.calls), 2)
+        metrics = self.hedger.metrics()
+        self.assertEquals((metrics["hedged"], metrics["wins"]), (1, 1))
+        self.assertEquals(metrics["hedge_rate"], 0.25)
+
+    def test_budget(self):
+        """Tests that no call is hedged beyond max_extra"""
+        self.hedger.max_extra = 0
+        self.prime()
+        self.release.set()
+        self.assertEquals(self.hedger.call(self.slow_first, 1), "slow")
+        self.assertEquals(len(self.calls), 1)
+
+    def test_exception_falls_back(self):
+        """Tests that an error from one call waits for the other"""
+        self.prime()
+        failures = []
+
+        def call():
+            failures.append(1)
+            if len(failures) == 1:
+                self.release.wait(5)
+                raise ValueError("first")
+            self.release.set()
+            raise ValueError("second")
+
+        with self.assertRaises(ValueError):
+            self.hedger.call(call)
+        self.assertEquals(len(failures), 2)
+
+
+class TestTimeSyncHedging(unittest.TestCase):
+
+    def setUp(self):
+        baseurl = "http://ts.example.com/v1"
+        self.ts = pymesync.TimeSync(baseurl, token="TESTTOKEN", timeout=5)
+        self.ts.enable_hedging(max_extra=0.5, min_delay=0.01)
+
+        self.get_patcher = patch("requests.get")
+        requests.get = self.get_patcher.start()
+        self.addCleanup(self.get_patcher.stop)
+
+    def test_get_hedged(self):
+        """Tests that a slow GET is sent again and the first response used"""
+        release = threading.Event()
+        self.addCleanup(release.set)
+        calls = []
+
+        def get(url, timeout=None):
+            calls.append(timeout)
+            if len(calls) == 11:
+                release.wait(5)
+                return resp([{"slow": True}])
+            return resp([{"slow": False}])
+
+        requests.get.side_effect = get
+        for _ in range(10):
+            self.ts.get_projects()
+
+        self.assertEquals(self.ts.get_projects(), [{"slow": False}])
+        self.assertEquals(len(calls), 12)
+        self.assertEquals(calls[-1], 5)
+        metrics = self.ts.metrics()["hedging"]
+        self.assertEquals((metrics["requests"], metrics["hedged"],
+                           metrics["wins"]), (11, 1, 1))
+
+        self.ts.disable_hedging()
+        self.assertFalse("hedging" in self.ts.metrics())
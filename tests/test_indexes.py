@@ -0,0 +1,272 @@
+import unittest
+import requests
+import pymesync
+from pymesync import indexes
+from helpers import resp
+
+try:
+    from unittest.mock import patch
+except:
+    from mock import patch
+
+
+class TestPermissionIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = indexes.PermissionIndex([{
+            "uuid": "1234",
+            "slugs": ["pyme", "ps"],
+            "users": {
+                "malcolm": {"member": True, "spectator": False,
+                            "manager": True},
+                "simon": {"member": False, "spectator": True,
+                          "manager": False}
+            }
+        }])
+
+    def test_mask(self):
+        """Tests that permissions are stored as bitmasks"""
+        self.assertEquals(self.index.mask("malcolm", "ps"),
+                          indexes.MEMBER | indexes.MANAGER)
+        self.assertEquals(self.index.mask("simon", "pyme"), indexes.SPECTATOR)
+        self.assertEquals(self.index.mask("jayne", "pyme"), 0)
+
+    def test_has(self):
+        """Tests PermissionIndex.has with known and unknown permissions"""
+        self.assertTrue(self.index.has("malcolm", "pyme", "manager"))
+        self.assertFalse(self.index.has("simon", "pyme", "manager"))
+        self.assertFalse(self.index.has("simon", "pyme", "captain"))
+
+    def test_projects(self):
+        """Tests the permission to projects lookup"""
+        self.assertEquals(self.index.projects("malcolm", "manager"),
+                          frozenset(["pyme", "ps"]))
+        self.assertEquals(self.index.projects("simon", "manager"),
+                          frozenset())
+
+    def test_project_users(self):
+        """Tests that project_users converts masks back to names"""
+        self.assertEquals(self.index.project_users("ps"),
+                          {"malcolm": ["member", "manager"],
+                           "simon": ["spectator"]})
+        self.assertIsNone(self.index.project_users("nope"))
+
+    def test_update_replaces_slugs(self):
+        """Tests that updating a project drops its old slugs and users"""
+        self.index.update({
+            "uuid": "1234",
+            "slugs": ["pymesync"],
+            "users": {"simon": {"manager": True}}
+        })
+        self.assertFalse("pyme" in self.index)
+        self.assertEquals(self.index.user_projects("malcolm"), {})
+        self.assertEquals(self.index.projects("simon", "manager"),
+                          frozenset(["pymesync"]))
+
+
+class TestTimeSyncPermissionIndex(unittest.TestCase):
+
+    def setUp(self):
+        baseurl = "http://ts.example.com/v1"
+        self.ts = pymesync.TimeSync(baseurl, test=True)
+        self.ts.authenticate("testuser", "testpassword", "password")
+
+    def tearDown(self):
+        del(self.ts)
+
+    def test_permission_index(self):
+        """Tests that permission_index is built from get_projects"""
+        index = self.ts.permission_index()
+        self.assertEquals(index.projects("tschuy", "manager"),
+                          frozenset(["gwm", "timesync", "ts"]))
+
+    def test_permission_index_create_project(self):
+        """Tests that create_project updates a built permission index"""
+        index = self.ts.permission_index()
+        self.ts.create_project({
+            "name": "Serenity",
+            "slugs": ["firefly"],
+            "users": {"malcolm": {"member": True, "manager": True}}
+        })
+        self.assertTrue(index.has("malcolm", "firefly", "manager"))
+
+    def test_permission_index_no_auth(self):
+        """Tests that permission_index requires authentication"""
+        self.ts.token = None
+        self.assertEquals(self.ts.permission_index(),
+                          {self.ts.error: "Not authenticated with TimeSync, "
+                                          "call self.authenticate() first"})
+
+
+class TestSlugIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = indexes.SlugIndex([
+            {"uuid": "1234", "revision": 1, "slugs": ["gwm", "ganeti"]},
+            {"uuid": "5678", "revision": 1, "slugs": ["ts"]},
+        ])
+
+    def test_resolve(self):
+        """Tests that every slug and slug list resolves to its uuid"""
+        self.assertEquals(self.index.resolve("gwm"), "1234")
+        self.assertEquals(self.index.resolve("ganeti"), "1234")
+        self.assertEquals(self.index.resolve(["nope", "ts"]), "5678")
+        self.assertIsNone(self.index.resolve("nope"))
+
+    def test_group_times(self):
+        """Tests that time entries are grouped by project uuid"""
+        times = [{"project": ["gwm"]}, {"project": "ganeti"},
+                 {"project": ["ts"]}, {"project": ["nope"]}]
+        self.assertEquals(self.index.group_times(times), {
+            "1234": [{"project": ["gwm"]}, {"project": "ganeti"}],
+            "5678": [{"project": ["ts"]}],
+            None: [{"project": ["nope"]}],
+        })
+
+    def test_refresh_incremental(self):
+        """Tests that refresh only touches changed or removed projects"""
+        changed = self.index.refresh([
+            {"uuid": "1234", "revision": 1, "slugs": ["gwm", "ganeti"]},
+            {"uuid": "9999", "revision": 1, "slugs": ["ps"]},
+        ])
+        self.assertEquals(changed, 2)
+        self.assertIsNone(self.index.resolve("ts"))
+        self.assertEquals(self.index.resolve("ps"), "9999")
+
+    def test_update_renames_slugs(self):
+        """Tests that an update drops slugs the project no longer has"""
+        self.index.update({"uuid": "1234", "revision": 2, "slugs": ["gwm2"]})
+        self.assertIsNone(self.index.resolve("gwm"))
+        self.assertEquals(self.index.slugs("1234"), ["gwm2"])
+
+
+class TestTimeSyncSlugIndex(unittest.TestCase):
+
+    def setUp(self):
+        baseurl = "http://ts.example.com/v1"
+        self.ts = pymesync.TimeSync(baseurl, test=True)
+        self.ts.authenticate("testuser", "testpassword", "password")
+
+    def tearDown(self):
+        del(self.ts)
+
+    def test_slug_index_groups_times(self):
+        """Tests that slug_index groups get_times results by project"""
+        groups = self.ts.slug_index().group_times(self.ts.get_times())
+        self.assertEquals(sorted(len(v) for v in groups.values()), [1, 2])
+        self.assertEquals(len(groups["a034806c-rrrr-bbbb-8de8-514575f31bfb"]),
+                          1)
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    def test_membership(self):
+        """Tests that added items are always found and few others are"""
+        bloom = indexes.BloomFilter(1000, 0.01)
+        for number in range(1000):
+            bloom.add("user{}".format(number))
+        self.assertTrue(all("user{}".format(number) in bloom
+                            for number in range(1000)))
+        false_positives = sum("other{}".format(number) in bloom
+                              for number in range(10000))
+        self.assertTrue(false_positives < 200)
+        self.assertTrue(bloom.size() < 1300)
+        self.assertFalse(bloom.add("user1"))
+
+    def test_invalid(self):
+        """Tests that impossible sizes are rejected"""
+        self.assertRaises(ValueError, indexes.BloomFilter, 0)
+        self.assertRaises(ValueError, indexes.BloomFilter, 10, 1.5)
+
+
+class TestExistenceIndex(unittest.TestCase):
+
+    def test_partition(self):
+        """Tests that names are indexed per kind from TimeSync objects"""
+        index = indexes.ExistenceIndex()
+        index.update("users", [{"username": "malcolm"}])
+        index.update("projects", [{"uuid": "1234", "slugs": ["pyme", "ps"]},
+                                  {"error": "Object not found"}])
+        index.update("activities", [{"uuid": "5678", "slug": "dev"}])
+
+        self.assertEquals(index.partition("projects", ["ps", "gwm", "1234"]),
+                          (["gwm"], ["ps", "1234"]))
+        self.assertTrue(index.might_exist("activities", "dev"))
+        self.assertFalse(index.might_exist("users", "pyme"))
+        self.assertEquals(index.update("users", [{"username": "malcolm"}]),
+                          0)
+
+    def test_growth(self):
+        """Tests that filters are added as the index fills up"""
+        index = indexes.ExistenceIndex(capacity=100)
+        index.update("users", [{"username": "user{}".format(number)}
+                               for number in range(1000)])
+        metrics = index.metrics()["users"]
+        self.assertEquals(metrics["filters"], 4)
+        self.assertTrue(990 < metrics["names"] <= 1000)
+        self.assertTrue(all(index.might_exist("users", "user{}".format(n))
+                            for n in range(1000)))
+
+
+class TestTimeSyncExistenceIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.ts = pymesync.TimeSync("http://ts.example.com/v1",
+                                    token="TESTTOKEN")
+        self.users = ["malcolm", "jayne"]
+        self.urls = []
+
+        self.get_patcher = patch("requests.get")
+        requests.get = self.get_patcher.start()
+        self.addCleanup(self.get_patcher.stop)
+
+        def get(url):
+            self.urls.append(url)
+            path = url.split("?")[0].split("/v1/")[1]
+            if path == "users":
+                return resp([{"username": name} for name in self.users])
+            name = path.split("/")[1]
+            if name in self.users:
+                return resp({"username": name})
+            return resp({"status": 404, "error": "Object not found",
+                         "text": "Nonexistent user"}, 404)
+
+        requests.get.side_effect = get
+
+    def test_find_existing(self):
+        """Tests that only names the index can't rule out are looked up"""
+        self.ts.enable_existence_index(error_rate=0.0001)
+        new = ["user{}".format(number) for number in range(50)]
+        self.assertEquals(self.ts.find_existing("users", new + ["jayne"]),
+                          ["jayne"])
+        baseurl = "http://ts.example.com/v1"
+        self.assertEquals(self.urls, [
+            "{}/users?token=TESTTOKEN".format(baseurl),
+            "{}/users/jayne?token=TESTTOKEN".format(baseurl)])
+
+    def test_incremental(self):
+        """Tests that created users are added without a refresh and stale
+        kinds are refreshed"""
+        self.ts.enable_existence_index(ttl=0)
+        patcher = patch("requests.post")
+        requests.post = patcher.start()
+        self.addCleanup(patcher.stop)
+        requests.post.return_value = resp({"username": "kaylee"})
+
+        index = self.ts.existence_index(["users"])
+        self.ts.create_user({"username": "kaylee", "password": "pass"})
+        self.assertTrue(index.might_exist("users", "kaylee"))
+
+        self.users.append("zoe")
+        self.assertTrue(self.ts.existence_index(["users"]).might_exist(
+            "users", "zoe"))
+        self.assertEquals(len(self.urls), 2)
+
+    def test_errors(self):
+        """Tests that refresh and lookup errors are returned"""
+        self.assertEquals(self.ts.existence_index(["groups"]),
+                          {self.ts.error: "invalid kind: groups"})
+        requests.get.side_effect = lambda url: resp(
+            {"error": "Server error"}, 500)
+        self.assertEquals(self.ts.find_existing("users", ["malcolm"]),
+                          {"error": "Server error"})
@@ -0,0 +1,118 @@
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+import pymesync
+from pymesync import journal
+
+
+class TestKeyJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "keys")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_time_key(self):
+        """Tests that time_key ignores fields outside KEY_FIELDS and treats
+        a project slug list like its first slug"""
+        time = {"user": "u", "project": "gwm", "date_worked": "2016-01-01",
+                "duration": 60, "notes": ""}
+        self.assertEquals(journal.time_key(time),
+                          journal.time_key(dict(time, project=["gwm", "g"],
+                                                notes=None,
+                                                uuid="x")))
+        self.assertNotEqual(journal.time_key(time),
+                            journal.time_key(dict(time, duration=61)))
+
+    def test_reserve_commit_release(self):
+        """Tests that keys can only be reserved once until released"""
+        keys = journal.KeyJournal(self.path)
+        self.assertTrue(keys.reserve("a"))
+        self.assertFalse(keys.reserve("a"))
+        keys.release("a")
+        self.assertTrue(keys.reserve("a"))
+        keys.commit("a")
+        self.assertFalse(keys.reserve("a"))
+        self.assertTrue("a" in keys)
+
+    def test_shared_file(self):
+        """Tests that journals on the same file see each other's keys"""
+        first = journal.KeyJournal(self.path)
+        second = journal.KeyJournal(self.path)
+        first.commit("a")
+        self.assertFalse(second.reserve("a"))
+        self.assertEquals(len(journal.KeyJournal(self.path)), 1)
+
+    def test_shared_reservations(self):
+        """Tests that a key reserved through one journal can't be reserved
+        through another on the same file until it is released"""
+        first = journal.KeyJournal(self.path)
+        second = journal.KeyJournal(self.path)
+        self.assertTrue(first.reserve("x"))
+        self.assertFalse(second.reserve("x"))
+        self.assertFalse(journal.KeyJournal(self.path).reserve("x"))
+        first.release("x")
+        self.assertTrue(second.reserve("x"))
+        second.commit("x")
+        self.assertFalse(first.reserve("x"))
+        self.assertTrue("x" in journal.KeyJournal(self.path))
+
+    def test_stale_reservation(self):
+        """Tests that a reservation left by a dead process expires"""
+        journal.KeyJournal(self.path).reserve("x")
+        self.assertFalse(journal.KeyJournal(self.path).reserve("x"))
+        later = journal.KeyJournal(self.path, reservation_ttl=0)
+        self.assertTrue(later.reserve("x"))
+
+        # A claim made by a process that has exited
+        with open(self.path, "a") as handle:
+            handle.write("reserve y {0!r} {1} 999999999\n".format(
+                time.time(), socket.gethostname()))
+        self.assertTrue(journal.KeyJournal(self.path).reserve("y"))
+
+
+class TestIdempotentCreateTime(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        baseurl = "http://ts.example.com/v1"
+        self.ts = pymesync.TimeSync(baseurl, test=True)
+        self.ts.authenticate("testuser", "testpassword", "password")
+        self.ts.enable_idempotency(os.path.join(self.tmp, "keys"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+        del(self.ts)
+
+    def test_create_time_once(self):
+        """Tests that a retried create_time is reported as a duplicate"""
+        time = {"duration": "1h", "project": "gwm", "user": "userone",
+                "date_worked": "2016-01-01"}
+        self.assertEquals(self.ts.create_time(dict(time))["uuid"],
+                          "838853e3-3635-4076-a26f-7efr4e60981f")
+        result = self.ts.create_time(dict(time))
+        self.assertEquals(result, {"status": "duplicate",
+                                   "key": journal.time_key(
+                                       dict(time, duration=3600))})
+
+    def test_create_time_existing(self):
+        """Tests that an entry TimeSync already has is returned instead of
+        being created again"""
+        time = {"duration": 12, "project": "gwm", "user": "userone",
+                "date_worked": "2014-04-17",
+                "notes": "Worked on documentation."}
+        self.assertEquals(self.ts.create_time(time)["uuid"],
+                          "c3706e79-1c9a-4765-8d7f-89b4544cad56")
+
+    def test_create_times_duplicates_in_batch(self):
+        """Tests that identical entries in one batch are only sent once"""
+        time = {"duration": 60, "project": "gwm", "user": "userone",
+                "date_worked": "2016-01-01"}
+        results = self.ts.create_times([time, time, time], workers=3)
+        created = [r for r in results if "uuid" in r]
+        self.assertEquals(len(created), 1)
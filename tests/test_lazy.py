@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+import unittest
+from pymesync import lazy
+
+
+class TestLazyModule(unittest.TestCase):
+
+    def test_imports_on_first_use(self):
+        """Tests that a module is imported by the first attribute lookup"""
+        module = lazy.LazyModule("json")
+        self.assertNotIn("(loaded)", repr(module))
+        self.assertEquals(module.dumps([1]), "[1]")
+        self.assertIn("(loaded)", repr(module))
+
+    def test_sees_patched_attributes(self):
+        """Tests that attributes changed on the real module after loading are
+        seen through the proxy"""
+        import json
+        module = lazy.LazyModule("json")
+        original = json.dumps
+        json.dumps = lambda obj: "patched"
+        try:
+            self.assertEquals(module.dumps([1]), "patched")
+        finally:
+            json.dumps = original
+
+    def test_missing_module(self):
+        """Tests that a missing module raises ImportError when used"""
+        module = lazy.LazyModule("pymesync_no_such_module")
+        with self.assertRaises(ImportError):
+            module.anything
+
+    def test_import_pymesync_is_lazy(self):
+        """Tests that importing pymesync doesn't import its heavy
+        dependencies"""
+        root = os.path.join(os.path.dirname(__file__), os.pardir)
+        output = subprocess.check_output([
+            sys.executable, "-c",
+            "import sys, pymesync; print(sorted(name for name in ["
+            "'requests', 'bcrypt', 'multiprocessing.pool', "
+            "'pymesync.mock_pymesync'] if name in sys.modules))"],
+            cwd=root)
+        self.assertEquals(output.decode("utf-8").strip(), "[]")
@@ -631,3 +631,17 @@ class TestMockPymesync(unittest.TestCase):
         }]
 
         self.assertEquals(self.ts.get_users("spectator"), expected_result)
+
+    def test_mock_project_users_many(self):
+        expected_result = {
+            "gwm": {"patcht": ["member"],
+                    "tschuy": ["member", "spectator", "manager"]},
+            "ts": {"patcht": ["member"],
+                   "mrsj": ["member", "spectator"],
+                   "tschuy": ["member", "spectator", "manager"]}
+        }
+
+        self.assertEquals(self.ts.project_users_many(["gwm", "ts"]),
+                          expected_result)
+        self.assertTrue(self.ts.has_permission("mrsj", "ps", "manager"))
+        self.assertFalse(self.ts.has_permission("mrsj", "ts", "manager"))
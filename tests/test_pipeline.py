@@ -0,0 +1,104 @@
+import unittest
+import threading
+import pymesync
+from pymesync import pipeline
+
+
+class TestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        baseurl = "http://ts.example.com/v1"
+        self.ts = pymesync.TimeSync(baseurl, test=True)
+        self.ts.authenticate("testuser", "testpassword", "password")
+
+    def tearDown(self):
+        del(self.ts)
+
+    def test_prefetch_keeps_order(self):
+        """Tests that pipeline.prefetch yields results in query order"""
+        results = list(pipeline.prefetch(lambda q: q * 2, range(10), 3))
+        self.assertEquals(results, [(q, q * 2) for q in range(10)])
+
+    def test_prefetch_backpressure(self):
+        """Tests that pipeline.prefetch stops fetching when depth results are
+        waiting for the consumer"""
+        calls = []
+        blocked = threading.Event()
+
+        def fetch(query):
+            calls.append(query)
+            if len(calls) == 3:
+                blocked.set()
+            return query
+
+        gen = pipeline.prefetch(fetch, range(100), depth=1)
+        self.assertEquals(next(gen), (0, 0))
+        blocked.wait(0.2)
+        # One result consumed, one in flight
+        self.assertEquals(len(calls), 2)
+        gen.close()
+
+    def test_prefetch_workers(self):
+        """Tests that pipeline.prefetch runs up to workers fetches at once
+        and still yields results in query order"""
+        barrier = threading.Event()
+        started = []
+
+        def fetch(query):
+            started.append(query)
+            if len(started) == 3:
+                barrier.set()
+            barrier.wait(1)
+            return query
+
+        results = list(pipeline.prefetch(fetch, range(6), depth=3, workers=3))
+        self.assertTrue(barrier.is_set())
+        self.assertEquals(results, [(q, q) for q in range(6)])
+
+    def test_prefetch_reraises(self):
+        """Tests that exceptions from fetch are raised in the consumer"""
+        def fetch(query):
+            raise KeyError(query)
+
+        gen = pipeline.prefetch(fetch, ["bad"])
+        self.assertRaises(KeyError, list, gen)
+
+    def test_prefetch_invalid_depth(self):
+        """Tests that pipeline.prefetch rejects a depth or workers below 1"""
+        self.assertRaises(ValueError, list,
+                          pipeline.prefetch(lambda q: q, [1], 0))
+        self.assertRaises(ValueError, list,
+                          pipeline.prefetch(lambda q: q, [1], 1, 0))
+
+    def test_date_shards(self):
+        """Tests that date_shards covers the whole range inclusively"""
+        self.assertEquals(list(pipeline.date_shards("2016-01-30",
+                                                    "2016-02-05", 3)),
+                          [("2016-01-30", "2016-02-01"),
+                           ("2016-02-02", "2016-02-04"),
+                           ("2016-02-05", "2016-02-05")])
+
+    def test_ts_prefetch(self):
+        """Tests that TimeSync.prefetch yields get_users results"""
+        results = list(self.ts.prefetch("get_users", ["admin", "manager"]))
+        self.assertEquals([q for q, r in results], ["admin", "manager"])
+        self.assertEquals(results[0][1], self.ts.get_users("admin"))
+
+    def test_ts_prefetch_invalid_method(self):
+        """Tests that TimeSync.prefetch returns an error for bad methods"""
+        self.assertEquals(list(self.ts.prefetch("delete_user", ["x"])),
+                          [(None, [{self.ts.error: "invalid prefetch method: "
+                                                   "delete_user"}])])
+
+    def test_ts_prefetch_times(self):
+        """Tests that TimeSync.prefetch_times shards the date range and does
+        not modify query_parameters"""
+        query = {"user": ["userone"]}
+        results = list(self.ts.prefetch_times("2016-01-01", "2016-01-10", 5,
+                                              query))
+        self.assertEquals([q for q, r in results],
+                          [{"user": ["userone"], "start": ["2016-01-01"],
+                            "end": ["2016-01-05"]},
+                           {"user": ["userone"], "start": ["2016-01-06"],
+                            "end": ["2016-01-10"]}])
+        self.assertEquals(query, {"user": ["userone"]})
@@ -6,6 +6,8 @@ import base64
 import ast
 import datetime
 import bcrypt
+import threading
+import time
 
 try:
     from unittest import mock
@@ -1776,7 +1778,10 @@ class TestPymesync(unittest.TestCase):
 
         self.ts.create_user(user)
 
-        mock_create_or_update.assert_called_with(user, None, "user", "users")
+        hashed = mock_create_or_update.call_args[0][0]
+        mock_create_or_update.assert_called_with(hashed, None, "user", "users")
+        self.assertEquals(dict(user, password=hashed["password"]), hashed)
+        self.assertEquals(user["password"], "password")
 
     @patch("pymesync.TimeSync._TimeSync__create_or_update")
     def test_create_user_valid_perms(self, mock_create_or_update):
@@ -1794,9 +1799,11 @@ class TestPymesync(unittest.TestCase):
 
         self.ts.create_user(user)
 
-        mock_create_or_update.assert_called_with(user, None, "user", "users")
-        self.assertEquals(bcrypt.hashpw(b"password", user["password"]),
-                          user["password"])
+        hashed = mock_create_or_update.call_args[0][0]
+        mock_create_or_update.assert_called_with(hashed, None, "user", "users")
+        self.assertEquals(bcrypt.hashpw(b"password", hashed["password"]),
+                          hashed["password"])
+        self.assertEquals(user["password"], "password")
 
     def test_create_user_invalid_admin(self):
         """Tests that TimeSync.create_user returns error with invalid perm
@@ -1839,8 +1846,9 @@ class TestPymesync(unittest.TestCase):
 
         self.ts.create_user(user)
 
-        self.assertEquals(bcrypt.hashpw(encoded_password, user["password"]),
-                          user["password"])
+        hashed = mock_create_or_update.call_args[0][0]
+        self.assertEquals(bcrypt.hashpw(encoded_password, hashed["password"]),
+                          hashed["password"])
 
     @patch("pymesync.TimeSync._TimeSync__create_or_update")
     def test_update_user(self, mock_create_or_update):
@@ -1854,10 +1862,12 @@ class TestPymesync(unittest.TestCase):
         }
 
         self.ts.update_user(user, "example")
-        mock_create_or_update.assert_called_with(user, "example", "user",
+        hashed = mock_create_or_update.call_args[0][0]
+        mock_create_or_update.assert_called_with(hashed, "example", "user",
                                                  "users", False)
-        self.assertEquals(bcrypt.hashpw(b"password", user["password"]),
-                          user["password"])
+        self.assertEquals(bcrypt.hashpw(b"password", hashed["password"]),
+                          hashed["password"])
+        self.assertEquals(user["password"], "password")
 
     @patch("pymesync.TimeSync._TimeSync__create_or_update")
     def test_update_user_unicode_password(self, mock_create_or_update):
@@ -1878,8 +1888,9 @@ class TestPymesync(unittest.TestCase):
 
         self.ts.update_user(user, user["username"])
 
-        self.assertEquals(bcrypt.hashpw(encoded_password, user["password"]),
-                          user["password"])
+        hashed = mock_create_or_update.call_args[0][0]
+        self.assertEquals(bcrypt.hashpw(encoded_password, hashed["password"]),
+                          hashed["password"])
 
     def test_authentication(self):
         """Tests authenticate method for url and data construction"""
@@ -2219,10 +2230,10 @@ class TestPymesync(unittest.TestCase):
 
         encoded_password = user["password"].encode("utf-8")
 
-        self.ts._TimeSync__hash_user_password(user)
+        hashed = self.ts._TimeSync__hash_user_password(user)
 
-        self.assertEquals(bcrypt.hashpw(encoded_password, user["password"]),
-                          user["password"])
+        self.assertEquals(bcrypt.hashpw(encoded_password, hashed["password"]),
+                          hashed["password"])
 
     def test_hash_user_password_nonunicode(self):
         """Tests that non-unicode passwords are hashed correctly"""
@@ -2233,10 +2244,10 @@ class TestPymesync(unittest.TestCase):
 
         password = user["password"]
 
-        self.ts._TimeSync__hash_user_password(user)
+        hashed = self.ts._TimeSync__hash_user_password(user)
 
-        self.assertEquals(bcrypt.hashpw(password, user["password"]),
-                          user["password"])
+        self.assertEquals(bcrypt.hashpw(password, hashed["password"]),
+                          hashed["password"])
 
     def test_duration_invalid(self):
         """Tests for duration validity - if the duration given is a negative
@@ -2351,3 +2362,127 @@ class TestPymesync(unittest.TestCase):
         """Test that the trailing slash in the baseurl is removed"""
         self.ts = pymesync.TimeSync("http://ts.example.com/v1")
         self.assertEquals(self.ts.baseurl, "http://ts.example.com/v1")
+
+    def test_project_users_many(self):
+        """Test project_users_many returns permissions for every slug of each
+        project from a single get_projects request"""
+        response = resp()
+        response.status_code = 200
+        response.text = json.dumps([{
+            "slugs": ["pyme", "ps"],
+            "users": {
+                "malcolm": {"member": True,
+                            "manager": True,
+                            "spectator": False},
+                "simon":   {"member": False,
+                            "manager": False,
+                            "spectator": True}
+            }
+        }])
+
+        requests.get.return_value = response
+
+        self.assertEquals(self.ts.project_users_many(["pyme", "ps"]), {
+            "pyme": {"malcolm": ["member", "manager"], "simon": ["spectator"]},
+            "ps": {"malcolm": ["member", "manager"], "simon": ["spectator"]},
+        })
+        requests.get.assert_called_once_with(
+            "http://ts.example.com/v1/projects?token=TESTTOKEN")
+
+    def test_project_users_many_cached(self):
+        """Test project_users_many and has_permission reuse the permission
+        cache until it expires"""
+        response = resp()
+        response.status_code = 200
+        response.text = json.dumps([{
+            "slugs": ["pyme"],
+            "users": {"malcolm": {"member": True, "manager": True}}
+        }])
+
+        requests.get.return_value = response
+
+        self.ts.project_users_many(["pyme"])
+        self.assertTrue(self.ts.has_permission("malcolm", "pyme", "manager"))
+        self.assertFalse(self.ts.has_permission("malcolm", "pyme",
+                                                "spectator"))
+        self.assertFalse(self.ts.has_permission("jayne", "pyme", "member"))
+        self.assertEquals(requests.get.call_count, 1)
+
+        self.ts.refresh_permissions()
+        self.ts.has_permission("malcolm", "pyme", "manager")
+        self.assertEquals(requests.get.call_count, 2)
+
+    def test_project_users_many_missing_slug(self):
+        """Test project_users_many fetches slugs missing from get_projects
+        with project_users"""
+        projects = resp()
+        projects.status_code = 200
+        projects.text = json.dumps([])
+        missing = resp()
+        missing.status_code = 404
+        missing.text = json.dumps({"error": "Object not found",
+                                   "text": "Nonexistent project"})
+
+        def get(url):
+            return projects if url.endswith("/projects?token=TESTTOKEN") else (
+                missing)
+
+        requests.get.side_effect = get
+
+        self.assertEquals(self.ts.project_users_many(["nope"]),
+                          {"nope": {"error": "Object not found",
+                                    "text": "Nonexistent project"}})
+
+    def test_project_users_many_error(self):
+        """Test project_users_many and has_permission when get_projects
+        fails"""
+        response = resp()
+        response.status_code = 401
+        response.text = json.dumps({"error": "Authentication failure"})
+
+        requests.get.return_value = response
+
+        self.assertEquals(self.ts.project_users_many(["pyme"]),
+                          {"error": "Authentication failure"})
+        self.assertFalse(self.ts.has_permission("malcolm", "pyme", "member"))
+
+    def test_project_users_many_no_auth(self):
+        """Test project_users_many returns an error when not
+        authenticated"""
+        self.ts.token = None
+        self.assertEquals(self.ts.project_users_many(["pyme"]),
+                          {self.ts.error: "Not authenticated with TimeSync, "
+                                          "call self.authenticate() first"})
+
+    def test_get_projects_single_flight(self):
+        """Test concurrent identical get_projects calls share one request"""
+        response = resp()
+        response.status_code = 200
+        response.text = json.dumps([{"slugs": ["pyme"]}])
+        started = threading.Event()
+        release = threading.Event()
+
+        def get(url):
+            started.set()
+            release.wait(5)
+            return response
+
+        requests.get.side_effect = get
+
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(self.ts.get_projects()))
+            for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        started.wait(5)
+        while self.ts.metrics()["single_flight"]["calls"] < 4:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEquals(results, [[{"slugs": ["pyme"]}]] * 4)
+        self.assertEquals(requests.get.call_count, 1)
+        self.assertEquals(self.ts.metrics()["single_flight"],
+                          {"calls": 4, "shared": 3})
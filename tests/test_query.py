@@ -0,0 +1,69 @@
+import unittest
+import pymesync
+from pymesync.query import Query
+
+
+class TestQuery(unittest.TestCase):
+
+    def test_canonical(self):
+        """Tests that queries with the same filters are equal and hash the
+        same whatever order or sequence type they were given in"""
+        one = Query({"user": ["malcolm"], "start": "2016-01-01"})
+        two = Query(start="2016-01-01", user=("malcolm",))
+        self.assertEquals(one, two)
+        self.assertEquals(hash(one), hash(two))
+        self.assertEquals(list(one), ["start", "user"])
+        self.assertEquals(one["user"], ("malcolm",))
+        self.assertEquals({one: 1}[two], 1)
+
+    def test_immutable(self):
+        """Tests that a query copies its filters and can't be changed"""
+        filters = {"user": ["malcolm"]}
+        query = Query(filters)
+        filters["user"].append("jayne")
+        self.assertEquals(query["user"], ("malcolm",))
+        with self.assertRaises(TypeError):
+            query["user"] = ["jayne"]
+
+    def test_filter_string(self):
+        """Tests the get_times() query string"""
+        query = Query({"user": ["malcolm", "river tam"], "start": "2016-01-01",
+                       "include_revisions": True})
+        self.assertEquals(query.filter_string(),
+                          "?include_revisions=true&start=2016-01-01&"
+                          "user=malcolm&user=river%20tam&")
+        self.assertIs(query.filter_string(), query.filter_string())
+
+    def test_filter_string_uuid(self):
+        """Tests that only include_* filters are sent with a uuid"""
+        query = Query({"uuid": "some/uuid", "user": ["malcolm"],
+                       "include_deleted": False})
+        self.assertEquals(query.filter_string(),
+                          "/some%2Fuuid?include_deleted=false&")
+
+    def test_endpoint_string(self):
+        """Tests the get_projects() and get_activities() query string"""
+        self.assertEquals(Query({"slug": "pyme", "include_revisions": 1})
+                          .endpoint_string(),
+                          "/pyme?include_revisions=true&")
+        self.assertEquals(Query({"user": ["a&b"], "include_deleted": True})
+                          .endpoint_string(),
+                          "?user=a%26b&include_deleted=true&")
+        self.assertEquals(Query().endpoint_string(), "?")
+        self.assertIsNone(Query({"slug": "pyme", "include_deleted": True})
+                          .endpoint_string())
+
+    def test_get_times_with_query(self):
+        """Tests that a Query can be reused with the get_* methods and the
+        caller's dict is not modified"""
+        ts = pymesync.TimeSync("http://ts.example.com/v1", test=True)
+        ts.authenticate("testuser", "testpassword", "password")
+        filters = {"slug": "gwm", "include_revisions": True}
+        query = Query(filters)
+
+        for _ in range(2):
+            self.assertEquals(ts.get_projects(query),
+                              ts.get_projects(filters))
+            self.assertEquals(ts.get_times(Query(uuid="some-uuid")),
+                              ts.get_times({"uuid": "some-uuid"}))
+        self.assertEquals(filters, {"slug": "gwm", "include_revisions": True})
@@ -0,0 +1,83 @@
+import threading
+import unittest
+from pymesync import singleflight
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def setUp(self):
+        self.flight = singleflight.SingleFlight()
+        self.release = threading.Event()
+        self.calls = []
+
+    def slow(self, value):
+        self.calls.append(value)
+        self.release.wait(5)
+        if isinstance(value, Exception):
+            raise value
+        return {"value": value}
+
+    def run_concurrently(self, key, value, count):
+        results = [None] * count
+        errors = [None] * count
+
+        def worker(n):
+            try:
+                results[n] = self.flight.do(key, self.slow, value)
+            except Exception as e:
+                errors[n] = e
+
+        threads = [threading.Thread(target=worker, args=(n,))
+                   for n in range(count)]
+        for thread in threads:
+            thread.start()
+        while self.flight.metrics()["calls"] < count:
+            threading.Event().wait(0.01)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        return results, errors
+
+    def test_shares_one_call(self):
+        """Tests that concurrent calls with one key run the function once
+        and each get their own copy of the result"""
+        results, errors = self.run_concurrently("url", 1, 5)
+        self.assertEquals(self.calls, [1])
+        self.assertEquals(results, [{"value": 1}] * 5)
+        self.assertEquals(len(set(id(result) for result in results)), 5)
+        self.assertEquals(self.flight.metrics(), {"calls": 5, "shared": 4})
+
+    def test_shares_exception(self):
+        """Tests that followers get the leader's exception"""
+        error = ValueError("boom")
+        results, errors = self.run_concurrently("url", error, 3)
+        self.assertEquals(len(self.calls), 1)
+        self.assertEquals(errors, [error] * 3)
+
+    def test_sequential_calls_not_cached(self):
+        """Tests that calls made one after another each run the function"""
+        self.release.set()
+        self.flight.do("url", self.slow, 1)
+        self.flight.do("url", self.slow, 2)
+        self.assertEquals(self.calls, [1, 2])
+
+    def test_different_keys(self):
+        """Tests that calls with different keys do not share"""
+        self.release.set()
+        self.assertEquals(self.flight.do("a", self.slow, 1), {"value": 1})
+        self.assertEquals(self.flight.do("b", self.slow, 2), {"value": 2})
+        self.assertEquals(self.flight.metrics()["shared"], 0)
+
+    def test_follower_timeout(self):
+        """Tests that a follower stops waiting after its timeout while the
+        leader carries on"""
+        leader = threading.Thread(target=self.flight.do,
+                                  args=("url", self.slow, 1))
+        leader.start()
+        while not self.calls:
+            threading.Event().wait(0.01)
+        with self.assertRaises(singleflight.Timeout):
+            self.flight.do("url", self.slow, 2, timeout=0.05)
+        self.release.set()
+        leader.join(5)
+        self.assertEquals(self.calls, [1])
@@ -0,0 +1,95 @@
+import copy
+import threading
+import unittest
+import requests
+from pymesync import pymesync
+from helpers import resp
+
+try:
+    from unittest.mock import patch
+except:
+    from mock import patch
+
+
+class TestThreadSafety(unittest.TestCase):
+
+    def setUp(self):
+        baseurl = "http://ts.example.com/v1"
+        self.ts = pymesync.TimeSync(baseurl, token="TESTTOKEN")
+
+        self.get_patcher = patch("requests.get")
+        self.post_patcher = patch("requests.post")
+        requests.get = self.get_patcher.start()
+        requests.post = self.post_patcher.start()
+        self.addCleanup(self.get_patcher.stop)
+        self.addCleanup(self.post_patcher.stop)
+
+        requests.get.side_effect = self.get
+        requests.post.side_effect = self.post
+
+    def get(self, url):
+        # Echo the url back so each caller can check it got its own result
+        return resp([{"url": url, "slugs": ["pyme"], "uuid": "p-uuid",
+                      "revision": 1,
+                      "users": {"malcolm": {"member": True}}}])
+
+    def post(self, url, json=None):
+        if url.endswith("/login"):
+            return resp({"token": "TOKEN-{}".format(
+                json["auth"]["username"])})
+        if url.endswith("/users"):
+            return resp({"username": json["object"]["username"]})
+        return resp(dict(json["object"], uuid="t-uuid"))
+
+    def test_shared_instance(self):
+        """Tests one TimeSync object used by many threads at once never
+        modifies caller arguments, mixes up results or raises"""
+        time_query = {"user": ["malcolm"], "start": "2016-01-01",
+                      "include_revisions": True}
+        project_query = {"slug": "pyme", "include_revisions": False}
+        time = {"duration": "1h30m", "project": "pyme", "user": "malcolm",
+                "date_worked": "2016-01-01"}
+        user = {"username": "simon", "password": u"password"}
+        originals = copy.deepcopy([time_query, project_query, time, user])
+        errors = []
+
+        def worker(n):
+            try:
+                for _ in range(20):
+                    times = self.ts.get_times(time_query)
+                    self.assertEqual(
+                        times[0]["url"],
+                        "http://ts.example.com/v1/times?include_revisions="
+                        "true&start=2016-01-01&user=malcolm&token={}".format(
+                            times[0]["url"].rsplit("=", 1)[1]))
+
+                    projects = self.ts.get_projects(project_query)
+                    self.assertTrue(projects[0]["url"].startswith(
+                        "http://ts.example.com/v1/projects/pyme?"
+                        "include_revisions=false&token="))
+
+                    created = self.ts.create_time(time)
+                    self.assertEqual(created["duration"], 5400)
+
+                    self.assertTrue(self.ts.has_permission("malcolm", "pyme",
+                                                           "member"))
+                    if n % 4 == 0:
+                        result = self.ts.authenticate(
+                            "user{}".format(n), "password", "password")
+                        self.assertEqual(result["token"],
+                                         "TOKEN-user{}".format(n))
+                if n == 0:
+                    self.ts.create_user(user)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(n,))
+                   for n in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+
+        self.assertEqual(errors, [])
+        self.assertEqual([time_query, project_query, time, user], originals)
+        self.assertTrue(self.ts.token.startswith("TOKEN-user"))
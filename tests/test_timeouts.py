@@ -0,0 +1,115 @@
+import threading
+import time
+import unittest
+import requests
+from pymesync import pymesync
+from helpers import resp
+
+try:
+    from unittest.mock import patch
+except:
+    from mock import patch
+
+
+class TestTimeouts(unittest.TestCase):
+
+    def setUp(self):
+        baseurl = "http://ts.example.com/v1"
+        self.ts = pymesync.TimeSync(baseurl, token="TESTTOKEN", timeout=10)
+        self.url = "{}/times?token=TESTTOKEN".format(baseurl)
+
+        self.get_patcher = patch("requests.get")
+        self.post_patcher = patch("requests.post")
+        requests.get = self.get_patcher.start()
+        requests.post = self.post_patcher.start()
+        self.addCleanup(self.get_patcher.stop)
+        self.addCleanup(self.post_patcher.stop)
+
+        requests.get.return_value = resp([])
+        requests.post.side_effect = lambda url, json=None, timeout=None: (
+            resp(dict(json["object"], uuid="some-uuid")))
+
+        self.time = {"duration": 3600, "project": "gwm", "user": "userone",
+                     "date_worked": "2016-01-01"}
+
+    def test_timeout(self):
+        """Tests that the configured timeout is sent with each request"""
+        self.ts.get_times()
+        requests.get.assert_called_with(self.url, timeout=10)
+
+    def test_request_timeout(self):
+        """Tests that request_timeout overrides the timeout in its block"""
+        with self.ts.request_timeout((1, 5)):
+            self.ts.get_times()
+            requests.get.assert_called_with(self.url, timeout=(1, 5))
+        self.ts.get_times()
+        requests.get.assert_called_with(self.url, timeout=10)
+
+    def test_deadline_shrinks_timeout(self):
+        """Tests that a deadline cuts the timeout to the time left"""
+        with self.ts.deadline(2):
+            self.ts.get_times()
+            with self.ts.deadline(60):
+                self.assertTrue(self.ts.deadline_remaining() <= 2)
+        timeout = requests.get.call_args[1]["timeout"]
+        self.assertTrue(0 < timeout <= 2)
+        self.assertIsNone(self.ts.deadline_remaining())
+
+    def test_deadline_expired(self):
+        """Tests that nothing is sent once the deadline has passed"""
+        with self.ts.deadline(0):
+            self.assertEquals(self.ts.deadline_remaining(), 0)
+            result = self.ts.get_times()
+        self.assertFalse(requests.get.called)
+        self.assertTrue(isinstance(result[0][self.ts.error],
+                                   requests.exceptions.Timeout))
+
+    def test_deadline_worker_threads(self):
+        """Tests that create_times applies the caller's deadline in its
+        worker threads"""
+        with self.ts.deadline(0):
+            results = self.ts.create_times([self.time] * 3, workers=3)
+        self.assertFalse(requests.post.called)
+        self.assertEquals(len([result for result in results
+                               if self.ts.error in result]), 3)
+
+        with self.ts.deadline(5):
+            self.ts.create_times([self.time] * 2, workers=2)
+        for call in requests.post.call_args_list:
+            self.assertTrue(0 < call[1]["timeout"] <= 5)
+
+    def test_deadline_per_thread(self):
+        """Tests that a deadline only applies to the thread that set it"""
+        results = []
+        with self.ts.deadline(0):
+            thread = threading.Thread(
+                target=lambda: results.append(self.ts.get_times()))
+            thread.start()
+            thread.join(5)
+        self.assertEquals(results, [[]])
+
+    def test_deadline_shared_request(self):
+        """Tests that a caller sharing another thread's slow GET stops
+        waiting for it at its deadline"""
+        release = threading.Event()
+        started = threading.Event()
+
+        def slow_get(url, timeout=None):
+            started.set()
+            release.wait(5)
+            return resp([])
+
+        requests.get.side_effect = slow_get
+        thread = threading.Thread(target=self.ts.get_times)
+        thread.start()
+        started.wait(5)
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(release.set)
+
+        begun = time.time()
+        with self.ts.deadline(0.2):
+            result = self.ts.get_times()
+        self.assertTrue(time.time() - begun < 1)
+        self.assertTrue(isinstance(result[0][self.ts.error],
+                                   requests.exceptions.Timeout))
+        self.assertEquals(requests.get.call_count, 1)
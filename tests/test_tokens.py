@@ -0,0 +1,151 @@
+import json
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+import unittest
+import requests
+from pymesync import pymesync
+from pymesync import tokens
+from helpers import resp, make_token
+
+try:
+    from unittest.mock import patch
+except:
+    from mock import patch
+
+
+class TestTokenCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "tokens.json")
+        self.cache = tokens.TokenCache(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_get_set(self):
+        """Tests that tokens are stored per baseurl, user and auth type and
+        expire"""
+        now = time.time()
+        self.cache.set("http://ts", "malcolm", "password", "pw", "one",
+                       now + 600)
+        self.cache.set("http://ts", "malcolm", "ldap", "pw", "two", now + 60)
+        self.assertEquals(self.cache.get("http://ts", "malcolm", "password",
+                                         "pw"), "one")
+        self.assertEquals(self.cache.get("http://ts", "malcolm", "ldap",
+                                         "pw"), "two")
+        self.assertIsNone(self.cache.get("http://ts", "malcolm", "ldap",
+                                         "pw", margin=120))
+        self.assertIsNone(self.cache.get("http://ts", "jayne", "password",
+                                         "pw"))
+
+        self.cache.delete("http://ts", "malcolm", "password")
+        self.assertIsNone(self.cache.get("http://ts", "malcolm", "password",
+                                         "pw"))
+        self.assertEquals(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+
+    def test_password_verifier(self):
+        """Tests that a token is only returned for the password it was
+        stored with, and the password is not stored"""
+        self.cache.set("http://ts", "malcolm", "password", "secret", "one",
+                       time.time() + 600)
+        self.assertIsNone(self.cache.get("http://ts", "malcolm", "password",
+                                         "wrong"))
+        self.assertEquals(self.cache.get("http://ts", "malcolm", "password",
+                                         "secret"), "one")
+        with open(self.path) as handle:
+            self.assertFalse("secret" in handle.read())
+
+        # Entries without a verifier are never used
+        with open(self.path) as handle:
+            entries = json.load(handle)
+        for entry in entries.values():
+            del entry["verifier"]
+        with open(self.path, "w") as handle:
+            json.dump(entries, handle)
+        self.assertIsNone(self.cache.get("http://ts", "malcolm", "password",
+                                         "secret"))
+
+    def test_unreadable_file(self):
+        """Tests that a corrupt cache file is treated as empty"""
+        with open(self.path, "w") as handle:
+            handle.write("{not json")
+        self.assertIsNone(self.cache.get("http://ts", "malcolm", "password",
+                                         "pw"))
+
+
+class TestTimeSyncTokenCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "tokens.json")
+        self.baseurl = "http://ts.example.com/v1"
+        self.expires = time.time() + 3600
+        self.logins = []
+
+        self.post_patcher = patch("requests.post")
+        requests.post = self.post_patcher.start()
+        self.addCleanup(self.post_patcher.stop)
+
+        def post(url, json=None):
+            self.logins.append(json["auth"]["username"])
+            # Slow enough for concurrent logins to overlap
+            time.sleep(0.05)
+            return resp({"token": make_token(self.expires,
+                                             len(self.logins))})
+
+        requests.post.side_effect = post
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def login(self, password="password"):
+        ts = pymesync.TimeSync(self.baseurl)
+        ts.enable_token_cache(self.path)
+        return ts, ts.authenticate("malcolm", password, "password")
+
+    def test_shared_login(self):
+        """Tests that concurrent logins through one cache file make one
+        request"""
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            self.login())) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEquals(self.logins, ["malcolm"])
+        self.assertEquals(len(set(ts.token for ts, result in results)), 1)
+        self.assertEquals(results[0][1], {"token": results[0][0].token})
+
+    def test_near_expiry(self):
+        """Tests that a token about to expire is replaced"""
+        self.expires = time.time() + 60
+        self.login()
+        ts, result = self.login()
+        self.assertEquals(len(self.logins), 2)
+        self.assertTrue(result["token"].startswith("2."))
+
+    def test_other_password(self):
+        """Tests that a cached token is not returned for another password"""
+        self.login()
+        ts, result = self.login("guess")
+        self.assertEquals(len(self.logins), 2)
+        self.assertTrue(result["token"].startswith("2."))
+
+        ts, result = self.login("guess")
+        self.assertEquals(len(self.logins), 2)
+        self.assertTrue(result["token"].startswith("2."))
+
+    def test_failed_login_not_cached(self):
+        """Tests that login errors are not cached"""
+        requests.post.side_effect = lambda url, json=None: resp(
+            {"error": "Authentication failure"}, 401)
+        ts, result = self.login()
+        self.assertEquals(result, {"error": "Authentication failure"})
+        self.assertFalse(os.path.exists(self.path))
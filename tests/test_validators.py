@@ -0,0 +1,184 @@
+import unittest
+import requests
+import pymesync
+from pymesync import validators
+from helpers import resp
+
+try:
+    from unittest.mock import patch
+except:
+    from mock import patch
+
+
+class TestValidators(unittest.TestCase):
+
+    def setUp(self):
+        self.time = {
+            "duration": 12,
+            "project": "ganeti-web-manager",
+            "user": "example-user",
+            "date_worked": "2014-04-17",
+        }
+
+    def test_schema_valid(self):
+        """Tests that a valid time has no errors"""
+        self.assertEquals(validators.SCHEMAS["time"].errors(self.time), [])
+
+    def test_schema_reports_all_errors(self):
+        """Tests that every error in an object is reported in order"""
+        self.time["bad"] = True
+        self.time["date_worked"] = "April 17"
+        del(self.time["user"])
+        self.assertEquals(validators.SCHEMAS["time"].errors(self.time), [
+            "time object: invalid field: bad",
+            "time object: missing required field(s): user",
+            "time object: date_worked must be a yyyy-mm-dd string",
+        ])
+
+    def test_schema_update_skips_required(self):
+        """Tests that required fields are not checked for updates"""
+        self.assertEquals(validators.SCHEMAS["time"].errors({"duration": 5},
+                                                            False), [])
+
+    def test_schema_type_checks(self):
+        """Tests duration, boolean and slug checks"""
+        self.assertEquals(
+            validators.SCHEMAS["time"].errors({"duration": -1}, False),
+            ["time object: duration must be a positive integer or duration "
+             "string"])
+        self.assertEquals(
+            validators.SCHEMAS["user"].errors({"active": "yes"}, False),
+            ["user object: active must be True or False"])
+        self.assertEquals(
+            validators.SCHEMAS["activity"].errors({"slug": "a b"}, False),
+            ["activity object: slug must be a slug"])
+
+    def test_validate_many(self):
+        """Tests that validate_many maps indexes of invalid objects to their
+        errors"""
+        objects = [self.time, "nope", dict(self.time, duration=True)]
+        self.assertEquals(validators.validate_many(objects, "time"), {
+            1: ["time object: must be python dictionary"],
+            2: ["time object: duration must be a positive integer or "
+                "duration string"],
+        })
+
+    def test_ts_validate(self):
+        """Tests TimeSync.validate with valid and unknown object types"""
+        ts = pymesync.TimeSync("http://ts.example.com/v1")
+        self.assertEquals(ts.validate([self.time], "time"), {})
+        self.assertEquals(ts.validate([self.time], "thing"),
+                          {ts.error: "invalid object type: thing"})
+
+
+class TestReferenceValidation(unittest.TestCase):
+
+    def setUp(self):
+        baseurl = "http://ts.example.com/v1"
+        self.ts = pymesync.TimeSync(baseurl, test=True)
+        self.ts.authenticate("testuser", "testpassword", "password")
+        self.ts.enable_reference_validation()
+        self.time = {"duration": 60, "project": "ps", "user": "userone",
+                     "activities": ["docs", "dev"],
+                     "date_worked": "2016-01-01"}
+
+    def test_reference_errors(self):
+        """Tests that every unknown reference is reported per entry"""
+        known = set(["users/userone", "projects/ps", "activities/docs"])
+        errors = validators.reference_errors(
+            [self.time, dict(self.time, project="gwm", user="nobody"), 5],
+            lambda kind, name: "{0}/{1}".format(kind, name) in known)
+        self.assertEquals(errors, {
+            0: ["time object: unknown activity: dev"],
+            1: ["time object: unknown user: nobody",
+                "time object: unknown project: gwm",
+                "time object: unknown activity: dev"]})
+
+    def test_create_times(self):
+        """Tests that entries with unknown references are not sent"""
+        results = self.ts.create_times([
+            self.time, dict(self.time, project="nope"),
+            dict(self.time, activities=["docs", "sleep"])])
+        self.assertFalse(self.ts.error in results[0])
+        self.assertEquals(results[1], {
+            self.ts.error: "time object: unknown project: nope"})
+        self.assertEquals(results[2], {
+            self.ts.error: "time object: unknown activity: sleep"})
+
+    def test_create_time(self):
+        """Tests create_time with unknown references and after turning
+        validation off"""
+        time = dict(self.time, user="nobody")
+        self.assertEquals(self.ts.create_time(time), {
+            self.ts.error: "time object: unknown user: nobody"})
+        self.ts.disable_reference_validation()
+        self.assertFalse(self.ts.error in self.ts.create_time(time))
+
+    def test_recheck(self):
+        """Tests that unknown names are fetched again once the recheck
+        interval has passed, and entries are sent unchecked when the
+        indexes can't be fetched"""
+        ts = pymesync.TimeSync("http://ts.example.com/v1", token="TOKEN")
+        ts.enable_reference_validation(recheck=0)
+        projects = [{"uuid": "1", "slugs": ["ps"]}]
+        get_patcher = patch("requests.get")
+        requests.get = get_patcher.start()
+        self.addCleanup(get_patcher.stop)
+        post_patcher = patch("requests.post")
+        requests.post = post_patcher.start()
+        self.addCleanup(post_patcher.stop)
+
+        def get(url):
+            if "/projects" in url:
+                return resp(projects)
+            if "/activities" in url:
+                return resp([{"uuid": "2", "slug": "docs"},
+                             {"uuid": "3", "slug": "dev"}])
+            return resp([{"username": "userone"}])
+
+        requests.get.side_effect = get
+        requests.post.return_value = resp({"uuid": "4"})
+
+        ts.create_time(self.time)
+        projects.append({"uuid": "5", "slugs": ["new"]})
+        self.assertEquals(ts.create_time(dict(self.time, project="new")),
+                          {"uuid": "4"})
+        self.assertEquals(requests.post.call_count, 2)
+
+        requests.get.side_effect = lambda url: resp(
+            {"error": "Server error"}, 500)
+        self.assertEquals(ts.create_time(dict(self.time, project="gone")),
+                          {"uuid": "4"})
+
+    def test_recheck_cached(self):
+        """Tests that the recheck fetches from TimeSync, not the read
+        cache, so names created elsewhere are accepted"""
+        ts = pymesync.TimeSync("http://ts.example.com/v1", token="TOKEN")
+        ts.enable_cache(ttl=60)
+        ts.enable_reference_validation(recheck=0)
+        projects = [{"uuid": "1", "slugs": ["ps"]}]
+        get_patcher = patch("requests.get")
+        requests.get = get_patcher.start()
+        self.addCleanup(get_patcher.stop)
+        post_patcher = patch("requests.post")
+        requests.post = post_patcher.start()
+        self.addCleanup(post_patcher.stop)
+
+        def get(url):
+            if "/projects" in url:
+                return resp(projects)
+            if "/activities" in url:
+                return resp([{"uuid": "2", "slug": "docs"},
+                             {"uuid": "3", "slug": "dev"}])
+            return resp([{"username": "userone"}])
+
+        requests.get.side_effect = get
+        requests.post.return_value = resp({"uuid": "4"})
+
+        ts.get_projects()
+        ts.create_time(self.time)
+        projects.append({"uuid": "5", "slugs": ["new"]})
+        self.assertEquals(ts.create_time(dict(self.time, project="new")),
+                          {"uuid": "4"})
+        self.assertEquals(requests.post.call_count, 2)
+        self.assertEquals(len(ts.get_projects()), 2)
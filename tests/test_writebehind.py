@@ -0,0 +1,253 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import requests
+import pymesync
+from pymesync import writebehind
+from helpers import resp
+
+try:
+    from unittest.mock import patch
+except:
+    from mock import patch
+
+
+class TestWriteBehindQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "journal")
+        self.sent = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def submit(self, operation, obj, identifier):
+        self.sent.append((operation, obj, identifier))
+        return {"ok": True}
+
+    def test_enqueue_and_flush(self):
+        """Tests that queued submissions are sent in order"""
+        queue = writebehind.WriteBehindQueue(self.submit, self.path)
+        queue.enqueue("create_time", {"n": 1})
+        queue.enqueue("update_time", {"n": 2}, "uuid")
+        self.assertTrue(queue.flush(5))
+        self.assertEquals(self.sent, [("create_time", {"n": 1}, None),
+                                      ("update_time", {"n": 2}, "uuid")])
+        metrics = queue.metrics()
+        self.assertEquals(metrics["depth"], 0)
+        self.assertEquals(metrics["submitted"], 2)
+        self.assertTrue(metrics["drain_rate"] > 0)
+        queue.close()
+
+    def test_recovers_unsent(self):
+        """Tests that submissions without a done record are sent again"""
+        with io.open(self.path, "w", encoding="utf-8") as handle:
+            handle.write(u'{"id": 1, "op": "create_time", "object": {"n": 1},'
+                         u' "identifier": null}\n'
+                         u'{"id": 2, "op": "create_time", "object": {"n": 2},'
+                         u' "identifier": null}\n'
+                         u'{"id": 1, "done": true, "failed": false}\n'
+                         u'{"id": 3, "op": "crea')
+
+        queue = writebehind.WriteBehindQueue(self.submit, self.path)
+        self.assertTrue(queue.flush(5))
+        self.assertEquals(self.sent, [("create_time", {"n": 2}, None)])
+        self.assertEquals(queue.enqueue("create_time", {"n": 3}), 3)
+        queue.close()
+
+    def test_done_recorded_per_entry(self):
+        """Tests that each submission is recorded as done before the next
+        one in its batch is sent, and close() stops a blocked worker"""
+        release = threading.Event()
+        journal_at_second = []
+
+        def submit(operation, obj, identifier):
+            if obj["n"] == 2:
+                with io.open(self.path, encoding="utf-8") as handle:
+                    journal_at_second.append(handle.read())
+                release.wait(5)
+            self.sent.append(obj["n"])
+            return {"ok": True}
+
+        queue = writebehind.WriteBehindQueue(submit, self.path)
+        for n in range(1, 4):
+            queue.enqueue("create_time", {"n": n})
+        for _ in range(100):
+            if journal_at_second:
+                break
+            threading.Event().wait(0.01)
+        self.assertTrue('{"id": 1, "done": true' in journal_at_second[0])
+
+        # The flush times out while entry 2 is being sent; the worker stops
+        # after it instead of sending entry 3
+        threading.Timer(0.3, release.set).start()
+        queue.close(0.2)
+        self.assertEquals(self.sent, [1, 2])
+
+        sent = []
+        queue = writebehind.WriteBehindQueue(
+            lambda op, obj, identifier: sent.append(obj["n"]) or {}, self.path)
+        self.assertTrue(queue.flush(5))
+        self.assertEquals(sent, [3])
+        queue.close()
+
+    def test_retries_transient_errors(self):
+        """Tests that connection errors are retried and TimeSync client
+        errors and entries rejected locally are not"""
+        results = [{"pymesync error": requests.exceptions.ConnectionError()},
+                   {"error": "Bad object", "status": 400},
+                   {"pymesync error": "time object: invalid field: bad"}]
+
+        def submit(operation, obj, identifier):
+            return results.pop(0)
+
+        queue = writebehind.WriteBehindQueue(submit, self.path,
+                                             retry_delay=0)
+        queue.enqueue("create_time", {"n": 1})
+        queue.enqueue("create_time", {"n": 2})
+        self.assertTrue(queue.flush(5))
+        metrics = queue.metrics()
+        self.assertEquals((metrics["retried"], metrics["failed"]), (1, 2))
+        self.assertEquals(queue.failures()[0]["result"]["status"], 400)
+        queue.close()
+
+    def test_is_transient(self):
+        """Tests which errors are worth retrying"""
+        error = "pymesync error"
+        for result in [{error: requests.exceptions.Timeout()},
+                       {error: "circuit breaker open for http://ts/times"},
+                       {"error": "Server error"},
+                       {"error": "Server error", "status": 503}]:
+            self.assertTrue(writebehind.is_transient(result, error))
+        for result in [{"uuid": "1"}, {error: "time object: bad"},
+                       {"error": "Object not found", "status": 404}]:
+            self.assertFalse(writebehind.is_transient(result, error))
+
+    def test_outage_keeps_entries(self):
+        """Tests that the worker pauses on an entry that keeps failing
+        transiently instead of failing the queue, and leaves it queued"""
+        def submit(operation, obj, identifier):
+            self.sent.append(obj["n"])
+            raise requests.exceptions.ConnectionError("connection failed")
+
+        queue = writebehind.WriteBehindQueue(submit, self.path, retries=2,
+                                             retry_delay=0.01)
+        queue.enqueue("create_time", {"n": 1})
+        queue.enqueue("create_time", {"n": 2})
+        self.assertFalse(queue.flush(0.3))
+        metrics = queue.metrics()
+        self.assertTrue(metrics["paused"])
+        self.assertEquals((metrics["depth"], metrics["failed"]), (2, 0))
+        self.assertTrue(metrics["retried"] > 2)
+        self.assertEquals(set(self.sent), set([1]))
+        queue.close(0.1)
+        self.assertEquals(queue.failures(), [])
+
+        self.sent = []
+        queue = writebehind.WriteBehindQueue(self.submit, self.path)
+        self.assertTrue(queue.flush(5))
+        self.assertEquals([obj["n"] for op, obj, _ in self.sent], [1, 2])
+        queue.close()
+
+    def test_failures_kept(self):
+        """Tests that rejected submissions survive a restart until they are
+        cleared"""
+        def submit(operation, obj, identifier):
+            return {"error": "Bad object", "status": 400}
+
+        queue = writebehind.WriteBehindQueue(submit, self.path)
+        for n in range(3):
+            queue.enqueue("create_time", {"n": n})
+        self.assertTrue(queue.flush(5))
+        queue.close()
+
+        queue = writebehind.WriteBehindQueue(self.submit, self.path)
+        failures = queue.failures()
+        self.assertEquals([f["object"]["n"] for f in failures], [0, 1, 2])
+        self.assertEquals(failures[0]["result"]["status"], 400)
+        queue.clear_failures([failures[0]["id"]])
+        queue.close()
+
+        queue = writebehind.WriteBehindQueue(self.submit, self.path)
+        self.assertEquals(len(queue.failures()), 2)
+        queue.clear_failures()
+        self.assertEquals(queue.failures(), [])
+        queue.close()
+        queue = writebehind.WriteBehindQueue(self.submit, self.path)
+        self.assertEquals(queue.failures(), [])
+        self.assertEquals(self.sent, [])
+        queue.close()
+
+    def test_batches_done_records(self):
+        """Tests that a batch of submissions is recorded done in one write"""
+        release = threading.Event()
+
+        def submit(operation, obj, identifier):
+            release.wait(5)
+            return {"ok": True}
+
+        queue = writebehind.WriteBehindQueue(submit, self.path, batch_size=10)
+        for n in range(3):
+            queue.enqueue("create_time", {"n": n})
+        release.set()
+        self.assertTrue(queue.flush(5))
+        queue.close()
+
+        with io.open(self.path, encoding="utf-8") as handle:
+            records = [json.loads(line) for line in handle]
+        self.assertEquals(len([r for r in records if r.get("done")]), 3)
+
+
+class TestTimeSyncWriteBehind(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        baseurl = "http://ts.example.com/v1"
+        self.ts = pymesync.TimeSync(baseurl, test=True)
+        self.ts.authenticate("testuser", "testpassword", "password")
+        self.ts.enable_write_behind(os.path.join(self.tmp, "journal"))
+
+    def tearDown(self):
+        self.ts.enable_write_behind(None)
+        shutil.rmtree(self.tmp)
+        del(self.ts)
+
+    def test_create_time_queued(self):
+        """Tests that create_time returns immediately with a journal id"""
+        result = self.ts.create_time({"duration": "1h", "project": "gwm",
+                                      "user": "userone",
+                                      "date_worked": "2016-01-01"})
+        self.assertEquals(result, {"status": "queued", "id": 1})
+        self.assertTrue(self.ts.flush_write_behind(5))
+        self.assertEquals(self.ts.metrics()["write_behind"]["submitted"], 1)
+
+    def test_write_behind_failures(self):
+        """Tests that rejected entries are returned and can be cleared"""
+        ts = pymesync.TimeSync("http://ts.example.com/v1", token="TOKEN")
+        ts.enable_write_behind(os.path.join(self.tmp, "other"))
+        self.addCleanup(ts.enable_write_behind, None)
+        post_patcher = patch("requests.post")
+        requests.post = post_patcher.start()
+        self.addCleanup(post_patcher.stop)
+        requests.post.return_value = resp(
+            {"status": 400, "error": "Bad object"}, 400)
+
+        self.assertEquals(ts.write_behind_failures(), [])
+        ts.create_time({"duration": "1h", "project": "gwm",
+                        "user": "userone", "date_worked": "2016-01-01"})
+        self.assertTrue(ts.flush_write_behind(5))
+        failures = ts.write_behind_failures(clear=True)
+        self.assertEquals(failures[0]["op"], "create_time")
+        self.assertEquals(failures[0]["result"]["status"], 400)
+        self.assertEquals(ts.write_behind_failures(), [])
+
+    def test_invalid_time_not_queued(self):
+        """Tests that invalid times are rejected before being queued"""
+        self.assertEquals(self.ts.update_time({"bad": 1}, "uuid"),
+                          {self.ts.error: "time object: invalid field: bad"})
+        self.assertEquals(self.ts.metrics()["write_behind"]["depth"], 0)